@@ -1,11 +1,22 @@
 import streamlit as st
-from snowflake.snowpark.context import get_active_session
 from snowflake.snowpark.functions import col, lit, current_timestamp, sql_expr
 import snowflake.snowpark as snowpark # Required for types like DataFrame
 import pandas as pd
-from datetime import datetime
-import pypdfium2 as pdfium # Import pypdfium2
-import io
+import time
+from docai_invoice_qs_backend import backend_name, connect
+from docai_invoice_qs_details import InvoiceDetailLoader
+from docai_invoice_qs_discrepancies import fetch_discrepancy_breakdown, fetch_invoice_discrepancies, fetch_products_by_mismatch_type
+from docai_invoice_qs_documents import DocumentStore, stage_content_hash
+from docai_invoice_qs_gold import MAX_BULK_INVOICES, bulk_accept_docai, submit_review
+from docai_invoice_qs_instrument import InstrumentedSession, QueryLog
+from docai_invoice_qs_query_cache import QueryResultCache
+from docai_invoice_qs_queue import ALL_MISMATCH_TYPES, DEFAULT_PAGE_SIZE, QueuePage, fetch_queue_page, count_queue, fetch_mismatch_details, fetch_queue_invoice_ids
+from docai_invoice_qs_reconcile import MISMATCH_TYPES
+from docai_invoice_qs_render import FULL_SCALE, PREVIEW_SCALE, PageRenderCache
+from docai_invoice_qs_summaries import SummaryCacheStats, get_summary
+from docai_invoice_qs_templates import TEMPLATE_STATS, check_result_cache, compiled_count, template
+from docai_invoice_qs_timing import timed_section
+from docai_invoice_qs_upload import upload_batch, split_extracted_documents, record_duplicates, content_hash
 
 st.set_page_config(layout="wide") # Use wider layout for tables
 
@@ -16,6 +27,7 @@ STAGE_NAME = "DOC_AI_STAGE"
 
 RECONCILE_ITEMS_TABLE = f"{DB_NAME}.{SCHEMA_NAME}.RECONCILE_RESULTS_ITEMS"
 RECONCILE_TOTALS_TABLE = f"{DB_NAME}.{SCHEMA_NAME}.RECONCILE_RESULTS_TOTALS"
+RECONCILE_DISCREPANCIES_TABLE = f"{DB_NAME}.{SCHEMA_NAME}.RECONCILE_DISCREPANCIES"
 BRONZE_TRANSACT_ITEMS_TABLE = f"{DB_NAME}.{SCHEMA_NAME}.TRANSACT_ITEMS"
 BRONZE_TRANSACT_TOTALS_TABLE = f"{DB_NAME}.{SCHEMA_NAME}.TRANSACT_TOTALS"
 BRONZE_DOCAI_ITEMS_TABLE = f"{DB_NAME}.{SCHEMA_NAME}.DOCAI_INVOICE_ITEMS"
@@ -24,15 +36,32 @@ BRONZE_DOCAI_TOTALS_TABLE = f"{DB_NAME}.{SCHEMA_NAME}.DOCAI_INVOICE_TOTALS"
 GOLD_ITEMS_TABLE = f"{DB_NAME}.{SCHEMA_NAME}.GOLD_INVOICE_ITEMS"
 GOLD_TOTALS_TABLE = f"{DB_NAME}.{SCHEMA_NAME}.GOLD_INVOICE_TOTALS"
 
+METRICS_DAILY_TABLE = f"{DB_NAME}.{SCHEMA_NAME}.RECONCILE_METRICS_DAILY"
+METRICS_INVOICES_TABLE = f"{DB_NAME}.{SCHEMA_NAME}.RECONCILE_METRICS_INVOICES"
+MISMATCH_SUMMARIES_TABLE = f"{DB_NAME}.{SCHEMA_NAME}.MISMATCH_SUMMARIES"
+
+DOCUMENT_HASHES_TABLE = f"{DB_NAME}.{SCHEMA_NAME}.DOCAI_DOCUMENT_HASHES"
+PIPELINE_RUN_HISTORY_TABLE = f"{DB_NAME}.{SCHEMA_NAME}.PIPELINE_RUN_HISTORY"
+
 if 'processed_invoice_id' not in st.session_state:
     st.session_state.processed_invoice_id = None
 if 'cached_mismatch_summary' not in st.session_state:
     st.session_state.cached_mismatch_summary = None
+if 'uploaded_hashes' not in st.session_state:
+    st.session_state.uploaded_hashes = set() # Content already handled by this session's uploader
+
+@st.cache_resource
+def get_query_log():
+    """Query, stage transfer and page render diagnostics, shared by all sessions."""
+    return QueryLog()
 
 # --- Get Snowflake Session ---
 try:
-    session = get_active_session()
-    st.success("❄️ Snowflake session established!")
+    session = InstrumentedSession(connect(), get_query_log()) # Records every query for the diagnostics panel
+    if backend_name() == "local":
+        st.success("🗄️ Local SQLite backend loaded (no Snowflake connection)!")
+    else:
+        st.success("❄️ Snowflake session established!")
     CURRENT_USER = session.get_current_role().replace("\"", "")
 except Exception as e:
     st.error(f"Error getting Snowflake session: {e}")
@@ -44,51 +73,86 @@ with st.sidebar:
     uploaded = st.file_uploader("PDF / Image", type=["pdf", "jpg", "jpeg", "png"], accept_multiple_files=True)
     st.divider()
     placeholder = st.empty()
-if uploaded:
-    for uploaded_file in uploaded:
-        placeholder.empty()
-        file_bytes = uploaded_file.read()
-        file_name  = uploaded_file.name
-        
-        # Stage file & presigned URL
-        session.file.put_stream(io.BytesIO(file_bytes), f"@{DB_NAME}.{SCHEMA_NAME}.{STAGE_NAME}/{file_name}", overwrite=True, auto_compress=False)
-        presigned_url = session.sql(
-            f"SELECT GET_PRESIGNED_URL('@{DB_NAME}.{SCHEMA_NAME}.{STAGE_NAME}', '{file_name}', 360) AS URL"
-        ).to_pandas().at[0, "URL"]
-        session.sql(f"ALTER STAGE {DB_NAME}.{SCHEMA_NAME}.{STAGE_NAME} REFRESH").collect()
+# The uploader keeps its files across reruns, so only handle content not seen yet this session
+pending_uploads = [
+    (uploaded_file.name, uploaded_file.getvalue()) for uploaded_file in (uploaded or [])
+    if content_hash(uploaded_file.getvalue()) not in st.session_state.uploaded_hashes
+]
+if pending_uploads:
+    placeholder.empty()
+    # Skip byte-identical documents that DocAI has already extracted (no PUT, no PREDICT)
+    new_files, duplicate_files = split_extracted_documents(session, DOCUMENT_HASHES_TABLE, pending_uploads)
+    record_duplicates(session, DOCUMENT_HASHES_TABLE, duplicate_files)
+    st.session_state.uploaded_hashes.update(digest for _, digest in duplicate_files)
+
+    if new_files:
+        with st.sidebar:
+            upload_progress = st.progress(0.0, text=f"Uploading {len(new_files)} file(s)...")
+
+        def show_upload_progress(done, total, result):
+            status = "✅" if result.ok else "❌"
+            upload_progress.progress(done / total, text=f"{status} {result.file_name} ({done}/{total})")
+
+        # Stage all files concurrently, then refresh the stage directory once for the batch
+        upload_summary = upload_batch(
+            session,
+            f"{DB_NAME}.{SCHEMA_NAME}.{STAGE_NAME}",
+            new_files,
+            on_progress=show_upload_progress,
+        )
+        uploaded_names = {result.file_name for result in upload_summary.uploaded}
+        st.session_state.uploaded_hashes.update(content_hash(data) for name, data in new_files if name in uploaded_names)
         with st.sidebar:
-            placeholder.write("Upload successful!")
+            placeholder.write(
+                f"Uploaded {len(upload_summary.uploaded)}/{len(upload_summary.results)} file(s) in {upload_summary.seconds:.1f}s "
+                f"({upload_summary.files_per_second:.1f} files/s, {upload_summary.mb_per_second:.2f} MB/s)"
+            )
+            for failed in upload_summary.failed:
+                st.error(f"Failed to upload {failed.file_name} after {failed.attempts} attempts: {failed.error}")
+    if duplicate_files:
+        with st.sidebar:
+            st.info(f"Skipped {len(duplicate_files)} already-extracted file(s) ({len(duplicate_files)} PREDICT calls avoided).")
     
     
 # --- PDF Display Functions ---
 
-def display_pdf_page():
-    """Renders and displays the current PDF page."""
-    if 'pdf_doc' not in st.session_state or st.session_state['pdf_doc'] is None:
+@st.cache_resource
+def get_document_store():
+    """Opened PDFs shared by all sessions, keyed by (stage path, content hash)."""
+    return DocumentStore()
+
+@st.cache_resource
+def get_page_render_cache():
+    """Rendered pages shared by all sessions, keyed by (document hash, page, scale)."""
+    return PageRenderCache(on_render=get_query_log().add_render)
+
+def display_pdf_page(document):
+    """Renders and displays the current page of a StoredDocument."""
+    if document is None:
         st.warning("No PDF document loaded.")
         return
     if 'pdf_page' not in st.session_state:
          st.session_state['pdf_page'] = 0 # Initialize if missing
 
-    pdf = st.session_state['pdf_doc']
+    pdf = document.pdf
     page_index = st.session_state['pdf_page']
-    num_pages = len(pdf)
+    num_pages = document.page_count
 
     if not 0 <= page_index < num_pages:
         st.error(f"Invalid page index: {page_index}. Must be between 0 and {num_pages-1}.")
         st.session_state['pdf_page'] = 0 # Reset to first page
         page_index = 0
 
-    page = pdf[page_index]
-
+    page_cache = get_page_render_cache()
+    doc_hash = document.content_hash
     try:
-        # Rendering parameters - adjust scale for performance/quality trade-off
-        bitmap = page.render(
-                        scale = 2, # Reduced scale from 8 for potentially better performance
-                        rotation = 0,
-                )
-        pil_image = bitmap.to_pil()
-        st.image(pil_image, use_container_width='always') # Display the rendered page image
+        image_slot = st.empty()
+        if page_cache.cached(doc_hash, page_index, FULL_SCALE) is None:
+            # Low-resolution preview first, swapped for the full render once it is ready
+            page_cache.submit(pdf, doc_hash, page_index, FULL_SCALE)
+            image_slot.image(page_cache.get(pdf, doc_hash, page_index, PREVIEW_SCALE), use_container_width='always')
+        image_slot.image(page_cache.get(pdf, doc_hash, page_index, FULL_SCALE), use_container_width='always') # Display the rendered page image
+        page_cache.prefetch(pdf, doc_hash, page_index, num_pages)
     except Exception as e:
         st.error(f"Error rendering PDF page {page_index + 1}: {e}")
 
@@ -100,113 +164,98 @@ def previous_pdf_page():
 def next_pdf_page():
     """Navigates to the next PDF page."""
     if ('pdf_page' in st.session_state and
-        'pdf_doc' in st.session_state and
-        st.session_state['pdf_doc'] is not None and
-        st.session_state['pdf_page'] < len(st.session_state['pdf_doc']) - 1):
+        st.session_state.get('pdf_page_count') and
+        st.session_state['pdf_page'] < st.session_state['pdf_page_count'] - 1):
         st.session_state['pdf_page'] += 1
 
-def summarize_mismatch_details(active_session, reconcile_items_details_df, reconcile_totals_details_df, selected_invoice_id):
+@st.cache_resource
+def get_summary_cache_stats():
+    """Hit/miss counters for the mismatch summary cache, shared by all sessions."""
+    return SummaryCacheStats()
+
+def summarize_mismatch_details(active_session, item_mismatch_details, total_mismatch_details, selected_invoice_id):
     """
-    Summarizes item mismatch details from two DataFrames for a selected invoice ID
-    using Snowflake Cortex.
+    Summarizes item and total mismatch details for a selected invoice ID
+    using Snowflake Cortex, via the MISMATCH_SUMMARIES cache.
     """
     try:
         session = active_session # Get active Snowpark session
 
-        # Filter DataFrames for the selected invoice ID
-        try:
-            item_mismatch_details = reconcile_items_details_df["ITEM_MISMATCH_DETAILS"][reconcile_items_details_df["INVOICE_ID"] == selected_invoice_id].iloc[0]
-        except: 
-            item_mismatch_details = ""
-        try:
-            total_mismatch_details = reconcile_totals_details_df["ITEM_MISMATCH_DETAILS"][reconcile_totals_details_df["INVOICE_ID"] == selected_invoice_id].iloc[0]
-        except: 
-            total_mismatch_details = ""
-
         all_mismatch_details = item_mismatch_details + total_mismatch_details
 
         if not all_mismatch_details:
             return f"No item mismatch details found for Invoice ID: {selected_invoice_id}."
 
 
-        # Construct the prompt for Snowflake Cortex
-        prompt = f"""
-        Based on the following item mismatch details for invoice {selected_invoice_id}, please provide a concise summary of the differences.
-        Focus on the types of mismatches and affected items or amounts, do not use the words expected or actual.
-
-        Mismatch Details:
-        ---
-        {all_mismatch_details}
-        ---
-        """
-
-        # Call Cortex complete function
-        # You might need to adjust the model name based on availability and your needs.
+        # Summaries are pre-generated after each reconciliation run; only a miss calls Cortex
         try:
-            response_df = session.sql(f"SELECT SNOWFLAKE.CORTEX.COMPLETE('llama3.1-70b', '{prompt}') as summary").collect()
-            summary = response_df[0]["SUMMARY"] if response_df else "Could not retrieve summary."
+            summary = get_summary(session, MISMATCH_SUMMARIES_TABLE, selected_invoice_id, item_mismatch_details, total_mismatch_details, get_summary_cache_stats())
         except Exception as e:
             return f"Error calling Snowflake Cortex: {e}"
 
-
-        return summary
+        return summary or "Could not retrieve summary."
 
     except Exception as e:
         st.error(f"An error occurred: {e}")
         return f"Failed to generate summary due to an error: {str(e)}"
         
-def get_invoice_reconciliation_metrics(session: session) -> dict | None:
+# Metrics are maintained incrementally by SP_REFRESH_RECONCILE_METRICS (RECONCILE_FINALIZE task and
+# manual submissions), so the app only sums the small per-day rollup.
+@template("metrics_totals")
+def metrics_totals_sql(metrics_table):
+    return f"""
+    SELECT
+        SUM(invoice_count) AS total_invoice_count,
+        SUM(total_amount) AS grand_total_amount,
+        SUM(reconciled_invoice_count) AS reconciled_invoice_count,
+        SUM(auto_reconciled_invoice_count) AS auto_reconciled_invoice_count,
+        SUM(reconciled_amount) AS total_reconciled_amount,
+        SUM(pending_invoice_count) AS pending_invoice_count,
+        SUM(pending_amount) AS pending_amount
+    FROM {metrics_table}
+    """
 
-    # Define the database and schema for clarity
-    db_name = "doc_ai_qs_db"
-    schema_name = "doc_ai_schema"
-    transact_table = f"{db_name}.{schema_name}.TRANSACT_TOTALS"
-    gold_totals_table = f"{db_name}.{schema_name}.GOLD_INVOICE_TOTALS"
-    gold_items_table = f"{db_name}.{schema_name}.GOLD_INVOICE_ITEMS"
+@template("metrics_daily")
+def metrics_daily_sql(metrics_table):
+    return f"SELECT * FROM {metrics_table} ORDER BY invoice_date DESC"
+
+@template("check_metrics")
+def check_metrics_sql():
+    return f"CALL {DB_NAME}.{SCHEMA_NAME}.SP_CHECK_RECONCILE_METRICS()"
+
+# One PIPELINE row per run of the extraction/reconciliation task graph, newest first
+@template("pipeline_runs")
+def pipeline_runs_sql(history_table):
+    return f"""
+    SELECT started_timestamp, duration_ms AS processing_ms, upload_to_queue_ms, trigger_wait_ms, invoice_count, status_message, run_group_id
+    FROM {history_table}
+    WHERE stage = 'PIPELINE'
+    ORDER BY started_timestamp DESC
+    LIMIT ?
+    """
 
-    # Construct the single SQL query using Common Table Expressions (CTEs) for clarity
-    # and conditional aggregation.
-    sql_query = f"""
-    SELECT
-        -- 1) Extract unique invoice count and total sum from TRANSACT_TOTALS
-        COUNT(DISTINCT tt.invoice_id) AS total_invoice_count,
-        SUM(tt.total) AS grand_total_amount,
-
-        -- 2 & 3) Determine presence in both GOLD tables and aggregate conditionally
-        COUNT(DISTINCT CASE
-                        WHEN EXISTS (SELECT 1 FROM {gold_totals_table} git WHERE git.invoice_id = tt.invoice_id)
-                         AND EXISTS (SELECT 1 FROM {gold_items_table} gii WHERE gii.invoice_id = tt.invoice_id)
-                        THEN tt.invoice_id -- Count distinct reconciled invoice IDs
-                        ELSE NULL
-                    END) AS reconciled_invoice_count,
-        --  Determine presence in both GOLD tables and aggregate conditionally for AUTO-RECONCILED
-        COUNT(DISTINCT CASE
-                        WHEN EXISTS (SELECT 1 FROM {gold_totals_table} git WHERE git.invoice_id = tt.invoice_id AND git.reviewed_by = 'Auto-reconciled')
-                         AND EXISTS (SELECT 1 FROM {gold_items_table} gii WHERE gii.invoice_id = tt.invoice_id AND gii.reviewed_by = 'Auto-reconciled')
-                        THEN tt.invoice_id -- Count distinct auto-reconciled invoice IDs
-                        ELSE NULL
-                    END) AS auto_reconciled_invoice_count,
-        SUM(CASE
-                WHEN EXISTS (SELECT 1 FROM {gold_totals_table} git WHERE git.invoice_id = tt.invoice_id)
-                 AND EXISTS (SELECT 1 FROM {gold_items_table} gii WHERE gii.invoice_id = tt.invoice_id)
-                THEN tt.total -- Sum total only if reconciled
-                ELSE 0 -- Contribute 0 to the sum if not reconciled
-            END) AS total_reconciled_amount,
-        
-    FROM
-        {transact_table} AS tt;
+@template("pipeline_stages")
+def pipeline_stages_sql(history_table):
+    return f"""
+    SELECT stage, started_timestamp, completed_timestamp, duration_ms, invoice_count, status_message
+    FROM {history_table}
+    WHERE run_group_id = ? AND stage <> 'PIPELINE'
+    ORDER BY started_timestamp, stage
     """
 
+def get_invoice_reconciliation_metrics(session: session) -> dict | None:
+    sql_query = metrics_totals_sql(METRICS_DAILY_TABLE)
+
     try:
         st.write("Executing Reconciliation Query:")
-        # st.code(sql_query, language='sql')
+        # st.code(sql_query.text, language='sql')
 
         # Execute the query using the provided session object
         # .collect() fetches all results (in this case, just one row)
-        result = session.sql(sql_query).collect()
+        result = sql_query.collect(session)
 
         if not result:
-            st.warning(f"No data found in the source table: {transact_table}")
+            st.warning(f"No data found in the metrics table: {METRICS_DAILY_TABLE}")
             return None
 
         # result is a list containing one Snowpark Row object
@@ -218,6 +267,8 @@ def get_invoice_reconciliation_metrics(session: session) -> dict | None:
         reconciled_invoices = row['RECONCILED_INVOICE_COUNT']
         total_reconciled = row['TOTAL_RECONCILED_AMOUNT']
         count_auto_reconciled = row['AUTO_RECONCILED_INVOICE_COUNT']
+        pending_invoices = row['PENDING_INVOICE_COUNT'] or 0
+        pending_amount = row['PENDING_AMOUNT'] or 0.0
 
         # Handle potential None values if SUM results in NULL (e.g., empty table)
         # Although COUNT should return 0, SUM might return NULL.
@@ -239,7 +290,9 @@ def get_invoice_reconciliation_metrics(session: session) -> dict | None:
             'total_reconciled_amount': float(total_reconciled),
             'reconciled_invoice_ratio': float(reconciled_invoice_ratio),
             'reconciled_amount_ratio': float(reconciled_amount_ratio),
-            'count_auto_reconciled': int(count_auto_reconciled)
+            'count_auto_reconciled': int(count_auto_reconciled),
+            'pending_invoice_count': int(pending_invoices),
+            'pending_amount': float(pending_amount)
         }
         return metrics
 
@@ -247,137 +300,310 @@ def get_invoice_reconciliation_metrics(session: session) -> dict | None:
         st.error(f"Snowflake SQL Error during reconciliation: {e}")
         return None
 
+def get_daily_reconciliation_metrics(session: session) -> pd.DataFrame:
+    """Per-invoice-date breakdown straight from the precomputed rollup."""
+    try:
+        return metrics_daily_sql(METRICS_DAILY_TABLE).to_pandas(session)
+    except Exception as e:
+        st.error(f"Error loading daily reconciliation metrics: {e}")
+        return pd.DataFrame()
 
 
 # --- Helper Functions ---
-@st.cache_data(ttl=600) # Cache data for 10 minutes
-def load_reconcile_data(status_filter='Pending Review'):
-    """Loads data from reconciliation tables, optionally filtering by review_status."""
+@st.cache_resource
+def get_query_cache(_session):
+    """Query results shared by all sessions, valid until the tables they read change."""
+    return QueryResultCache(_session)
+
+query_cache = get_query_cache(session)
+RECONCILE_TABLES = [RECONCILE_ITEMS_TABLE, RECONCILE_TOTALS_TABLE, RECONCILE_DISCREPANCIES_TABLE]
+
+def load_reconciliation_metrics():
+    """Headline metrics from the daily rollup (cached until RECONCILE_METRICS_DAILY changes)."""
+    metrics = query_cache.get(("metrics",), [METRICS_DAILY_TABLE], lambda: get_invoice_reconciliation_metrics(session), tags=["metrics"])
+    if metrics is None:
+        query_cache.invalidate(["metrics"]) # Do not keep a failed load
+    return metrics
+
+def queue_status_tag(status_filter):
+    return f"queue_status:{status_filter}"
+
+def load_reconcile_page(status_filter='Pending Review', invoice_prefix='', cursor=None, page_size=DEFAULT_PAGE_SIZE,
+                        mismatch_type=ALL_MISMATCH_TYPES):
+    """Loads one page of the review queue (projected columns only), optionally filtered by review_status, invoice_id prefix and mismatch type."""
     try:
-        # Use UNION ALL to get all invoice IDs needing review from both tables
-        # Select distinct invoice IDs to avoid duplicates if an invoice has issues in both items and totals
-        query = f"""
-        SELECT DISTINCT invoice_id, review_status, last_reconciled_timestamp
-        FROM {RECONCILE_ITEMS_TABLE}
-        WHERE review_status = '{status_filter}' OR '{status_filter}' = 'All'
-        UNION
-        SELECT DISTINCT invoice_id, review_status, last_reconciled_timestamp
-        FROM {RECONCILE_TOTALS_TABLE}
-        WHERE review_status = '{status_filter}' OR '{status_filter}' = 'All'
-        ORDER BY last_reconciled_timestamp DESC
-        """
-        reconcile_df = session.sql(query).to_pandas()
-
-        # Also load full details for display later if needed (optional here, load on demand below)
-        reconcile_items_full_df = session.table(RECONCILE_ITEMS_TABLE).filter(col("review_status") == status_filter).to_pandas() if status_filter != 'All' else session.table(RECONCILE_ITEMS_TABLE).to_pandas()
-        reconcile_totals_full_df = session.table(RECONCILE_TOTALS_TABLE).filter(col("review_status") == status_filter).to_pandas() if status_filter != 'All' else session.table(RECONCILE_TOTALS_TABLE).to_pandas()
-
-        return reconcile_df, reconcile_items_full_df, reconcile_totals_full_df
+        # Keyset pages only change when an invoice on them changes, so each page is tagged with its
+        # invoice ids; a review can also add its invoice to a Reviewed page, hence the status tag
+        page = query_cache.get(
+            ("queue_page", status_filter, invoice_prefix, mismatch_type, cursor, page_size), RECONCILE_TABLES,
+            lambda: fetch_queue_page(session, RECONCILE_ITEMS_TABLE, RECONCILE_TOTALS_TABLE, status_filter, invoice_prefix, cursor, page_size,
+                                     mismatch_type),
+            tags=[queue_status_tag(status_filter)], tag_fn=lambda loaded: loaded.invoice_ids,
+        )
+        queue_size = query_cache.get(
+            ("queue_count", status_filter, invoice_prefix, mismatch_type), RECONCILE_TABLES,
+            lambda: count_queue(session, RECONCILE_ITEMS_TABLE, RECONCILE_TOTALS_TABLE, status_filter, invoice_prefix, mismatch_type),
+            tags=["queue_counts"],
+        )
+        return page, queue_size
     except Exception as e:
         st.error(f"Error loading reconcile data: {e}")
-        return pd.DataFrame(), pd.DataFrame(), pd.DataFrame() # Return empty DataFrames on error
+        return QueuePage([], None), 0
+
+def load_mismatch_details(invoice_ids):
+    """Loads the (wide) mismatch detail strings for the given invoices only."""
+    try:
+        return query_cache.get(
+            ("mismatch_details", tuple(invoice_ids)), RECONCILE_TABLES,
+            lambda: fetch_mismatch_details(session, RECONCILE_ITEMS_TABLE, RECONCILE_TOTALS_TABLE, invoice_ids),
+            tags=invoice_ids,
+        )
+    except Exception as e:
+        st.error(f"Error loading mismatch details: {e}")
+        return {}
+
+@st.cache_resource
+def get_invoice_detail_loader(_session):
+    """One detail cache per app process, shared by all reviewer sessions and reloaded when a bronze table changes."""
+    return InvoiceDetailLoader(_session, {
+        'transact_items': BRONZE_TRANSACT_ITEMS_TABLE,
+        'transact_totals': BRONZE_TRANSACT_TOTALS_TABLE,
+        'docai_items': BRONZE_DOCAI_ITEMS_TABLE,
+        'docai_totals': BRONZE_DOCAI_TOTALS_TABLE,
+    }, versions=query_cache.versions)
+
+invoice_detail_loader = get_invoice_detail_loader(session)
+PREFETCH_AHEAD = 3 # Invoices further down the review queue to load in the background
 
 def load_bronze_data(invoice_id):
-    """Loads data from all relevant bronze tables for a specific invoice_id."""
-    bronze_data = {}
+    """Loads data from all relevant bronze tables for a specific invoice_id (cached, fetched concurrently)."""
     try:
         if invoice_id:
-            # Use .filter().to_pandas() for smaller datasets typical for one invoice
-            bronze_data['transact_items'] = session.table(BRONZE_TRANSACT_ITEMS_TABLE).filter(col("invoice_id") == invoice_id).to_pandas()
-            bronze_data['transact_totals'] = session.table(BRONZE_TRANSACT_TOTALS_TABLE).filter(col("invoice_id") == invoice_id).to_pandas()
-            bronze_data['docai_items'] = session.table(BRONZE_DOCAI_ITEMS_TABLE).filter(col("invoice_id") == invoice_id).to_pandas()
-            bronze_data['docai_totals'] = session.table(BRONZE_DOCAI_TOTALS_TABLE).filter(col("invoice_id") == invoice_id).to_pandas()
-        return bronze_data
+            return invoice_detail_loader.get(invoice_id)
+        return {}
     except Exception as e:
         st.error(f"Error loading Bronze data for invoice {invoice_id}: {e}")
         return {} # Return empty dict on error
 
+def section_timings():
+    """Timings of the sections run in this session's latest (full or fragment) rerun."""
+    if 'section_timings' not in st.session_state:
+        st.session_state.section_timings = {}
+    return st.session_state.section_timings
+
+def show_section_timing(section):
+    timing = section_timings().get(section)
+    if timing:
+        st.caption(timing.caption())
+
+def data_changed(invoice_ids, before):
+    """
+    Called after the app wrote reviews (`before` from query_cache.before_write()): drops the pages
+    showing those invoices, the Reviewed pages they move into, and the counts and metrics.
+    """
+    query_cache.record_write(invoice_ids, groups=[queue_status_tag("Reviewed"), "queue_counts", "metrics"], before=before)
+
 # --- Streamlit App UI ---
+# Each section below is a fragment: interacting with a widget only reruns the fragment that owns it.
+# Full reruns happen only when the selected invoice changes or data is written.
 st.title("🛒 Invoice Reconciliation")
 st.markdown(f"Connected as role: **{CURRENT_USER}**")
 
 # --- Section 0: Display Totals
-#run_reconciliation(session)
-with st.spinner("Loading reconciliation metrics..."):
-    reconciliation_data = get_invoice_reconciliation_metrics(session)
-
-# --- Display results ---
-if reconciliation_data:
-    st.success("Metrics displayed below (updated automatically).")
-    st.success(f"{reconciliation_data['count_auto_reconciled']} Invoices out of {reconciliation_data['total_invoice_count']} were fully Auto-Reconciled with DocAI")
-    st.subheader("Reconciliation Ratios")
-    col1, col2 = st.columns(2)
-    col1.metric(
-        label="Reconciled Invoices (Count Ratio)",
-        value=f"{reconciliation_data['reconciled_invoice_ratio']:.2%}",
-        help=f"Percentage of unique invoices from TRANSACT_TOTALS found in both GOLD tables. ({reconciliation_data['reconciled_invoice_count']}/{reconciliation_data['total_invoice_count']})"
-    )
-    col2.metric(
-        label="Reconciled Amount (Value Ratio)",
-        value=f"{reconciliation_data['reconciled_amount_ratio']:.2%}",
-        help=f"Percentage of total amount from TRANSACT_TOTALS that corresponds to reconciled invoices. (${reconciliation_data['total_reconciled_amount']:,.2f} / ${reconciliation_data['grand_total_amount']:,.2f})"
-    )
-
-    st.subheader("Detailed Numbers")
-    df_metrics = pd.DataFrame([
-         {"Metric": "Total Unique Invoices", "Value": reconciliation_data['total_invoice_count']},
-         {"Metric": "Fully Reconciled Invoices", "Value": reconciliation_data['reconciled_invoice_count']},
-         {"Metric": "Grand Total Amount ($)", "Value": f"{reconciliation_data['grand_total_amount']:,.2f}"},
-         {"Metric": "Total Reconciled Amount ($)", "Value": f"{reconciliation_data['total_reconciled_amount']:,.2f}"},
-    ]).set_index("Metric")
-    st.dataframe(df_metrics)
+@st.fragment
+def metrics_panel():
+    with timed_section(session, "Metrics", section_timings()):
+        # Served from the query cache until the rollup changes
+        if st.button("🔄 Refresh Metrics"):
+            query_cache.invalidate(["metrics"])
+        with st.spinner("Loading reconciliation metrics..."):
+            reconciliation_data = load_reconciliation_metrics()
+
+        # --- Display results ---
+        if reconciliation_data:
+            st.success("Metrics displayed below (updated automatically).")
+            st.success(f"{reconciliation_data['count_auto_reconciled']} Invoices out of {reconciliation_data['total_invoice_count']} were fully Auto-Reconciled with DocAI")
+            st.subheader("Reconciliation Ratios")
+            col1, col2 = st.columns(2)
+            col1.metric(
+                label="Reconciled Invoices (Count Ratio)",
+                value=f"{reconciliation_data['reconciled_invoice_ratio']:.2%}",
+                help=f"Percentage of unique invoices from TRANSACT_TOTALS found in both GOLD tables. ({reconciliation_data['reconciled_invoice_count']}/{reconciliation_data['total_invoice_count']})"
+            )
+            col2.metric(
+                label="Reconciled Amount (Value Ratio)",
+                value=f"{reconciliation_data['reconciled_amount_ratio']:.2%}",
+                help=f"Percentage of total amount from TRANSACT_TOTALS that corresponds to reconciled invoices. (${reconciliation_data['total_reconciled_amount']:,.2f} / ${reconciliation_data['grand_total_amount']:,.2f})"
+            )
+
+            st.subheader("Detailed Numbers")
+            df_metrics = pd.DataFrame([
+                 {"Metric": "Total Unique Invoices", "Value": reconciliation_data['total_invoice_count']},
+                 {"Metric": "Fully Reconciled Invoices", "Value": reconciliation_data['reconciled_invoice_count']},
+                 {"Metric": "Grand Total Amount ($)", "Value": f"{reconciliation_data['grand_total_amount']:,.2f}"},
+                 {"Metric": "Total Reconciled Amount ($)", "Value": f"{reconciliation_data['total_reconciled_amount']:,.2f}"},
+                 {"Metric": "Pending Invoices", "Value": reconciliation_data['pending_invoice_count']},
+                 {"Metric": "Pending Amount ($)", "Value": f"{reconciliation_data['pending_amount']:,.2f}"},
+            ]).set_index("Metric")
+            st.dataframe(df_metrics)
+
+            with st.expander("Show Daily Breakdown"):
+                if st.toggle("Load daily breakdown", key="load_daily_breakdown"):
+                    st.dataframe(
+                        query_cache.get(("metrics_daily",), [METRICS_DAILY_TABLE], lambda: get_daily_reconciliation_metrics(session), tags=["metrics"]),
+                        use_container_width=True,
+                    )
+            with st.expander("Show Discrepancies by Mismatch Type"):
+                if st.toggle("Load discrepancy breakdown", key="load_discrepancy_breakdown"):
+                    try:
+                        st.dataframe(
+                            query_cache.get(
+                                ("discrepancy_breakdown",), [RECONCILE_DISCREPANCIES_TABLE, METRICS_INVOICES_TABLE],
+                                lambda: fetch_discrepancy_breakdown(session, RECONCILE_DISCREPANCIES_TABLE, METRICS_INVOICES_TABLE),
+                                tags=["metrics"],
+                            ),
+                            use_container_width=True,
+                        )
+                        breakdown_type = st.selectbox("Products with mismatch type:", MISMATCH_TYPES, key="breakdown_mismatch_type")
+                        st.dataframe(
+                            query_cache.get(
+                                ("discrepancy_products", breakdown_type), [RECONCILE_DISCREPANCIES_TABLE],
+                                lambda: fetch_products_by_mismatch_type(session, RECONCILE_DISCREPANCIES_TABLE, breakdown_type),
+                                tags=["metrics"],
+                            ),
+                            use_container_width=True,
+                        )
+                    except Exception as e:
+                        st.error(f"Error loading discrepancy breakdown: {e}")
+                if st.button("Check Metrics Against Raw Tables"):
+                    st.info(check_metrics_sql().collect(session)[0][0])
 
-else:
-    # Error messages are now mostly handled within the cached function call
-    st.warning("Could not retrieve or calculate reconciliation metrics. Check logs above if any.")
+        else:
+            # Error messages are now mostly handled within the cached function call
+            st.warning("Could not retrieve or calculate reconciliation metrics. Check logs above if any.")
+    show_section_timing("Metrics")
 
 # --- Section 1: Display reconcile Tables & Select Invoice ---
-st.header("1. Invoices Awaiting Review")
-
-review_status_options = ['Pending Review', 'Reviewed', 'Auto-reconciled']
-selected_status = st.selectbox("Filter by Review Status:", review_status_options, index=0) # Default to 'Pending Review'
-
-# Load distinct invoice IDs based on filter
-invoices_to_review_df, reconcile_items_details_df, reconcile_totals_details_df = load_reconcile_data(selected_status)
-
-if not invoices_to_review_df.empty:
-    st.write(f"Found {len(invoices_to_review_df['INVOICE_ID'].unique())} unique invoices with totals or items status '{selected_status}'.")
-
-    # Allow user to select an invoice
-    invoice_list = [""] + invoices_to_review_df['INVOICE_ID'].unique().tolist() # Add blank option
-    selected_invoice_id = st.selectbox(
-        "Select Invoice ID to Review/Correct:",
-        invoice_list,
-        index=0, # Default to blank
-        key="invoice_selector"
-    )
-
-    # Display details from reconcile tables for context (optional)
-    with st.expander("Show Reconciliation Details for All Filtered Invoices"):
-         st.subheader("Item Reconciliation Details")
-         st.dataframe(reconcile_items_details_df, use_container_width=True)
-         st.subheader("Total Reconciliation Details")
-         st.dataframe(reconcile_totals_details_df, use_container_width=True)
-
-else:
-    st.info(f"No invoices found with status '{selected_status}'.")
-    selected_invoice_id = None # Ensure no invoice is selected if list is empty
+@st.fragment
+def review_queue():
+    with timed_section(session, "Review queue", section_timings()):
+        st.header("1. Invoices Awaiting Review")
+
+        review_status_options = ['Pending Review', 'Reviewed', 'Auto-reconciled']
+        filter_col1, filter_col2, filter_col3 = st.columns([1, 1, 1])
+        selected_status = filter_col1.selectbox("Filter by Review Status:", review_status_options, index=0) # Default to 'Pending Review'
+        invoice_prefix = filter_col2.text_input("Search Invoice ID (prefix):", key="invoice_prefix").strip()
+        mismatch_type = filter_col3.selectbox("Filter by Mismatch Type:", [ALL_MISMATCH_TYPES] + MISMATCH_TYPES, key="queue_mismatch_type")
+
+        # Keyset pagination: keep the cursor of every page visited so far; reset when the filters change
+        queue_filters = (selected_status, invoice_prefix, mismatch_type)
+        if st.session_state.get('queue_filters') != queue_filters:
+            st.session_state.queue_filters = queue_filters
+            st.session_state.queue_cursors = [None]
+        queue_cursors = st.session_state.queue_cursors
+
+        queue_page, queue_size = load_reconcile_page(selected_status, invoice_prefix, queue_cursors[-1], mismatch_type=mismatch_type)
+        st.session_state.queue_invoice_ids = queue_page.invoice_ids # Used by the detail section to prefetch
+
+        if queue_page.rows:
+            page_number = len(queue_cursors)
+            st.write(f"Found {queue_size} unique invoices with totals or items status '{selected_status}'. Page {page_number}.")
+
+            nav_prev, nav_next = st.columns(2)
+            if nav_prev.button("⬅️ Previous Page", disabled=page_number == 1, use_container_width=True):
+                queue_cursors.pop()
+                st.rerun(scope="fragment")
+            if nav_next.button("Next Page ➡️", disabled=queue_page.next_cursor is None, use_container_width=True):
+                queue_cursors.append(queue_page.next_cursor)
+                st.rerun(scope="fragment")
+
+            # Allow user to select an invoice
+            invoice_list = [""] + queue_page.invoice_ids # Add blank option
+            selected_invoice_id = st.selectbox(
+                "Select Invoice ID to Review/Correct:",
+                invoice_list,
+                index=0, # Default to blank
+                key="invoice_selector"
+            )
+
+            # Detail strings are only fetched on request, and only for this page
+            with st.expander("Show Reconciliation Details for Invoices on This Page"):
+                if st.toggle("Load details", key="load_page_details"):
+                    page_details = load_mismatch_details(queue_page.invoice_ids)
+                    st.dataframe(
+                        pd.DataFrame(
+                            [{"INVOICE_ID": invoice_id, "ITEM_MISMATCH_DETAILS": items, "TOTAL_MISMATCH_DETAILS": totals}
+                             for invoice_id, (items, totals) in page_details.items()]
+                        ),
+                        use_container_width=True,
+                    )
+
+            # Bulk review: promote DocAI values for the whole filtered queue inside the warehouse
+            if selected_status == 'Pending Review':
+                with st.expander("Bulk Accept DocAI Extracted Values"):
+                    bulk_skipped_ids = st.session_state.pop("bulk_skipped_ids", None)
+                    if bulk_skipped_ids:
+                        st.warning(f"{len(bulk_skipped_ids)} invoice(s) were skipped without DocAI items or totals and are still pending: "
+                                   + ", ".join(bulk_skipped_ids))
+                    bulk_count = min(queue_size, MAX_BULK_INVOICES)
+                    st.write(f"Accepts the DocAI values for the {bulk_count} newest invoice(s) matching the filters above"
+                             + (f" (limited to {MAX_BULK_INVOICES})." if queue_size > MAX_BULK_INVOICES else "."))
+                    bulk_notes = st.text_area("Bulk Review Notes:", key="bulk_review_notes")
+                    bulk_confirm = st.checkbox(f"I have checked that these {bulk_count} invoice(s) only differ by DocAI noise", key="bulk_confirm")
+                    if st.button("❄️ ✅ Accept DocAI Values for All Matching Invoices", disabled=not bulk_confirm):
+                        try:
+                            with st.spinner(f"Accepting {bulk_count} invoice(s)..."):
+                                bulk_ids = fetch_queue_invoice_ids(session, RECONCILE_ITEMS_TABLE, RECONCILE_TOTALS_TABLE,
+                                                                   selected_status, invoice_prefix, MAX_BULK_INVOICES, mismatch_type)
+                                before = query_cache.before_write()
+                                bulk_result = bulk_accept_docai(session, bulk_ids, CURRENT_USER, bulk_notes)
+                            # A toast outlives the rerun below; the skipped ids are shown after it
+                            st.toast(bulk_result.message, icon="✅" if bulk_result.accepted else "⚠️")
+                            st.session_state.bulk_skipped_ids = bulk_result.skipped_invoice_ids
+                            skipped = set(bulk_result.skipped_invoice_ids)
+                            accepted_ids = [bulk_id for bulk_id in bulk_ids if bulk_id not in skipped]
+                            for bulk_id in accepted_ids:
+                                invoice_detail_loader.invalidate(bulk_id)
+                            data_changed(accepted_ids, before)
+                            st.session_state.queue_cursors = [None]
+                            st.rerun()
+                        except Exception as e:
+                            st.error(f"An error occurred during bulk acceptance: {e}")
+
+        else:
+            st.info(f"No invoices found with status '{selected_status}'.")
+            selected_invoice_id = None # Ensure no invoice is selected if list is empty
+
+        # Only a change of invoice needs the sections below to rerun
+        selected_invoice_id = selected_invoice_id or None
+        if selected_invoice_id != st.session_state.get('selected_invoice_id'):
+            st.session_state.selected_invoice_id = selected_invoice_id
+            st.rerun()
+    show_section_timing("Review queue")
 
 # --- Section 2: Display Bronze Data for Selected Invoice ---
-st.header("2. Review and Correct Invoice Data")
+@st.fragment
+def invoice_detail(selected_invoice_id, bronze_data_dict):
+    with timed_section(session, "Invoice detail", section_timings()):
+        if selected_invoice_id != st.session_state.processed_invoice_id:
+            item_details, total_details = load_mismatch_details([selected_invoice_id]).get(selected_invoice_id, ("", ""))
+            mismatch_summary = summarize_mismatch_details(session, item_details, total_details, selected_invoice_id)
+            st.session_state.cached_mismatch_summary = mismatch_summary
+            st.session_state.processed_invoice_id = selected_invoice_id
+        if st.session_state.cached_mismatch_summary is not None:
+            st.subheader(f"{st.session_state.cached_mismatch_summary}")
+            summary_stats = get_summary_cache_stats()
+            st.caption(f"Summary cache: {summary_stats.hits} hits / {summary_stats.misses} misses ({summary_stats.hit_rate:.0%} hit rate)")
+        with st.expander("Show Discrepancy Rows"):
+            st.dataframe(
+                query_cache.get(
+                    ("invoice_discrepancies", selected_invoice_id), [RECONCILE_DISCREPANCIES_TABLE],
+                    lambda: fetch_invoice_discrepancies(session, RECONCILE_DISCREPANCIES_TABLE, selected_invoice_id),
+                    tags=[selected_invoice_id],
+                ),
+                use_container_width=True,
+            )
 
-if selected_invoice_id:
-    st.subheader(f"Displaying Data for Invoice: `{selected_invoice_id}`")
-    if selected_invoice_id != st.session_state.processed_invoice_id:
-        mismatch_summary = summarize_mismatch_details(session, reconcile_items_details_df, reconcile_totals_details_df, selected_invoice_id)
-        st.session_state.cached_mismatch_summary = mismatch_summary
-        st.session_state.processed_invoice_id = selected_invoice_id
-    if st.session_state.cached_mismatch_summary is not None:
-        st.subheader(f"{st.session_state.cached_mismatch_summary}")
-    # Load data from Bronze layer
-    bronze_data_dict = load_bronze_data(selected_invoice_id)
-
-    if bronze_data_dict:
         col1, col2 = st.columns(2)
 
         with col1:
@@ -387,11 +613,7 @@ if selected_invoice_id:
             # --- Editable Transact Items ---
             st.write("**Items (Original DB):**")
             if not bronze_data_dict['transact_items'].empty:
-                 # Convert relevant columns to numeric for proper editing if they aren't already
-                 for col_name in ['QUANTITY', 'UNIT_PRICE', 'TOTAL_PRICE']:
-                    if col_name in bronze_data_dict['transact_items'].columns:
-                        bronze_data_dict['transact_items'][col_name] = pd.to_numeric(bronze_data_dict['transact_items'][col_name], errors='coerce')
-
+                 # Already typed by the loader (docai_invoice_qs_schema): numbers are float64, dates python dates
                  edited_transact_items_df = st.data_editor(
                     bronze_data_dict['transact_items'],
                     key="editor_transact_items",
@@ -412,14 +634,6 @@ if selected_invoice_id:
                 # Ensure only one row and make it editable
                 transact_totals_edit_df = bronze_data_dict['transact_totals'].head(1).copy() # Take first row if multiple exist
 
-                # Convert relevant columns to numeric/date
-                for col_name in ['SUBTOTAL', 'TAX', 'TOTAL']:
-                     if col_name in transact_totals_edit_df.columns:
-                        transact_totals_edit_df[col_name] = pd.to_numeric(transact_totals_edit_df[col_name], errors='coerce')
-                if 'INVOICE_DATE' in transact_totals_edit_df.columns:
-                    transact_totals_edit_df['INVOICE_DATE'] = pd.to_datetime(transact_totals_edit_df['INVOICE_DATE'], errors='coerce').dt.date
-
-
                 edited_transact_totals_df = st.data_editor(
                     transact_totals_edit_df,
                     key="editor_transact_totals",
@@ -454,76 +668,83 @@ if selected_invoice_id:
             st.write("**Totals (DocAI):**")
             if not bronze_data_dict['docai_totals'].empty:
                 st.dataframe(bronze_data_dict['docai_totals'], use_container_width=True)
-                pdf_file_name = bronze_data_dict['docai_totals']['FILE_NAME'][0]
 
                 st.session_state.docai_totals = bronze_data_dict['docai_totals'] # Store docai data for docai reconcile button
             else:
                 st.info("No data found in DOCAI_INVOICE_TOTALS for this invoice.")
-                pdf_file_name = ""
+    show_section_timing("Invoice detail")
 
+@st.fragment
+def pdf_viewer(selected_invoice_id, pdf_file_name):
+    with timed_section(session, "PDF viewer", section_timings()):
         # Initialize session state keys for PDF viewer if they don't exist
         if 'pdf_page' not in st.session_state:
             st.session_state['pdf_page'] = 0
-        if 'pdf_doc' not in st.session_state:
-            st.session_state['pdf_doc'] = None
+        if 'pdf_hash' not in st.session_state:
+            st.session_state['pdf_hash'] = None
         if 'pdf_url' not in st.session_state:
             st.session_state['pdf_url'] = None
         with st.expander("Show Selected Invoice"):
 
             # --- PDF Display Logic ---
             if selected_invoice_id:
-                    
+
                 stage_path = f"@{DB_NAME}.{SCHEMA_NAME}.{STAGE_NAME}/{pdf_file_name}"
-    
-                # Check if we need to load a new PDF
-                if (st.session_state['pdf_url'] != stage_path):
-                    st.write(f"Loading PDF from: {stage_path}")
-                    try:
-                        pdf_stream = session.file.get_stream(stage_path, decompress=False)
-                        pdf_bytes = pdf_stream.read() # Read into memory first
-                        pdf_stream.close()
-                        st.session_state['pdf_doc'] = pdfium.PdfDocument(pdf_bytes) # Load from bytes
+                document_store = get_document_store()
+                document = None
+
+                try:
+                    if (st.session_state['pdf_url'] != stage_path):
+                        # New document for this session: the stage directory tells us which version to serve
+                        document = document_store.get(session, stage_path, stage_content_hash(session, f"{DB_NAME}.{SCHEMA_NAME}.{STAGE_NAME}", pdf_file_name))
                         st.session_state['pdf_url'] = stage_path
+                        st.session_state['pdf_hash'] = document.content_hash
+                        st.session_state['pdf_page_count'] = document.page_count
                         st.session_state['pdf_page'] = 0 # Reset to first page
                         st.success(f"Loaded '{pdf_file_name}'")
-                    except Exception as e:
-                        if pdf_file_name == "":
-                            st.warning(f"The file you're looking for may not have been uploaded yet!")
-                        else:
-                            st.warning(f"Failed to load or read PDF from '{stage_path}': {e}")
-                            st.session_state['pdf_doc'] = None # Ensure pdf_doc is None on failure
-                            st.session_state['pdf_url'] = None
-    
+                    else:
+                        # Shared store: only downloads again if the document was evicted
+                        document = document_store.get(session, stage_path, st.session_state['pdf_hash'])
+                except Exception as e:
+                    if pdf_file_name == "":
+                        st.warning(f"The file you're looking for may not have been uploaded yet!")
+                    else:
+                        st.warning(f"Failed to load or read PDF from '{stage_path}': {e}")
+                        st.session_state['pdf_url'] = None
+                        st.session_state['pdf_hash'] = None
+
                 # Display navigation and page if PDF is loaded
-                if st.session_state.get('pdf_doc') is not None:
+                if document is not None:
                     nav_col1, nav_col2, nav_col3 = st.columns([1,2,1]) # Adjusted column ratios
                     with nav_col1:
                         st.button("⏮️ Previous", on_click=previous_pdf_page, use_container_width=True)
                     with nav_col2:
-                        st.write(f"<div style='text-align: center;'>Page {st.session_state['pdf_page'] + 1} of {len(st.session_state['pdf_doc'])}</div>", unsafe_allow_html=True)
+                        st.write(f"<div style='text-align: center;'>Page {st.session_state['pdf_page'] + 1} of {document.page_count}</div>", unsafe_allow_html=True)
                     with nav_col3:
                         st.button("Next ⏭️", on_click=next_pdf_page, use_container_width=True)
-    
-                    display_pdf_page() # Call the function to render the page
+
+                    display_pdf_page(document) # Call the function to render the page
                 else:
                      st.info("Could not load document preview.")
-    
+
             else:
                 st.warning("No Invoice ID found for the selected row to retrieve the document.")
                 # Clear PDF state if nothing is selected
-                st.session_state['pdf_doc'] = None
                 st.session_state['pdf_url'] = None
+                st.session_state['pdf_hash'] = None
                 st.session_state['pdf_page'] = 0
+    show_section_timing("PDF viewer")
 
-
-        
-        # --- Section 3: Submit Corrections ---
+# --- Section 3: Submit Corrections ---
+@st.fragment
+def submission_form(selected_invoice_id):
+    with timed_section(session, "Submission", section_timings()):
         st.header("3. Submit Review and Corrections")
-        
+
         submit_docai_button = st.button("❄️ ✅ Accept DocAI Extracted Values for Reconciliation")
-        
+
         st.write("Or...")
-        
+
         # Add fields for notes and corrected invoice number (if applicable)
         review_notes = st.text_area("Manual Review Notes / Comments:", key="review_notes")
 
@@ -542,7 +763,7 @@ if selected_invoice_id:
                 else:
                     gold_items_df = st.session_state.docai_items[["INVOICE_ID", "PRODUCT_NAME", "QUANTITY", "UNIT_PRICE", "TOTAL_PRICE"]].copy()
                     gold_totals_df = st.session_state.docai_totals[["INVOICE_ID", "INVOICE_DATE", "SUBTOTAL", "TAX", "TOTAL"]].copy()
-                
+
             else:
                 if 'edited_transact_items' not in st.session_state or st.session_state.edited_transact_items.empty:
                     st.warning("No item data to submit.")
@@ -557,87 +778,107 @@ if selected_invoice_id:
             if valid:
                 try:
                     st.write("Submitting...")
-                    current_ts = datetime.now() # Use current time for reviewed_timestamp
-
-                # --- Prepare Data for Gold Layer ---
-                # Items
-                    # Ensure invoice_id is consistent if rows were added/modified
-                    gold_items_df['INVOICE_ID'] = selected_invoice_id
-                    gold_items_df['REVIEWED_BY'] = CURRENT_USER
-                    gold_items_df['REVIEWED_TIMESTAMP'] = current_ts
-                    gold_items_df['NOTES'] = review_notes # Add notes
-
-                     # Convert Pandas DataFrame to Snowpark DataFrame for writing
-                    snowpark_gold_items = session.create_dataframe(gold_items_df)
-                    # Convert column names to uppercase to match Snowflake default behavior if needed
-                    for col_name in snowpark_gold_items.columns:
-                         snowpark_gold_items = snowpark_gold_items.with_column_renamed(col_name, col_name.upper())
-
-                    # Write to Gold Items Table (Append Mode)
-                    st.write(f"Writing {len(snowpark_gold_items.collect())} rows to {GOLD_ITEMS_TABLE}...") 
-                    # Example: Delete existing before insert
-                    session.sql(f"DELETE FROM {GOLD_ITEMS_TABLE} WHERE INVOICE_ID = '{selected_invoice_id}'").collect()
-                    snowpark_gold_items.write.mode("append").save_as_table(GOLD_ITEMS_TABLE)
-                    st.success(f"Successfully saved corrected items to {GOLD_ITEMS_TABLE}")
-
-                # Totals
-                    gold_totals_df = st.session_state.edited_transact_totals.copy()
-                     # Ensure invoice_id is consistent
-                    gold_totals_df['INVOICE_ID'] = selected_invoice_id
-                    gold_totals_df['REVIEWED_BY'] = CURRENT_USER
-                    gold_totals_df['REVIEWED_TIMESTAMP'] = current_ts
-                    gold_totals_df['NOTES'] = review_notes
-
-                    # Convert Pandas DataFrame to Snowpark DataFrame for writing
-                    snowpark_gold_totals = session.create_dataframe(gold_totals_df)
-                    # Convert column names to uppercase
-                    for col_name in snowpark_gold_totals.columns:
-                         snowpark_gold_totals = snowpark_gold_totals.with_column_renamed(col_name, col_name.upper())
-
-                    # Write to Gold Totals Table (Append Mode - or Merge/Delete+Insert)
-                    st.write(f"Writing corrected totals to {GOLD_TOTALS_TABLE}...")
-                    # Example: Delete existing before insert (use with caution)
-                    session.sql(f"DELETE FROM {GOLD_TOTALS_TABLE} WHERE INVOICE_ID = '{selected_invoice_id}'").collect()
-                    snowpark_gold_totals.write.mode("append").save_as_table(GOLD_TOTALS_TABLE)
-                    st.success(f"Successfully saved corrected totals to {GOLD_TOTALS_TABLE}")
-
-                    # --- Update reconcile Tables Review Status ---
-                    st.write("Updating review status in reconcile tables...")
-                    update_query = f"""
-                    UPDATE {RECONCILE_ITEMS_TABLE}
-                    SET REVIEW_STATUS = 'Reviewed',
-                        REVIEWED_BY = '{CURRENT_USER}',
-                        REVIEWED_TIMESTAMP = '{current_ts.strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]}', -- Format for TIMESTAMP_NTZ
-                        NOTES = '{review_notes.replace("'", "''")}' -- Escape single quotes
-                    WHERE INVOICE_ID = '{selected_invoice_id}';
-                    """
-                    session.sql(update_query).collect() # Use collect() to execute the update
-
-                    update_query = f"""
-                    UPDATE {RECONCILE_TOTALS_TABLE}
-                    SET REVIEW_STATUS = 'Reviewed',
-                        REVIEWED_BY = '{CURRENT_USER}',
-                        REVIEWED_TIMESTAMP = '{current_ts.strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]}',
-                        NOTES = '{review_notes.replace("'", "''")}'
-                    WHERE INVOICE_ID = '{selected_invoice_id}';
-                    """
-                    session.sql(update_query).collect() # Use collect() to execute the update
-
-                    st.success(f"Successfully updated review status for invoice {selected_invoice_id} in reconcile tables.")
+                    # One CALL: gold items + totals replaced and reconcile status set in a single transaction
+                    before = query_cache.before_write()
+                    status = submit_review(session, selected_invoice_id, gold_items_df, gold_totals_df, CURRENT_USER, review_notes)
+                    st.success(status)
 
                     # --- Clear Cache and Rerun ---
-                    st.cache_data.clear() # Clear the cache to reflect updated reconcile status
+                    invoice_detail_loader.invalidate(selected_invoice_id)
+                    data_changed([selected_invoice_id], before)
 
                     st.info("Refreshing application...")
                     st.rerun() # Rerun the app to refresh the invoice list
 
                 except Exception as e:
                     st.error(f"An error occurred during submission: {e}")
+    show_section_timing("Submission")
+
+
+# --- Page layout (runs only on full reruns) ---
+rerun_start = time.perf_counter()
+st.session_state.section_timings = {}
+metrics_panel()
+review_queue()
+
+st.header("2. Review and Correct Invoice Data")
+selected_invoice_id = st.session_state.get('selected_invoice_id')
+
+if selected_invoice_id:
+    st.subheader(f"Displaying Data for Invoice: `{selected_invoice_id}`")
+    # Load data from Bronze layer, and warm the cache for the next invoices in the queue
+    with timed_section(session, "Bronze load", section_timings()):
+        bronze_data_dict = load_bronze_data(selected_invoice_id)
+        queue_ids = st.session_state.get('queue_invoice_ids', [])
+        if selected_invoice_id in queue_ids:
+            next_index = queue_ids.index(selected_invoice_id) + 1
+            invoice_detail_loader.prefetch(queue_ids[next_index:next_index + PREFETCH_AHEAD])
+
+    if bronze_data_dict:
+        invoice_detail(selected_invoice_id, bronze_data_dict)
+        docai_totals = bronze_data_dict['docai_totals']
+        pdf_file_name = docai_totals['FILE_NAME'][0] if not docai_totals.empty else ""
+        pdf_viewer(selected_invoice_id, pdf_file_name)
+        submission_form(selected_invoice_id)
 
     else:
         st.warning("Please select an invoice ID from the dropdown above.")
 
 else:
     # Only show this message if the list wasn't empty but nothing was selected
-    if not invoices_to_review_df.empty:
+    if st.session_state.get('queue_invoice_ids'):
         st.info("Select an Invoice ID from the dropdown in section 1 to proceed.")
+
+# --- Per-rerun timing readout (full reruns; fragment reruns show their own caption) ---
+with st.sidebar:
+    with st.expander("🗃️ Query Cache"):
+        st.json(query_cache.stats())
+    with st.expander("⏱️ Last Full Rerun"):
+        st.write(f"Total: {(time.perf_counter() - rerun_start) * 1000:.0f} ms")
+        st.dataframe(
+            pd.DataFrame([{"Section": t.section, "ms": round(t.seconds * 1000), "Queries": t.queries} for t in section_timings().values()]),
+            hide_index=True,
+            use_container_width=True,
+        )
+    with st.expander("🚚 Pipeline Runs"):
+        try:
+            pipeline_runs = query_cache.get(("pipeline_runs",), [PIPELINE_RUN_HISTORY_TABLE],
+                                            lambda: pipeline_runs_sql(PIPELINE_RUN_HISTORY_TABLE).to_pandas(session, [20]))
+            if pipeline_runs.empty:
+                st.write("No task graph runs recorded yet.")
+            else:
+                latest = pipeline_runs.iloc[0]
+                st.caption(f"Latest run: {latest['PROCESSING_MS']} ms processing"
+                           + (f", {latest['UPLOAD_TO_QUEUE_MS']} ms upload-to-queue" if pd.notna(latest['UPLOAD_TO_QUEUE_MS']) else ""))
+                st.dataframe(pipeline_runs, hide_index=True, use_container_width=True)
+                st.dataframe(
+                    query_cache.get(("pipeline_stages", latest['RUN_GROUP_ID']), [PIPELINE_RUN_HISTORY_TABLE],
+                                    lambda: pipeline_stages_sql(PIPELINE_RUN_HISTORY_TABLE).to_pandas(session, [latest['RUN_GROUP_ID']])),
+                    hide_index=True,
+                    use_container_width=True,
+                )
+        except Exception as e:
+            st.error(f"Error loading pipeline runs: {e}")
+    with st.expander("🩺 Query Diagnostics"):
+        query_log = get_query_log()
+        diagnostics = query_log.summary()
+        if diagnostics:
+            st.dataframe(pd.DataFrame(diagnostics).round({"total_ms": 1, "max_ms": 1}), hide_index=True, use_container_width=True)
+            st.caption("Slowest recent calls")
+            slowest = sorted(query_log.records(), key=lambda record: record.seconds, reverse=True)[:20]
+            st.dataframe(
+                pd.DataFrame([{"Kind": r.kind, "Call site": r.call_site, "ms": round(r.seconds * 1000, 1), "Rows": r.rows,
+                               "Bytes": r.bytes, "Query ID": ", ".join(r.query_ids), "Text": r.text, "Error": r.error} for r in slowest]),
+                hide_index=True,
+                use_container_width=True,
+            )
+        else:
+            st.write("No queries recorded yet.")
+        st.download_button("Export JSONL", query_log.to_jsonl(), file_name="query_diagnostics.jsonl", mime="application/jsonl")
+        st.caption(f"Query templates ({compiled_count()} compiled this process)")
+        if st.button("Check Result-Cache Reuse", help="Looks up repeated queries in QUERY_HISTORY_BY_SESSION"):
+            checked, hits = check_result_cache(session, DB_NAME)
+            st.info(f"{hits} of {checked} repeated queries since the last check were served from the result cache.")
+        template_stats = TEMPLATE_STATS.summary()
+        if template_stats:
+            st.dataframe(pd.DataFrame(template_stats), hide_index=True, use_container_width=True)
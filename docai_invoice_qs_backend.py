@@ -0,0 +1,52 @@
+"""
+Data-access backend selection for the app.
+
+All app data access (review queue, bronze details, metrics, gold writes, summaries and
+stage files) goes through a session object with the Snowpark session interface the data
+modules already use: sql(query, params).collect() / to_pandas() / to_arrow(), table(name)
+with filter/sort, write_pandas / write_arrow, file.put_stream / get_stream, query_history()
+and get_current_role().
+Two backends provide it:
+
+- `snowpark` (default): the active Snowflake session of Streamlit in Snowflake.
+- `local`: docai_invoice_qs_local.LocalSession over an embedded SQLite database created
+  from docai_invoice_qs_setup.sql / docai_invoice_qs_reconcile.sql, loaded with the seed
+  invoices (or synthetic data) and reconciled on start.
+
+Run the app locally with:
+    DOCAI_QS_BACKEND=local streamlit run docai_invoice_qs_app.py
+"""
+import os
+import threading
+
+BACKEND_ENV = "DOCAI_QS_BACKEND"
+LOCAL_ITEMS_ENV = "DOCAI_QS_LOCAL_ITEMS" # synthetic line items instead of the seed invoices
+LOCAL_DATABASE_ENV = "DOCAI_QS_LOCAL_DB" # SQLite file instead of an in-memory database
+BACKENDS = ("snowpark", "local")
+
+_local_session = None
+_local_lock = threading.Lock()
+
+
+def backend_name(name=None):
+    name = (name or os.environ.get(BACKEND_ENV) or "snowpark").lower()
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown backend {name!r}; {BACKEND_ENV} must be one of {', '.join(BACKENDS)}")
+    return name
+
+
+def connect(name=None):
+    """Session of the selected backend; the local backend's database is created once per process."""
+    global _local_session
+    if backend_name(name) == "snowpark":
+        from snowflake.snowpark.context import get_active_session
+
+        return get_active_session()
+
+    from docai_invoice_qs_local import open_local_session
+
+    with _local_lock:
+        if _local_session is None:
+            items = int(os.environ.get(LOCAL_ITEMS_ENV, 0)) or None
+            _local_session = open_local_session(os.environ.get(LOCAL_DATABASE_ENV, ":memory:"), items)
+        return _local_session
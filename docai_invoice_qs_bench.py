@@ -0,0 +1,603 @@
+"""
+Local benchmarks for the invoice reconciliation pipeline.
+
+Usage:
+    python docai_invoice_qs_bench.py extract [--lines 10 100 1000] [--repeat 5]
+    python docai_invoice_qs_bench.py upload [--files 300] [--workers 1 8 16] [--put-latency 0.05]
+    python docai_invoice_qs_bench.py render [--documents 'extraction_documents/Custom_Invoice_*.pdf'] [--scales 0.5 2]
+    python docai_invoice_qs_bench.py e2e [--items 10000 100000] [--sample 20] [--query-latency 0.0] [--database bench.db]
+    python docai_invoice_qs_bench.py preparse [--copies 1000] [--workers 1 2 4 8] [--batch-size 5000]
+    python docai_invoice_qs_bench.py layout [--items 100000] [--sample 50]
+    python docai_invoice_qs_bench.py layout --connection NAME --label before|after [--sample 50]
+    python docai_invoice_qs_bench.py arrow [--lines 1000 100000] [--queue 10000 1000000] [--repeat 3]
+
+Every benchmark prints one JSON object per line; `--output FILE` also appends them to FILE
+so runs can be compared over time.
+"""
+import argparse
+import glob
+import json
+import random
+import sys
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+import docai_invoice_qs_extract as extract
+import docai_invoice_qs_render as render
+import docai_invoice_qs_upload as upload
+from docai_invoice_qs_local import LocalFileOperation, LocalSession, LocalWarehouse
+from docai_invoice_qs_synth import PRODUCTS
+
+# Above this many lines the old n^4 plan is reported, not executed
+NAIVE_MAX_LINES = 30
+
+# Hot-path predicates of the app and the reconciliation procedures: (name, query, binds). The gold
+# DELETEs and review status UPDATEs are measured as SELECTs with the same predicate, which prune the
+# same micro-partitions without changing any data.
+_SCHEMA = "DOC_AI_QS_DB.DOC_AI_SCHEMA"
+LAYOUT_HOT_PATHS = [
+    ("bronze_transact_items", f"SELECT * FROM {_SCHEMA}.TRANSACT_ITEMS WHERE invoice_id = ?", ["invoice_id"]),
+    ("bronze_transact_totals", f"SELECT * FROM {_SCHEMA}.TRANSACT_TOTALS WHERE invoice_id = ?", ["invoice_id"]),
+    ("bronze_docai_items", f"SELECT * FROM {_SCHEMA}.DOCAI_INVOICE_ITEMS WHERE invoice_id = ?", ["invoice_id"]),
+    ("bronze_docai_totals", f"SELECT * FROM {_SCHEMA}.DOCAI_INVOICE_TOTALS WHERE invoice_id = ?", ["invoice_id"]),
+    ("gold_delete_items", f"SELECT COUNT(*) FROM {_SCHEMA}.GOLD_INVOICE_ITEMS WHERE invoice_id = ?", ["invoice_id"]),
+    ("gold_delete_totals", f"SELECT COUNT(*) FROM {_SCHEMA}.GOLD_INVOICE_TOTALS WHERE invoice_id = ?", ["invoice_id"]),
+    ("metrics_exists_probe", f"""
+        SELECT EXISTS (SELECT 1 FROM {_SCHEMA}.GOLD_INVOICE_TOTALS WHERE invoice_id = ?)
+           AND EXISTS (SELECT 1 FROM {_SCHEMA}.GOLD_INVOICE_ITEMS WHERE invoice_id = ?) AS is_reconciled
+    """, ["invoice_id", "invoice_id"]),
+    ("status_update_items", f"SELECT COUNT(*) FROM {_SCHEMA}.RECONCILE_RESULTS_ITEMS WHERE invoice_id = ?", ["invoice_id"]),
+    ("status_update_totals", f"SELECT COUNT(*) FROM {_SCHEMA}.RECONCILE_RESULTS_TOTALS WHERE invoice_id = ?", ["invoice_id"]),
+    ("ready_for_gold", f"""
+        SELECT COUNT(*) FROM {_SCHEMA}.RECONCILE_RESULTS_ITEMS
+        WHERE review_status = 'Auto-reconciled' AND last_reconciled_timestamp = ?
+    """, ["run_timestamp"]),
+    ("pending_queue", f"""
+        SELECT invoice_id, last_reconciled_timestamp FROM {_SCHEMA}.RECONCILE_RESULTS_ITEMS
+        WHERE review_status = 'Pending Review'
+        ORDER BY last_reconciled_timestamp DESC, invoice_id
+        LIMIT 50
+    """, []),
+]
+
+
+def make_predict_payload(invoice_id, line_count, seed=0):
+    """Builds a PREDICT-shaped JSON payload with `line_count` order lines."""
+    rng = random.Random(seed)
+    items, quantities, prices, totals = [], [], [], []
+    subtotal = 0.0
+    for _ in range(line_count):
+        qty = rng.randint(1, 5)
+        price = round(rng.uniform(1, 20), 2)
+        total = round(qty * price, 2)
+        subtotal += total
+        items.append({"score": 0.99, "value": rng.choice(PRODUCTS)})
+        quantities.append({"score": 0.99, "value": str(qty)})
+        prices.append({"score": 0.99, "value": f"${price:,.2f}"})
+        totals.append({"score": 0.99, "value": f"${total:,.2f}"})
+    tax = round(subtotal * 0.1, 2)
+    return {
+        "__documentMetadata": {"ocrScore": 0.99},
+        "order_info|Item": items,
+        "order_info|Quantity": quantities,
+        "order_info|Price": prices,
+        "order_info|Total": totals,
+        "total_info|Invoice ID": [{"score": 0.99, "value": f"#{invoice_id}"}],
+        "total_info|Date": [{"score": 0.99, "value": "2025-04-25"}],
+        "total_info|Subtotal": [{"score": 0.99, "value": f"${subtotal:,.2f}"}],
+        "total_info|Tax": [{"score": 0.99, "value": f"${tax:,.2f}"}],
+        "total_info|Grand Total": [{"score": 0.99, "value": f"${subtotal + tax:,.2f}"}],
+    }
+
+
+def _naive_quad_flatten(json_data):
+    """The pre-change plan: four independent FLATTENs filtered on equal index."""
+    item, qty, price, total = (json_data.get(f) or [] for f in extract.ITEM_FIELDS.values())
+    rows = 0
+    for ni, _ in enumerate(item):
+        for qi, _ in enumerate(qty):
+            for pri, _ in enumerate(price):
+                for ti, _ in enumerate(total):
+                    if ni == pri and ni == qi and ni == ti:
+                        rows += 1
+    return rows
+
+
+def _best_of(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def bench_extract(lines, repeat):
+    results = []
+    for line_count in lines:
+        payload = make_predict_payload("2001", line_count, seed=line_count)
+        seconds = _best_of(lambda: extract.extract_line_items(payload), repeat)
+        result = {
+            "benchmark": "extract_line_items",
+            "lines": line_count,
+            "seconds": round(seconds, 6),
+            "us_per_line": round(seconds / line_count * 1e6, 3),
+            "old_plan_candidate_rows": line_count ** 4,
+        }
+        if line_count <= NAIVE_MAX_LINES:
+            naive = _best_of(lambda: _naive_quad_flatten(payload), 1)
+            result["old_plan_seconds"] = round(naive, 6)
+        results.append(result)
+    return results
+
+
+def bench_upload(file_count, workers, put_latency, query_latency, failure_rate):
+    files = [(f"Invoice_{i:05d}.pdf", bytes(64 * 1024)) for i in range(file_count)]
+    results = []
+
+    # Pre-change path: PUT + presigned URL query + stage refresh per file, one after another
+    session = LocalSession(query_latency, LocalFileOperation(put_latency))
+    start = time.perf_counter()
+    for name, data in files:
+        upload.put_with_retry(session, "@STAGE", name, data, max_attempts=1)
+        session.sql("SELECT GET_PRESIGNED_URL(...)").collect()
+        session.sql("ALTER STAGE STAGE REFRESH").collect()
+    seconds = time.perf_counter() - start
+    results.append({"benchmark": "upload", "mode": "serial", "files": file_count, "seconds": round(seconds, 4),
+                    "files_per_second": round(file_count / seconds, 2), "round_trips": len(session.queries) + session.file.put_calls})
+
+    for worker_count in workers:
+        session = LocalSession(query_latency, LocalFileOperation(put_latency, failure_rate))
+        summary = upload.upload_batch(session, "STAGE", files, max_workers=worker_count, backoff_seconds=0.01)
+        results.append({"benchmark": "upload", "mode": "batched", "workers": worker_count, "files": file_count,
+                        "seconds": round(summary.seconds, 4), "files_per_second": round(summary.files_per_second, 2),
+                        "failed": len(summary.failed), "round_trips": len(session.queries) + session.file.put_calls})
+    return results
+
+
+def bench_render(pattern, scales, repeat):
+    """Cold (empty cache) vs warm (cached) page renders of the bundled invoice PDFs."""
+    import pypdfium2 as pdfium
+
+    paths = sorted(glob.glob(pattern))
+    if not paths:
+        raise SystemExit(f"No documents match {pattern!r}")
+    documents = []
+    for path in paths:
+        with open(path, "rb") as f:
+            data = f.read()
+        documents.append((upload.content_hash(data), pdfium.PdfDocument(data)))
+    pages = [(doc_hash, pdf, index) for doc_hash, pdf in documents for index in range(render.page_count(pdf))]
+
+    results = []
+    for scale in scales:
+        cache = render.PageRenderCache(budget_bytes=1 << 30)
+        start = time.perf_counter()
+        encoded = [cache.get(pdf, doc_hash, index, scale) for doc_hash, pdf, index in pages]
+        cold = time.perf_counter() - start
+        warm = _best_of(lambda: [cache.get(pdf, doc_hash, index, scale) for doc_hash, pdf, index in pages], repeat)
+
+        # Old path, paid on every rerun: render + to_pil, then st.image encodes the PIL image as PNG
+        def uncached():
+            for _, pdf, index in pages:
+                render.encode_image(pdf[index].render(scale=scale, rotation=0).to_pil(), "PNG")
+        uncached_seconds = _best_of(uncached, 1)
+
+        results.append({
+            "benchmark": "render", "scale": scale, "documents": len(documents), "pages": len(pages),
+            "format": cache.image_format,
+            "rerun_ms_per_page_before": round(uncached_seconds / len(pages) * 1e3, 3),
+            "cold_ms_per_page": round(cold / len(pages) * 1e3, 3),
+            "warm_ms_per_page": round(warm / len(pages) * 1e3, 4),
+            "avg_kb_per_page": round(sum(len(e) for e in encoded) / len(pages) / 1024, 1),
+            "cache": cache.stats(),
+        })
+    for _, pdf in documents:
+        pdf.close()
+    return results
+
+
+def bench_preparse(pattern, copies, workers_list, batch_size, query_latency):
+    """
+    Bulk backfill pre-parser: documents/second (and per core) parsing `copies` x the bundled
+    invoice PDFs across a process pool and bulk-loading them into a LocalWarehouse.
+    """
+    import docai_invoice_qs_preparse as preparse
+
+    paths = sorted(glob.glob(pattern))
+    if not paths:
+        raise SystemExit(f"No documents match {pattern!r}")
+    paths = paths * copies
+    results = []
+    for workers in workers_list:
+        warehouse = LocalWarehouse()
+        session = LocalSession(query_latency, warehouse=warehouse)
+        summary = preparse.run(paths, workers, batch_size, session)
+        results.append({"benchmark": "preparse", **summary.report(), "batches": -(-len(paths) // batch_size), "queries": len(session.queries)})
+        warehouse.connection.close()
+    return results
+
+
+def _layout_context(session, sample, seed):
+    """Bind values for LAYOUT_HOT_PATHS: `sample` random invoice ids and the latest reconciliation run."""
+    invoice_ids = [row[0] for row in session.sql(f"SELECT DISTINCT invoice_id FROM {_SCHEMA}.TRANSACT_TOTALS").collect()]
+    run = session.sql(f"SELECT MAX(last_reconciled_timestamp) FROM {_SCHEMA}.RECONCILE_RESULTS_ITEMS").collect()
+    invoice_ids = random.Random(seed).sample(invoice_ids, min(sample, len(invoice_ids)))
+    return [{"invoice_id": invoice_id, "run_timestamp": run[0][0]} for invoice_id in invoice_ids]
+
+
+def _run_hot_path(session, query, binds, contexts):
+    """Runs `query` once per context; returns (seconds, query ids)."""
+    query_ids = []
+    start = time.perf_counter()
+    for context in contexts:
+        with session.query_history() as history:
+            session.sql(query, params=[context[name] for name in binds]).collect()
+        query_ids.extend(q.query_id for q in history.queries)
+    return time.perf_counter() - start, query_ids
+
+
+def bench_layout(items, sample, seed, connection=None, label=None):
+    """
+    Latency of the invoice_id point lookups and the reconcile results' status reads per hot path,
+    before and after the physical layout of docai_invoice_qs_layout.sql.
+
+    Locally, `items` synthetic line items are reconciled into a LocalWarehouse and every hot path
+    runs without indexes ('before') and with the layout's indexes ('after'); the SQLite plan shows
+    the full scans. With `connection` the hot paths run against that Snowflake account as one
+    labelled phase (run once before the migration and once after reclustering has settled), and
+    partitions scanned / total come from QUERY_HISTORY_BY_SESSION.
+    """
+    results = []
+    if connection is None:
+        warehouse = LocalWarehouse()
+        warehouse.load_synthetic(items, seed)
+        warehouse.run_reconciliation()
+        session = LocalSession(warehouse=warehouse)
+        contexts = _layout_context(session, sample, seed)
+        for phase, apply_layout in [("before", warehouse.drop_indexes), ("after", warehouse.create_indexes)]:
+            apply_layout()
+            for name, query, binds in LAYOUT_HOT_PATHS:
+                seconds, _ = _run_hot_path(session, query, binds, contexts)
+                plan = warehouse.explain(query, [contexts[0][bind] for bind in binds])
+                results.append({"benchmark": "layout", "label": phase, "items": items, "hot_path": name, "calls": len(contexts),
+                                "ms_per_call": round(seconds / len(contexts) * 1e3, 3),
+                                "full_scans": sum(step.startswith("SCAN") and step != "SCAN CONSTANT ROW" for step in plan), "plan": "; ".join(plan)})
+        warehouse.connection.close()
+        return results
+
+    from snowflake.snowpark import Session
+
+    session = Session.builder.config("connection_name", connection).create()
+    # Repeated statements must not be answered from the result cache
+    session.sql("ALTER SESSION SET USE_CACHED_RESULT = FALSE").collect()
+    contexts = _layout_context(session, sample, seed)
+    for name, query, binds in LAYOUT_HOT_PATHS:
+        seconds, query_ids = _run_hot_path(session, query, binds, contexts)
+        history = session.sql(f"""
+            SELECT partitions_scanned, partitions_total, total_elapsed_time
+            FROM TABLE(DOC_AI_QS_DB.INFORMATION_SCHEMA.QUERY_HISTORY_BY_SESSION(RESULT_LIMIT => 10000))
+            WHERE query_id IN ({", ".join("?" for _ in query_ids)})
+        """, params=query_ids).to_pandas()
+        results.append({"benchmark": "layout", "label": label, "hot_path": name, "calls": len(contexts),
+                        "ms_per_call": round(seconds / len(contexts) * 1e3, 3),
+                        "server_ms_per_call": round(float(history["TOTAL_ELAPSED_TIME"].mean()), 1),
+                        "partitions_scanned": round(float(history["PARTITIONS_SCANNED"].mean()), 1),
+                        "partitions_total": round(float(history["PARTITIONS_TOTAL"].mean()), 1)})
+    session.close()
+    return results
+
+
+def _measure(fn, repeat):
+    """(best seconds over `repeat` runs, peak Python + Arrow bytes, result frame bytes) of `fn()`."""
+    import tracemalloc
+
+    import pyarrow as pa
+
+    best = _best_of(fn, repeat)
+    # Memory is measured on a separate run: tracemalloc slows Python-heavy paths down
+    default_pool = pa.default_memory_pool()
+    pool = pa.proxy_memory_pool(default_pool) # separate statistics for this run's Arrow buffers
+    pa.set_memory_pool(pool)
+    tracemalloc.start()
+    try:
+        result = fn()
+        _, python_peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+        pa.set_memory_pool(default_pool)
+    frame_bytes = int(result.memory_usage(index=False, deep=True).sum()) if hasattr(result, "memory_usage") else sys.getsizeof(result)
+    del result # its buffers must be freed while `pool` still exists
+    return best, python_peak + pool.max_memory(), frame_bytes
+
+
+def _legacy_typed_frame(session, query, params, table_name):
+    """The pre-Arrow read: to_pandas() then per-column pd.to_numeric / pd.to_datetime fix-ups."""
+    import pyarrow as pa
+
+    from docai_invoice_qs_schema import table_schema
+
+    df = session.sql(query, params=params).to_pandas()
+    for field in table_schema(table_name):
+        if field.name not in df.columns:
+            continue
+        if pa.types.is_decimal(field.type):
+            df[field.name] = pd.to_numeric(df[field.name], errors="coerce")
+        elif pa.types.is_date(field.type):
+            df[field.name] = pd.to_datetime(df[field.name], errors="coerce").dt.date
+        elif pa.types.is_timestamp(field.type):
+            df[field.name] = pd.to_datetime(df[field.name], errors="coerce", utc=field.type.tz is not None)
+    return df
+
+
+def bench_arrow(line_counts, queue_sizes, repeat):
+    """
+    Memory and latency of the typed Arrow reads (docai_invoice_qs_schema) against the pandas
+    reads they replace, for one invoice with many lines (the review screen's bronze detail) and
+    for the review queue's invoice ids (bulk acceptance), against a LocalWarehouse.
+
+    Peak memory counts Python allocations (tracemalloc) and Arrow buffers. Locally both paths
+    read SQLite rows; from Snowflake the result already arrives as Arrow, so the Arrow path also
+    skips the connector's row conversion.
+    """
+    from docai_invoice_qs_details import _invoice_rows_sql
+    from docai_invoice_qs_schema import fetch_typed
+
+    rng = np.random.default_rng(0)
+    results = []
+    for lines in line_counts:
+        warehouse = LocalWarehouse()
+        quantity = rng.integers(1, 10, lines).astype(float)
+        unit_price = rng.integers(100, 2000, lines) / 100
+        base = {"INVOICE_ID": "900001", "PRODUCT_NAME": rng.choice(PRODUCTS, lines), "QUANTITY": quantity,
+                "UNIT_PRICE": unit_price, "TOTAL_PRICE": np.round(quantity * unit_price, 2)}
+        warehouse.load("TRANSACT_ITEMS", pd.DataFrame(base))
+        warehouse.load("DOCAI_INVOICE_ITEMS", pd.DataFrame({**base, "FILE_NAME": "Custom_Invoice_900001.pdf", "FILE_SIZE": 2377.0,
+                                                            "LAST_MODIFIED": pd.Timestamp("2025-05-23 20:37:41")}))
+        session = LocalSession(warehouse=warehouse)
+        for table in ["TRANSACT_ITEMS", "DOCAI_INVOICE_ITEMS"]:
+            table_name = f"{_SCHEMA}.{table}"
+            query = _invoice_rows_sql(table_name)
+            for path, fn in [("pandas", lambda: _legacy_typed_frame(session, query.text, ["900001"], table_name)),
+                             ("arrow", lambda: fetch_typed(session, query, ["900001"], table_name))]:
+                seconds, peak, frame_bytes = _measure(fn, repeat)
+                results.append({"benchmark": "arrow", "read": "invoice_detail", "table": table, "rows": lines, "path": path,
+                                "ms": round(seconds * 1e3, 2), "peak_mb": round(peak / 2**20, 2), "result_mb": round(frame_bytes / 2**20, 2)})
+        warehouse.connection.close()
+
+    queue_query = f"""
+        SELECT invoice_id FROM {_SCHEMA}.RECONCILE_RESULTS_ITEMS
+        WHERE review_status = ?
+        ORDER BY last_reconciled_timestamp DESC, invoice_id DESC
+    """
+    for invoices in queue_sizes:
+        warehouse = LocalWarehouse()
+        warehouse.load("RECONCILE_RESULTS_ITEMS", pd.DataFrame({
+            "INVOICE_ID": (np.arange(invoices) + 100000).astype(str), "ITEM_MISMATCH_DETAILS": "Product: Milk (ltr) Qty_Diff",
+            "REVIEW_STATUS": "Pending Review", "LAST_RECONCILED_TIMESTAMP": pd.Timestamp("2025-05-23 20:37:41"),
+        }))
+        session = LocalSession(warehouse=warehouse)
+        for path, fn in [("rows", lambda: [row["INVOICE_ID"] for row in session.sql(queue_query, params=["Pending Review"]).collect()]),
+                         ("arrow", lambda: session.sql(queue_query, params=["Pending Review"]).to_arrow().column(0).to_pylist())]:
+            seconds, peak, _ = _measure(fn, repeat)
+            results.append({"benchmark": "arrow", "read": "queue_invoice_ids", "rows": invoices, "path": path,
+                            "ms": round(seconds * 1e3, 2), "peak_mb": round(peak / 2**20, 2)})
+        warehouse.connection.close()
+    return results
+
+
+def _stage(items, stage, seconds, ops=1, session=None, **extra):
+    result = {"benchmark": "e2e", "items": items, "stage": stage, "seconds": round(seconds, 4), "ops": ops,
+              "ms_per_op": round(seconds / max(ops, 1) * 1e3, 3)}
+    if session is not None:
+        result["queries"] = len(session.queries)
+    result.update(extra)
+    return result
+
+
+def bench_e2e(item_counts, sample, query_latency, chunk_items, database, seed):
+    """
+    Generates synthetic data, reconciles it and times the app's read and write paths against
+    a LocalSession backed by a LocalWarehouse.
+
+    Reconciliation runs through the pandas mirror of the procedures (docai_invoice_qs_reconcile)
+    chunk by chunk; synthetic chunks have disjoint invoices, so they reconcile independently.
+    """
+    import docai_invoice_qs_reconcile as reconcile
+    import docai_invoice_qs_synth as synth
+
+    from docai_invoice_qs_details import InvoiceDetailLoader
+    from docai_invoice_qs_discrepancies import fetch_discrepancy_breakdown
+    from docai_invoice_qs_gold import submit_review
+    from docai_invoice_qs_queue import count_queue, fetch_mismatch_details, fetch_queue_invoice_ids, fetch_queue_page
+
+    items_table, totals_table = "DOC_AI_QS_DB.DOC_AI_SCHEMA.RECONCILE_RESULTS_ITEMS", "DOC_AI_QS_DB.DOC_AI_SCHEMA.RECONCILE_RESULTS_TOTALS"
+    discrepancies_table, metrics_invoices_table = "DOC_AI_QS_DB.DOC_AI_SCHEMA.RECONCILE_DISCREPANCIES", "DOC_AI_QS_DB.DOC_AI_SCHEMA.RECONCILE_METRICS_INVOICES"
+    results = []
+    for items in item_counts:
+        warehouse = LocalWarehouse(database)
+        run_timestamp = pd.Timestamp.now().floor("s")
+        timings = {"generate": 0.0, "reconcile": 0.0, "load": 0.0}
+        planted_mismatches = 0
+        summary = {}
+        chunks = synth.iter_chunks(items, chunk_items, seed)
+        while True:
+            start = time.perf_counter()
+            chunk = next(chunks, None)
+            timings["generate"] += time.perf_counter() - start
+            if chunk is None:
+                break
+            for key, value in chunk.summary().items():
+                summary[key] = summary.get(key, 0) + value
+
+            start = time.perf_counter()
+            item_discrepancies, item_ids = reconcile.item_discrepancies(chunk.transact_items, chunk.docai_items)
+            total_discrepancies, total_ids = reconcile.total_discrepancies(chunk.transact_totals, chunk.docai_totals)
+            item_results = reconcile.merge_results(None, reconcile.summarize_discrepancies(item_discrepancies, item_ids), run_timestamp)
+            total_results = reconcile.merge_results(None, reconcile.summarize_discrepancies(total_discrepancies, total_ids), run_timestamp)
+            discrepancies = pd.concat([item_discrepancies, total_discrepancies], ignore_index=True).assign(last_reconciled_timestamp=run_timestamp)
+            gold_items = chunk.transact_items[chunk.transact_items["INVOICE_ID"].isin(reconcile.ready_for_gold(item_results, run_timestamp))]
+            gold_totals = chunk.transact_totals[chunk.transact_totals["INVOICE_ID"].isin(reconcile.ready_for_gold(total_results, run_timestamp))]
+            timings["reconcile"] += time.perf_counter() - start
+            for results_frame, expected in [(item_results, chunk.expected_item_pending), (total_results, chunk.expected_total_pending)]:
+                pending = set(results_frame.loc[results_frame["review_status"] == reconcile.PENDING_REVIEW, "invoice_id"])
+                planted_mismatches += len(pending ^ expected)
+
+            start = time.perf_counter()
+            for table, df in [("TRANSACT_ITEMS", chunk.transact_items), ("TRANSACT_TOTALS", chunk.transact_totals),
+                              ("DOCAI_INVOICE_ITEMS", chunk.docai_items), ("DOCAI_INVOICE_TOTALS", chunk.docai_totals),
+                              ("RECONCILE_RESULTS_ITEMS", item_results), ("RECONCILE_RESULTS_TOTALS", total_results),
+                              ("RECONCILE_DISCREPANCIES", discrepancies)]:
+                warehouse.load(table, df)
+            for table, df in [("GOLD_INVOICE_ITEMS", gold_items), ("GOLD_INVOICE_TOTALS", gold_totals)]:
+                warehouse.load(table, df.assign(REVIEWED_BY=reconcile.AUTO_RECONCILED, REVIEWED_TIMESTAMP=run_timestamp))
+            timings["load"] += time.perf_counter() - start
+        warehouse.analyze()
+
+        # planted_mismatches: invoices whose reconciled status differs from what the generator planted (expect 0)
+        results.append(_stage(items, "generate", timings["generate"], **summary))
+        results.append(_stage(items, "reconcile", timings["reconcile"], planted_mismatches=planted_mismatches))
+        results.append(_stage(items, "load", timings["load"]))
+
+        start = time.perf_counter()
+        warehouse.refresh_metrics(full_refresh=True)
+        results.append(_stage(items, "metrics_refresh", time.perf_counter() - start))
+
+        session = LocalSession(query_latency, warehouse=warehouse)
+        start = time.perf_counter()
+        session.sql("""
+            SELECT SUM(invoice_count) AS total_invoice_count, SUM(total_amount) AS grand_total_amount,
+                   SUM(reconciled_invoice_count) AS reconciled_invoice_count, SUM(pending_invoice_count) AS pending_invoice_count
+            FROM DOC_AI_QS_DB.DOC_AI_SCHEMA.RECONCILE_METRICS_DAILY
+        """).collect()
+        session.sql("SELECT * FROM DOC_AI_QS_DB.DOC_AI_SCHEMA.RECONCILE_METRICS_DAILY ORDER BY invoice_date DESC").to_pandas()
+        results.append(_stage(items, "metrics_read", time.perf_counter() - start, session=session))
+
+        # Review queue: first page with its count and mismatch details, then paging through a few pages
+        session = LocalSession(query_latency, warehouse=warehouse)
+        start = time.perf_counter()
+        page = fetch_queue_page(session, items_table, totals_table, reconcile.PENDING_REVIEW)
+        queued = count_queue(session, items_table, totals_table, reconcile.PENDING_REVIEW)
+        fetch_mismatch_details(session, items_table, totals_table, page.invoice_ids)
+        first_page = time.perf_counter() - start
+        results.append(_stage(items, "queue_first_page", first_page, session=session, queued_invoices=queued))
+        pages = 0
+        start = time.perf_counter()
+        while page.next_cursor is not None and pages < 10:
+            page = fetch_queue_page(session, items_table, totals_table, reconcile.PENDING_REVIEW, cursor=page.next_cursor)
+            fetch_mismatch_details(session, items_table, totals_table, page.invoice_ids)
+            pages += 1
+        results.append(_stage(items, "queue_next_page", time.perf_counter() - start, ops=pages))
+
+        # Structured discrepancies: queue filtered by mismatch type and the per-type breakdown
+        session = LocalSession(query_latency, warehouse=warehouse)
+        start = time.perf_counter()
+        typed_queue = {mismatch_type: count_queue(session, items_table, totals_table, reconcile.PENDING_REVIEW, mismatch_type=mismatch_type)
+                       for mismatch_type in reconcile.MISMATCH_TYPES}
+        results.append(_stage(items, "queue_by_mismatch_type", time.perf_counter() - start, ops=len(typed_queue), session=session,
+                              largest_type=max(typed_queue.values())))
+        start = time.perf_counter()
+        breakdown = fetch_discrepancy_breakdown(session, discrepancies_table, metrics_invoices_table)
+        results.append(_stage(items, "discrepancy_breakdown", time.perf_counter() - start, mismatch_types=len(breakdown),
+                              discrepancies=int(breakdown["DISCREPANCY_COUNT"].sum())))
+
+        sample_ids = fetch_queue_invoice_ids(session, items_table, totals_table, reconcile.PENDING_REVIEW, limit=sample)
+        tables = {key: f"DOC_AI_QS_DB.DOC_AI_SCHEMA.{table}" for key, table in [
+            ("transact_items", "TRANSACT_ITEMS"), ("transact_totals", "TRANSACT_TOTALS"),
+            ("docai_items", "DOCAI_INVOICE_ITEMS"), ("docai_totals", "DOCAI_INVOICE_TOTALS")]}
+        session = LocalSession(query_latency, warehouse=warehouse)
+        loader = InvoiceDetailLoader(session, tables)
+        start = time.perf_counter()
+        details = {invoice_id: loader.get(invoice_id) for invoice_id in sample_ids}
+        results.append(_stage(items, "invoice_detail", time.perf_counter() - start, ops=len(sample_ids), session=session))
+
+        # Submission accepts the DocAI values, as a reviewer would after checking the document
+        session = LocalSession(query_latency, warehouse=warehouse)
+        start = time.perf_counter()
+        for invoice_id, data in details.items():
+            submit_review(session, invoice_id, data["docai_items"], data["docai_totals"], "BENCH", "")
+        results.append(_stage(items, "submit_review", time.perf_counter() - start, ops=len(details), session=session,
+                              queued_after=count_queue(session, items_table, totals_table, reconcile.PENDING_REVIEW)))
+        warehouse.connection.close()
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="benchmark", required=True)
+
+    p_extract = sub.add_parser("extract", help="DOCAI_EXTRACT line-item transform")
+    p_extract.add_argument("--lines", type=int, nargs="+", default=[10, 100, 1000])
+    p_extract.add_argument("--repeat", type=int, default=5)
+
+    p_upload = sub.add_parser("upload", help="sidebar uploader: serial vs batched PUTs")
+    p_upload.add_argument("--files", type=int, default=300)
+    p_upload.add_argument("--workers", type=int, nargs="+", default=[1, 8, 16])
+    p_upload.add_argument("--put-latency", type=float, default=0.05)
+    p_upload.add_argument("--query-latency", type=float, default=0.05)
+    p_upload.add_argument("--failure-rate", type=float, default=0.0)
+
+    p_render = sub.add_parser("render", help="PDF viewer: cold vs warm rendered-page cache")
+    p_render.add_argument("--documents", default="extraction_documents/Custom_Invoice_*.pdf")
+    p_render.add_argument("--scales", type=float, nargs="+", default=[render.PREVIEW_SCALE, render.FULL_SCALE])
+    p_render.add_argument("--repeat", type=int, default=3)
+
+    p_e2e = sub.add_parser("e2e", help="synthetic data: reconciliation, metrics, queue, detail and submission")
+    p_e2e.add_argument("--items", type=int, nargs="+", default=[10000, 100000])
+    p_e2e.add_argument("--sample", type=int, default=20, help="invoices opened and submitted")
+    p_e2e.add_argument("--query-latency", type=float, default=0.0)
+    p_e2e.add_argument("--chunk-items", type=int, default=1_000_000)
+    p_e2e.add_argument("--database", default=":memory:", help="SQLite file for runs too large for memory")
+    p_e2e.add_argument("--seed", type=int, default=0)
+
+    p_preparse = sub.add_parser("preparse", help="bulk backfill: parallel PDF pre-parser and batched load")
+    p_preparse.add_argument("--documents", default="extraction_documents/Custom_Invoice_*.pdf")
+    p_preparse.add_argument("--copies", type=int, default=1000, help="times each document is parsed")
+    p_preparse.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    p_preparse.add_argument("--batch-size", type=int, default=5000)
+    p_preparse.add_argument("--query-latency", type=float, default=0.0)
+
+    p_layout = sub.add_parser("layout", help="invoice_id point lookups before / after the clustering layout")
+    p_layout.add_argument("--items", type=int, default=100000, help="synthetic line items (local run)")
+    p_layout.add_argument("--sample", type=int, default=50, help="invoices looked up per hot path")
+    p_layout.add_argument("--seed", type=int, default=0)
+    p_layout.add_argument("--connection", help="Snowflake connection name (connections.toml): measure that account instead")
+    p_layout.add_argument("--label", default="snowflake", help="phase label of a --connection run, e.g. before / after")
+
+    p_arrow = sub.add_parser("arrow", help="typed Arrow reads vs pandas reads: large invoices and review queues")
+    p_arrow.add_argument("--lines", type=int, nargs="+", default=[1000, 100000], help="line items on the one invoice")
+    p_arrow.add_argument("--queue", type=int, nargs="+", default=[10000, 1000000], help="invoices in the review queue")
+    p_arrow.add_argument("--repeat", type=int, default=3)
+
+    parser.add_argument("--output", help="also append the results to this JSON lines file")
+    args = parser.parse_args(argv)
+    if args.benchmark == "extract":
+        results = bench_extract(args.lines, args.repeat)
+    elif args.benchmark == "upload":
+        results = bench_upload(args.files, args.workers, args.put_latency, args.query_latency, args.failure_rate)
+    elif args.benchmark == "render":
+        results = bench_render(args.documents, args.scales, args.repeat)
+    elif args.benchmark == "e2e":
+        results = bench_e2e(args.items, args.sample, args.query_latency, args.chunk_items, args.database, args.seed)
+    elif args.benchmark == "preparse":
+        results = bench_preparse(args.documents, args.copies, args.workers, args.batch_size, args.query_latency)
+    elif args.benchmark == "layout":
+        results = bench_layout(args.items, args.sample, args.seed, args.connection, args.label)
+    elif args.benchmark == "arrow":
+        results = bench_arrow(args.lines, args.queue, args.repeat)
+
+    run_at = datetime.now(timezone.utc).isoformat(timespec="seconds")
+    lines = [json.dumps({"run_at": run_at, **result}, default=str) for result in results]
+    for line in lines:
+        print(line)
+    if args.output:
+        with open(args.output, "a") as fh:
+            fh.writelines(line + "\n" for line in lines)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,24 +1,46 @@
 USE ROLE ACCOUNTADMIN;
 
+ALTER TASK doc_ai_qs_db.doc_ai_schema.DOCAI_EXTRACT SUSPEND;
+DROP TASK IF EXISTS doc_ai_qs_db.doc_ai_schema.RECONCILE_FINALIZE;
+DROP TASK IF EXISTS doc_ai_qs_db.doc_ai_schema.RECONCILE_ITEMS;
+DROP TASK IF EXISTS doc_ai_qs_db.doc_ai_schema.RECONCILE_TOTALS;
+DROP TASK IF EXISTS doc_ai_qs_db.doc_ai_schema.RECONCILE_CAPTURE;
 DROP TASK doc_ai_qs_db.doc_ai_schema.DOCAI_EXTRACT;
-DROP TASK doc_ai_qs_db.doc_ai_schema.RECONCILE;
 
 DROP STREAM doc_ai_qs_db.doc_ai_schema.BRONZE_DB_STREAM;
 DROP STREAM doc_ai_qs_db.doc_ai_schema.BRONZE_DOCAI_STREAM;
+DROP STREAM doc_ai_qs_db.doc_ai_schema.BRONZE_DB_ITEMS_STREAM;
+DROP STREAM doc_ai_qs_db.doc_ai_schema.BRONZE_DOCAI_ITEMS_STREAM;
 DROP STREAM doc_ai_qs_db.doc_ai_schema.INVOICE_STREAM;
 
-DROP PROCEDURE IF EXISTS doc_ai_qs_db.doc_ai_schema.SP_RUN_ITEM_RECONCILIATION();
-DROP PROCEDURE IF EXISTS doc_ai_qs_db.doc_ai_schema.SP_RUN_TOTALS_RECONCILIATION();
+DROP PROCEDURE IF EXISTS doc_ai_qs_db.doc_ai_schema.SP_CAPTURE_CHANGED_INVOICES();
+DROP PROCEDURE IF EXISTS doc_ai_qs_db.doc_ai_schema.SP_RUN_ITEM_RECONCILIATION(BOOLEAN);
+DROP PROCEDURE IF EXISTS doc_ai_qs_db.doc_ai_schema.SP_RUN_TOTALS_RECONCILIATION(BOOLEAN);
+DROP PROCEDURE IF EXISTS doc_ai_qs_db.doc_ai_schema.SP_REFRESH_RECONCILE_METRICS(VARCHAR, BOOLEAN);
+DROP PROCEDURE IF EXISTS doc_ai_qs_db.doc_ai_schema.SP_CHECK_RECONCILE_METRICS();
+DROP PROCEDURE IF EXISTS doc_ai_qs_db.doc_ai_schema.SP_GENERATE_MISMATCH_SUMMARIES();
+DROP PROCEDURE IF EXISTS doc_ai_qs_db.doc_ai_schema.SP_SUBMIT_REVIEW(VARCHAR, VARCHAR, VARCHAR, VARCHAR, VARCHAR);
+DROP PROCEDURE IF EXISTS doc_ai_qs_db.doc_ai_schema.SP_BULK_ACCEPT_DOCAI(VARCHAR, VARCHAR, VARCHAR);
+DROP PROCEDURE IF EXISTS doc_ai_qs_db.doc_ai_schema.SP_LOG_PIPELINE_STAGE(VARCHAR, VARCHAR, TIMESTAMP_NTZ, NUMBER, VARCHAR);
+DROP PROCEDURE IF EXISTS doc_ai_qs_db.doc_ai_schema.SP_RECORD_PIPELINE_LATENCY(VARCHAR);
 
 DROP STAGE IF EXISTS doc_ai_qs_db.doc_ai_schema.DOC_AI_STAGE;
 
 DROP TABLE IF EXISTS doc_ai_qs_db.doc_ai_schema.CO_INVOICES_ITEMS;
 DROP TABLE IF EXISTS doc_ai_qs_db.doc_ai_schema.CO_INVOICES_TOTALS;
+DROP TABLE IF EXISTS doc_ai_qs_db.doc_ai_schema.DOCAI_DOCUMENT_HASHES;
 DROP TABLE IF EXISTS doc_ai_qs_db.doc_ai_schema.DOCAI_INVOICE_ITEMS;
 DROP TABLE IF EXISTS doc_ai_qs_db.doc_ai_schema.DOCAI_INVOICE_TOTALS;
 DROP TABLE IF EXISTS doc_ai_qs_db.doc_ai_schema.DOCAI_PARSED;
 DROP TABLE IF EXISTS doc_ai_qs_db.doc_ai_schema.GOLD_INVOICE_ITEMS;
 DROP TABLE IF EXISTS doc_ai_qs_db.doc_ai_schema.GOLD_INVOICE_TOTALS;
+DROP TABLE IF EXISTS doc_ai_qs_db.doc_ai_schema.MISMATCH_SUMMARIES;
+DROP TABLE IF EXISTS doc_ai_qs_db.doc_ai_schema.PIPELINE_RUN_HISTORY;
+DROP TABLE IF EXISTS doc_ai_qs_db.doc_ai_schema.RECONCILE_DISCREPANCIES;
+DROP TABLE IF EXISTS doc_ai_qs_db.doc_ai_schema.RECONCILE_METRICS_DAILY;
+DROP TABLE IF EXISTS doc_ai_qs_db.doc_ai_schema.RECONCILE_METRICS_INVOICES;
+DROP TABLE IF EXISTS doc_ai_qs_db.doc_ai_schema.RECONCILE_METRICS_REFRESH_LOG;
+DROP TABLE IF EXISTS doc_ai_qs_db.doc_ai_schema.RECONCILE_PENDING_INVOICES;
 DROP TABLE IF EXISTS doc_ai_qs_db.doc_ai_schema.RECONCILE_RESULTS_ITEMS;
 DROP TABLE IF EXISTS doc_ai_qs_db.doc_ai_schema.RECONCILE_RESULTS_TOTALS;
 DROP TABLE IF EXISTS doc_ai_qs_db.doc_ai_schema.TRANSACT_ITEMS;
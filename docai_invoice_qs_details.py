@@ -0,0 +1,128 @@
+"""
+Invoice detail loader for the review screen.
+
+Fetches the four bronze result sets for an invoice (TRANSACT_ITEMS, TRANSACT_TOTALS,
+DOCAI_INVOICE_ITEMS, DOCAI_INVOICE_TOTALS) concurrently, keeps them in a bounded LRU
+keyed by invoice_id, and prefetches upcoming invoices of the review queue in the
+background. Given a `versions` function (QueryResultCache.versions), each entry is
+stamped with the LAST_ALTERED tokens of the four tables and reloaded once one of them
+changes, so DocAI re-extractions and ERP updates are not served stale.
+"""
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from docai_invoice_qs_schema import fetch_typed
+from docai_invoice_qs_templates import template
+
+DEFAULT_CAPACITY = 64
+DEFAULT_WORKERS = 8
+DEFAULT_PREFETCH_WORKERS = 4
+
+
+@template("invoice_rows")
+def _invoice_rows_sql(table_name):
+    return f"SELECT * FROM {table_name} WHERE invoice_id = ?"
+
+
+class InvoiceDetailLoader:
+    """
+    Thread-safe, process-wide cache of per-invoice bronze data.
+
+    `tables` maps the result key (e.g. 'transact_items') to a fully qualified table name.
+    Rows arrive as Arrow and are typed by the table's schema (docai_invoice_qs_schema).
+    Concurrent requests for the same invoice share one in-flight fetch. `versions(tables)`
+    returns the version tokens of `tables`; without it entries live until `invalidate`.
+    """
+
+    def __init__(self, session, tables, capacity=DEFAULT_CAPACITY, max_workers=DEFAULT_WORKERS,
+                 prefetch_workers=DEFAULT_PREFETCH_WORKERS, versions=None):
+        self.session = session
+        self.tables = dict(tables)
+        self.capacity = capacity
+        self.version_fn = versions
+        self._cache = OrderedDict()
+        self._inflight = {}
+        self._generation = {}
+        self._lock = threading.Lock()
+        # Separate pools: invoice loads wait on table queries, so they must not share workers
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="invoice-detail-query")
+        self._loaders = ThreadPoolExecutor(max_workers=prefetch_workers, thread_name_prefix="invoice-detail-load")
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+
+    def _versions(self):
+        return self.version_fn(list(self.tables.values())) if self.version_fn else None
+
+    def _fetch_table(self, table_name, invoice_id):
+        return fetch_typed(self.session, _invoice_rows_sql(table_name), [invoice_id], table_name)
+
+    def _fetch(self, invoice_id):
+        # One query per table, all in flight at once
+        futures = {key: self._pool.submit(self._fetch_table, table, invoice_id) for key, table in self.tables.items()}
+        return {key: future.result() for key, future in futures.items()}
+
+    def _load(self, invoice_id, generation):
+        try:
+            # Stamped before fetching: a change landing mid-fetch makes the entry stale, not current
+            versions = self._versions()
+            data = self._fetch(invoice_id)
+            with self._lock:
+                if self._generation.get(invoice_id, 0) != generation:
+                    return data # Invalidated while loading: serve it once, do not cache it
+                self._cache[invoice_id] = (data, versions)
+                self._cache.move_to_end(invoice_id)
+                while len(self._cache) > self.capacity:
+                    self._cache.popitem(last=False)
+            return data
+        finally:
+            with self._lock:
+                if self._generation.get(invoice_id, 0) == generation:
+                    self._inflight.pop(invoice_id, None)
+
+    def _future_for(self, invoice_id):
+        """Returns (cached_data, None) or (None, future) for an invoice, starting a fetch if needed."""
+        current = self._versions()
+        with self._lock:
+            if invoice_id in self._cache:
+                data, versions = self._cache[invoice_id]
+                if versions == current:
+                    self._cache.move_to_end(invoice_id)
+                    return data, None
+                del self._cache[invoice_id] # A bronze table changed since the load
+                self.stale += 1
+            future = self._inflight.get(invoice_id)
+            if future is None:
+                future = self._loaders.submit(self._load, invoice_id, self._generation.get(invoice_id, 0))
+                self._inflight[invoice_id] = future
+            return None, future
+
+    def get(self, invoice_id):
+        """Returns {key: DataFrame} for `invoice_id`; callers get copies they may modify."""
+        data, future = self._future_for(invoice_id)
+        with self._lock:
+            if data is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if data is None:
+            data = future.result()
+        return {key: df.copy() for key, df in data.items()}
+
+    def prefetch(self, invoice_ids):
+        """Starts background fetches for invoices that are neither cached nor in flight."""
+        for invoice_id in invoice_ids:
+            if invoice_id:
+                self._future_for(invoice_id)
+
+    def invalidate(self, invoice_id):
+        """Drops `invoice_id` from the cache, including any fetch still in flight."""
+        with self._lock:
+            self._cache.pop(invoice_id, None)
+            self._inflight.pop(invoice_id, None)
+            self._generation[invoice_id] = self._generation.get(invoice_id, 0) + 1
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "stale": self.stale, "cached": len(self._cache), "in_flight": len(self._inflight)}
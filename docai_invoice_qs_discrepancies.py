@@ -0,0 +1,67 @@
+"""
+Reads of RECONCILE_DISCREPANCIES, the typed discrepancy rows written by each reconciliation run.
+
+One row per (invoice, source, product occurrence, field) with the A/B values, the delta
+(B - A; days for invoice_date) and the mismatch type, so the app can filter and aggregate
+discrepancies without parsing the item/total mismatch detail strings.
+"""
+from docai_invoice_qs_templates import template
+
+
+@template("discrepancy_breakdown")
+def _breakdown_sql(discrepancies_table, metrics_invoices_table, by_date):
+    where = "WHERE m.invoice_date >= ? AND m.invoice_date <= ?" if by_date else ""
+    return f"""
+        SELECT d.source, d.mismatch_type,
+               COUNT(DISTINCT d.invoice_id) AS invoice_count,
+               COUNT(*) AS discrepancy_count,
+               SUM(ABS(d.delta)) AS total_abs_delta,
+               COUNT(DISTINCT CASE WHEN m.metric_status = 'Pending' THEN d.invoice_id END) AS pending_invoice_count
+        FROM {discrepancies_table} d
+        LEFT JOIN {metrics_invoices_table} m ON m.invoice_id = d.invoice_id
+        {where}
+        GROUP BY d.source, d.mismatch_type
+        ORDER BY invoice_count DESC, d.source, d.mismatch_type
+    """
+
+
+@template("discrepancy_products")
+def _products_sql(discrepancies_table):
+    return f"""
+        SELECT product_name,
+               COUNT(DISTINCT invoice_id) AS invoice_count,
+               COUNT(*) AS discrepancy_count,
+               SUM(ABS(delta)) AS total_abs_delta
+        FROM {discrepancies_table}
+        WHERE mismatch_type = ? AND product_name IS NOT NULL
+        GROUP BY product_name
+        ORDER BY invoice_count DESC, total_abs_delta DESC, product_name
+        LIMIT ?
+    """
+
+
+@template("invoice_discrepancies")
+def _invoice_discrepancies_sql(discrepancies_table):
+    return f"""
+        SELECT source, product_name, product_occurrence, field, mismatch_type, value_a, value_b, date_a, date_b, delta
+        FROM {discrepancies_table}
+        WHERE invoice_id = ?
+        ORDER BY source, product_name, product_occurrence, field
+    """
+
+
+def fetch_discrepancy_breakdown(session, discrepancies_table, metrics_invoices_table, date_from=None, date_to=None):
+    """Invoices, discrepancies and absolute delta per (source, mismatch type), optionally for an invoice date range."""
+    by_date = date_from is not None and date_to is not None
+    params = [date_from, date_to] if by_date else []
+    return _breakdown_sql(discrepancies_table, metrics_invoices_table, by_date).to_pandas(session, params)
+
+
+def fetch_products_by_mismatch_type(session, discrepancies_table, mismatch_type, limit=20):
+    """Products most often involved in `mismatch_type` discrepancies."""
+    return _products_sql(discrepancies_table).to_pandas(session, [mismatch_type, limit])
+
+
+def fetch_invoice_discrepancies(session, discrepancies_table, invoice_id):
+    """Typed discrepancy rows of one invoice."""
+    return _invoice_discrepancies_sql(discrepancies_table).to_pandas(session, [invoice_id])
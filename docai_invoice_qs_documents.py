@@ -0,0 +1,216 @@
+"""
+Process-wide store of opened invoice PDFs, shared by all reviewer sessions.
+
+Documents are keyed by (stage path, content hash), so a re-uploaded file with new bytes
+is never served stale and repeat views skip the stage download. Small documents are
+kept in memory; large ones are spilled to a local disk cache and read through mmap.
+Memory and disk use are capped, and evicting a document closes its pdfium handle.
+"""
+import hashlib
+import io
+import mmap
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+import pypdfium2 as pdfium
+
+from docai_invoice_qs_render import PDFIUM_LOCK
+from docai_invoice_qs_templates import template
+
+DEFAULT_MEMORY_BUDGET_BYTES = 128 * 1024 * 1024
+DEFAULT_DISK_BUDGET_BYTES = 1024 * 1024 * 1024
+DEFAULT_SPILL_THRESHOLD_BYTES = 4 * 1024 * 1024
+
+
+@template("stage_md5")
+def _stage_md5_sql(stage_name):
+    return f"SELECT md5 FROM DIRECTORY(@{stage_name}) WHERE relative_path = ?"
+
+
+def stage_content_hash(session, stage_name, relative_path):
+    """MD5 of a staged file from the stage directory (metadata only, no download)."""
+    rows = _stage_md5_sql(stage_name).collect(session, [relative_path])
+    return rows[0]["MD5"] if rows else None
+
+
+class _MmapStream(io.RawIOBase):
+    """Read-only file-like view of an mmap, so pdfium reads spilled documents lazily."""
+
+    def __init__(self, mapped):
+        self._mapped = mapped
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._pos, io.SEEK_END: len(self._mapped)}[whence]
+        self._pos = base + offset
+        return self._pos
+
+    def readinto(self, buffer):
+        data = self._mapped[self._pos:self._pos + len(buffer)]
+        buffer[:len(data)] = data
+        self._pos += len(data)
+        return len(data)
+
+
+class StoredDocument:
+    """One opened PDF; `pdf` must only be used under PDFIUM_LOCK (see docai_invoice_qs_render)."""
+
+    def __init__(self, stage_path, content_hash, data, spill_dir=None):
+        self.stage_path = stage_path
+        self.content_hash = content_hash
+        self.size_bytes = len(data)
+        self.spill_path = None
+        self._file = None
+        self._mapped = None
+        if spill_dir is None:
+            source = data
+        else:
+            # One file per entry: the same bytes can be stored under several stage paths
+            fd, self.spill_path = tempfile.mkstemp(prefix=f"{content_hash}_", suffix=".pdf", dir=spill_dir)
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            self._file = open(self.spill_path, "rb")
+            self._mapped = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            source = _MmapStream(self._mapped)
+        with PDFIUM_LOCK:
+            self.pdf = pdfium.PdfDocument(source)
+            self.page_count = len(self.pdf)
+
+    @property
+    def spilled(self):
+        return self.spill_path is not None
+
+    def close(self):
+        with PDFIUM_LOCK:
+            self.pdf.close()
+        if self._mapped is not None:
+            self._mapped.close()
+            self._file.close()
+            os.remove(self.spill_path)
+
+
+class DocumentStore:
+    """
+    Thread-safe LRU of StoredDocuments bounded by in-memory and spilled bytes.
+
+    Concurrent requests for the same document share one download.
+    """
+
+    def __init__(self, memory_budget_bytes=DEFAULT_MEMORY_BUDGET_BYTES, disk_budget_bytes=DEFAULT_DISK_BUDGET_BYTES,
+                 spill_threshold_bytes=DEFAULT_SPILL_THRESHOLD_BYTES, spill_dir=None):
+        self.memory_budget_bytes = memory_budget_bytes
+        self.disk_budget_bytes = disk_budget_bytes
+        self.spill_threshold_bytes = spill_threshold_bytes
+        self.spill_dir = spill_dir or tempfile.mkdtemp(prefix="docai_qs_documents_")
+        self._documents = OrderedDict()
+        self._inflight = {}
+        self._latest_hash = {}
+        self._memory_bytes = 0
+        self._disk_bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bytes_downloaded = 0
+
+    def _download(self, session, stage_path, content_hash):
+        stream = session.file.get_stream(stage_path, decompress=False)
+        try:
+            data = stream.read()
+        finally:
+            stream.close()
+        actual_hash = hashlib.md5(data).hexdigest()
+        spill_dir = self.spill_dir if len(data) > self.spill_threshold_bytes else None
+        document = StoredDocument(stage_path, actual_hash, data, spill_dir)
+        with self._lock:
+            self.bytes_downloaded += len(data)
+        return document
+
+    def _admit(self, key, document):
+        """Adds a document and evicts least recently used ones until both budgets hold; returns the stored one."""
+        evicted = []
+        with self._lock:
+            existing = self._documents.get(key)
+            if existing is not None:
+                # Same bytes fetched concurrently under an unknown hash: keep the first copy
+                self._documents.move_to_end(key)
+                evicted.append(document)
+                document = existing
+            else:
+                self._documents[key] = document
+                if document.spilled:
+                    self._disk_bytes += document.size_bytes
+                else:
+                    self._memory_bytes += document.size_bytes
+            self._latest_hash[document.stage_path] = document.content_hash
+            while len(self._documents) > 1 and (self._memory_bytes > self.memory_budget_bytes or self._disk_bytes > self.disk_budget_bytes):
+                _, old = self._documents.popitem(last=False)
+                if old.spilled:
+                    self._disk_bytes -= old.size_bytes
+                else:
+                    self._memory_bytes -= old.size_bytes
+                self.evictions += 1
+                evicted.append(old)
+        for old in evicted:
+            old.close()
+        return document
+
+    def get(self, session, stage_path, content_hash=None):
+        """
+        Returns the StoredDocument for `stage_path`, downloading it only on a miss.
+
+        Without `content_hash` the most recently stored version of the path is served.
+        """
+        with self._lock:
+            content_hash = content_hash or self._latest_hash.get(stage_path)
+            key = (stage_path, content_hash)
+            document = self._documents.get(key) if content_hash else None
+            if document is not None:
+                self._documents.move_to_end(key)
+                self.hits += 1
+                return document
+            self.misses += 1
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._inflight[key] = future
+
+        if not owner:
+            return future.result()
+        try:
+            document = self._download(session, stage_path, content_hash)
+            document = self._admit((stage_path, document.content_hash), document)
+            future.set_result(document)
+            return document
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions, "documents": len(self._documents),
+                    "memory_bytes": self._memory_bytes, "disk_bytes": self._disk_bytes, "bytes_downloaded": self.bytes_downloaded}
+
+    def close(self):
+        with self._lock:
+            documents = list(self._documents.values())
+            self._documents.clear()
+            self._memory_bytes = self._disk_bytes = 0
+        for document in documents:
+            document.close()
@@ -0,0 +1,164 @@
+"""
+Reference implementation of the DOCAI_EXTRACT JSON-to-rows transform.
+
+Mirrors the `extracted_item_data` and `extracted_total_data` steps of the
+DOCAI_EXTRACT task in docai_invoice_qs_setup.sql so recorded
+DOC_AI_QS_INVOICES!PREDICT payloads can be replayed locally.
+
+Usage:
+    python docai_invoice_qs_extract.py payload.json [payload2.json ...]
+"""
+import json
+import sys
+from datetime import date, datetime
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+
+# --- PREDICT field names (must match the DocAI model build) ---
+ITEM_FIELDS = {
+    "product_name": "order_info|Item",
+    "quantity": "order_info|Quantity",
+    "unit_price": "order_info|Price",
+    "total_price": "order_info|Total",
+}
+INVOICE_ID_FIELD = "total_info|Invoice ID"
+TOTAL_FIELDS = {
+    "invoice_date": "total_info|Date",
+    "subtotal": "total_info|Subtotal",
+    "tax": "total_info|Tax",
+    "total": "total_info|Grand Total",
+}
+
+# NUMBER(12, 2): at most 10 integer digits
+_MAX_NUMBER_12_2 = Decimal("9999999999.99")
+_CENT = Decimal("0.01")
+_DATE_FORMATS = ("%Y-%m-%d", "%m/%d/%Y", "%d-%b-%Y", "%B %d, %Y")
+# Product name of a line DocAI returned no name for (1-based line number)
+UNNAMED_LINE = "(unnamed line {})"
+
+
+def try_cast_number(value, strip_currency=True):
+    """Equivalent of TRY_CAST(REPLACE(REPLACE(v, '$', ''), ',', '') AS NUMBER(12, 2))."""
+    if value is None:
+        return None
+    text = str(value)
+    if strip_currency:
+        text = text.replace("$", "").replace(",", "")
+    try:
+        number = Decimal(text.strip()).quantize(_CENT, rounding=ROUND_HALF_UP)
+    except (InvalidOperation, ValueError):
+        return None
+    if not number.is_finite() or abs(number) > _MAX_NUMBER_12_2:
+        return None
+    return number
+
+
+def try_cast_date(value):
+    """Equivalent of TRY_CAST(v AS DATE) for the formats DocAI returns."""
+    if value is None:
+        return None
+    text = str(value).strip()
+    for fmt in _DATE_FORMATS:
+        try:
+            return datetime.strptime(text, fmt).date()
+        except ValueError:
+            continue
+    return None
+
+
+def _field_values(json_data, field):
+    """Returns the list of `value` entries for a PREDICT field (None where absent)."""
+    entries = json_data.get(field) or []
+    return [entry.get("value") if isinstance(entry, dict) else None for entry in entries]
+
+
+def _first_value(json_data, field):
+    values = _field_values(json_data, field)
+    return values[0] if values else None
+
+
+def extract_invoice_id(json_data):
+    """REPLACE(json_data:"total_info|Invoice ID"[0].value::STRING, '#', '')."""
+    invoice_id = _first_value(json_data, INVOICE_ID_FIELD)
+    return None if invoice_id is None else str(invoice_id).replace("#", "")
+
+
+def extract_line_items(json_data, file_meta=None):
+    """
+    Walks the PREDICT JSON once and emits one row per line index.
+
+    The four `order_info|*` arrays are aligned by position. When they have
+    different lengths the row count is the longest array and missing cells
+    become None, instead of the row being dropped by an inner join on index.
+    A missing product name becomes UNNAMED_LINE.
+    """
+    file_meta = file_meta or {}
+    invoice_id = extract_invoice_id(json_data)
+    columns = {name: _field_values(json_data, field) for name, field in ITEM_FIELDS.items()}
+    line_count = max(len(values) for values in columns.values())
+
+    rows = []
+    for index in range(line_count):
+        cell = {name: (values[index] if index < len(values) else None) for name, values in columns.items()}
+        rows.append({
+            "invoice_id": invoice_id,
+            "product_name": UNNAMED_LINE.format(index + 1) if cell["product_name"] is None else str(cell["product_name"]),
+            # Quantity is cast without stripping '$' / ',' (matches the task)
+            "quantity": try_cast_number(cell["quantity"], strip_currency=False),
+            "unit_price": try_cast_number(cell["unit_price"]),
+            "total_price": try_cast_number(cell["total_price"]),
+            "file_name": file_meta.get("file_name"),
+            "file_size": file_meta.get("file_size"),
+            "last_modified": file_meta.get("last_modified"),
+            "snowflake_file_url": file_meta.get("snowflake_file_url"),
+        })
+    return rows
+
+
+def extract_totals(json_data, file_meta=None):
+    """Emits the single DOCAI_INVOICE_TOTALS row for a PREDICT payload."""
+    file_meta = file_meta or {}
+    return {
+        "invoice_id": extract_invoice_id(json_data),
+        "invoice_date": try_cast_date(_first_value(json_data, TOTAL_FIELDS["invoice_date"])),
+        "subtotal": try_cast_number(_first_value(json_data, TOTAL_FIELDS["subtotal"])),
+        "tax": try_cast_number(_first_value(json_data, TOTAL_FIELDS["tax"])),
+        "total": try_cast_number(_first_value(json_data, TOTAL_FIELDS["total"])),
+        "file_name": file_meta.get("file_name"),
+        "file_size": file_meta.get("file_size"),
+        "last_modified": file_meta.get("last_modified"),
+        "snowflake_file_url": file_meta.get("snowflake_file_url"),
+    }
+
+
+def misaligned_fields(json_data):
+    """Returns {field: length} when the order_info arrays differ in length, else {}."""
+    lengths = {field: len(json_data.get(field) or []) for field in ITEM_FIELDS.values()}
+    return lengths if len(set(lengths.values())) > 1 else {}
+
+
+def _json_default(value):
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    raise TypeError(f"Unsupported type: {type(value)!r}")
+
+
+def main(paths):
+    for path in paths:
+        with open(path) as fh:
+            json_data = json.load(fh)
+        file_meta = {"file_name": path.rsplit("/", 1)[-1]}
+        lengths = misaligned_fields(json_data)
+        if lengths:
+            print(f"warning: {path}: order_info arrays differ in length {lengths}", file=sys.stderr)
+        for row in extract_line_items(json_data, file_meta):
+            print(json.dumps({"table": "DOCAI_INVOICE_ITEMS", **row}, default=_json_default))
+        print(json.dumps({"table": "DOCAI_INVOICE_TOTALS", **extract_totals(json_data, file_meta)}, default=_json_default))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print(__doc__.strip(), file=sys.stderr)
+        sys.exit(2)
+    main(sys.argv[1:])
@@ -0,0 +1,71 @@
+"""
+Write path from the review screen into the gold tables.
+
+A review is sent as one CALL to SP_SUBMIT_REVIEW (docai_invoice_qs_reconcile.sql) with the
+corrected items and totals inlined as JSON bind parameters. The procedure replaces the
+invoice's gold rows and marks it Reviewed in one transaction. Bulk acceptance of DocAI
+values sends only invoice ids to SP_BULK_ACCEPT_DOCAI, which reports the accepted count and
+the ids it skipped.
+"""
+import json
+from dataclasses import dataclass, field
+
+from docai_invoice_qs_templates import template
+
+SUBMIT_REVIEW_PROCEDURE = "doc_ai_qs_db.doc_ai_schema.SP_SUBMIT_REVIEW"
+BULK_ACCEPT_PROCEDURE = "doc_ai_qs_db.doc_ai_schema.SP_BULK_ACCEPT_DOCAI"
+MAX_BULK_INVOICES = 10000
+
+ITEM_COLUMNS = ["PRODUCT_NAME", "QUANTITY", "UNIT_PRICE", "TOTAL_PRICE"]
+TOTAL_COLUMNS = ["INVOICE_DATE", "SUBTOTAL", "TAX", "TOTAL"]
+
+
+@dataclass
+class BulkAcceptResult:
+    message: str
+    accepted: int = 0
+    skipped_invoice_ids: list = field(default_factory=list)  # requested ids without DocAI items or totals
+
+
+@template("submit_review")
+def _submit_review_sql():
+    return f"CALL {SUBMIT_REVIEW_PROCEDURE}(?, ?, ?, ?, ?)"
+
+
+@template("bulk_accept_docai")
+def _bulk_accept_sql():
+    return f"CALL {BULK_ACCEPT_PROCEDURE}(?, ?, ?)"
+
+
+def rows_to_json(df, columns):
+    """JSON array of row objects for `columns`; missing values become null, dates ISO strings."""
+    frame = df.reindex(columns=columns)
+    records = frame.astype(object).where(frame.notna(), None)
+    return json.dumps(records.to_dict(orient="records"), default=str)
+
+
+def submit_review(session, invoice_id, items_df, totals_df, reviewed_by, notes=""):
+    """
+    Replaces the gold rows of `invoice_id` with `items_df` / `totals_df` and marks the invoice
+    Reviewed, atomically. Raises if the procedure fails; nothing is written in that case.
+    """
+    rows = _submit_review_sql().collect(
+        session, [invoice_id, rows_to_json(items_df, ITEM_COLUMNS), rows_to_json(totals_df, TOTAL_COLUMNS), reviewed_by, notes or None],
+    )
+    return rows[0][0] if rows else ""
+
+
+def bulk_accept_docai(session, invoice_ids, reviewed_by, notes=""):
+    """
+    Accepts the DocAI-extracted values for up to MAX_BULK_INVOICES invoices in one CALL.
+    Only the ids are sent; the rows are promoted to gold inside the warehouse. Invoices
+    without both DocAI items and totals are skipped and listed in the returned BulkAcceptResult.
+    """
+    invoice_ids = list(dict.fromkeys(invoice_ids))
+    if not invoice_ids:
+        return BulkAcceptResult("No invoices to accept.")
+    if len(invoice_ids) > MAX_BULK_INVOICES:
+        raise ValueError(f"At most {MAX_BULK_INVOICES} invoices can be accepted at once, got {len(invoice_ids)}.")
+    rows = _bulk_accept_sql().collect(session, [json.dumps(invoice_ids), reviewed_by, notes or None])
+    result = json.loads(rows[0][0]) if rows else {}
+    return BulkAcceptResult(result.get("message", ""), result.get("accepted", 0), result.get("skipped_invoice_ids", []))
@@ -0,0 +1,222 @@
+"""
+Query instrumentation for the app.
+
+`InstrumentedSession` wraps a Snowpark session and records every query it runs (call
+site, latency, rows, approximate result size and query id) into a `QueryLog`, as well as
+stage file operations (`put_stream` / `get_stream`). PDF page renders are added by the
+render cache through `QueryLog.add`. Records are kept in a bounded in-memory ring and
+can be exported as JSON lines.
+"""
+import json
+import os
+import sys
+import threading
+import time
+from collections import deque
+from dataclasses import asdict, dataclass, field
+from datetime import datetime, timezone
+from typing import Optional
+
+DEFAULT_MAX_RECORDS = 2000
+TEXT_LIMIT = 300
+_SIZE_SAMPLE_ROWS = 100
+# DataFrame methods that execute a query
+_TERMINAL_METHODS = {"collect", "to_pandas", "to_arrow", "count", "first", "show"}
+_THIS_FILE = os.path.abspath(__file__)
+_APP_DIR = os.path.dirname(_THIS_FILE)
+# Plumbing between the app's call sites and the session: never reported as the call site
+_SKIPPED_FILES = {_THIS_FILE, os.path.join(_APP_DIR, "docai_invoice_qs_templates.py")}
+
+
+@dataclass
+class QueryRecord:
+    kind: str           # 'sql', 'table', 'put_stream', 'get_stream' or 'render'
+    call_site: str
+    seconds: float
+    rows: Optional[int] = None
+    bytes: Optional[int] = None
+    query_ids: list = field(default_factory=list)
+    text: str = ""
+    error: str = ""
+    started_at: str = ""
+
+
+def call_site():
+    """'file.py:line function' of the nearest caller in this app, outside this module and the template layer."""
+    frame = sys._getframe(1)
+    while frame is not None:
+        filename = os.path.abspath(frame.f_code.co_filename)
+        if filename not in _SKIPPED_FILES and os.path.dirname(filename) == _APP_DIR:
+            return f"{os.path.basename(filename)}:{frame.f_lineno} {frame.f_code.co_name}"
+        frame = frame.f_back
+    return "<unknown>"
+
+
+def _result_size(result):
+    """(rows, approximate bytes) of a collect()/to_pandas()/to_arrow() result, cheap even for large results."""
+    if hasattr(result, "num_rows") and hasattr(result, "nbytes"):
+        return result.num_rows, result.nbytes
+    if hasattr(result, "memory_usage"):
+        return len(result), int(result.memory_usage(index=False, deep=False).sum())
+    if isinstance(result, list):
+        sample = result[:_SIZE_SAMPLE_ROWS]
+        if not sample:
+            return 0, 0
+        sample_bytes = sum(sys.getsizeof(value) for row in sample for value in row)
+        return len(result), sample_bytes * len(result) // len(sample)
+    if isinstance(result, int):
+        return 1, None
+    return None, None
+
+
+class QueryLog:
+    """Thread-safe ring buffer of QueryRecords, shared by all sessions of the app process."""
+
+    def __init__(self, max_records=DEFAULT_MAX_RECORDS):
+        self._records = deque(maxlen=max_records)
+        self._lock = threading.Lock()
+
+    def add(self, record):
+        with self._lock:
+            self._records.append(record)
+
+    def add_render(self, key, seconds, size):
+        """`PageRenderCache.on_render` hook: logs one page render of (document hash, page, scale)."""
+        doc_hash, page_index, scale = key
+        self.add(QueryRecord("render", "page-render", seconds, 1, size, [], f"{doc_hash[:12]} page {page_index + 1} @ {scale}x",
+                             "", datetime.now(timezone.utc).isoformat()))
+
+    def records(self):
+        with self._lock:
+            return list(self._records)
+
+    def clear(self):
+        with self._lock:
+            self._records.clear()
+
+    def to_jsonl(self):
+        return "".join(json.dumps(asdict(record), default=str) + "\n" for record in self.records())
+
+    def summary(self):
+        """Per (kind, call site): calls, total and max seconds, rows and bytes, slowest first."""
+        totals = {}
+        for record in self.records():
+            entry = totals.setdefault((record.kind, record.call_site), {
+                "kind": record.kind, "call_site": record.call_site, "calls": 0, "errors": 0,
+                "total_ms": 0.0, "max_ms": 0.0, "rows": 0, "bytes": 0,
+            })
+            entry["calls"] += 1
+            entry["errors"] += bool(record.error)
+            entry["total_ms"] += record.seconds * 1000
+            entry["max_ms"] = max(entry["max_ms"], record.seconds * 1000)
+            entry["rows"] += record.rows or 0
+            entry["bytes"] += record.bytes or 0
+        return sorted(totals.values(), key=lambda entry: entry["total_ms"], reverse=True)
+
+
+def _timed(log, session, kind, site, text, fn, *args, **kwargs):
+    """Runs `fn`, recording latency, result size and the query ids Snowpark saw meanwhile."""
+    started_at = datetime.now(timezone.utc).isoformat()
+    start = time.perf_counter()
+    error = ""
+    result = None
+    history = session.query_history() if session is not None else None
+    try:
+        if history is not None:
+            with history:
+                result = fn(*args, **kwargs)
+        else:
+            result = fn(*args, **kwargs)
+        return result
+    except Exception as e:
+        error = str(e)[:TEXT_LIMIT]
+        raise
+    finally:
+        rows, size = _result_size(result)
+        query_ids = [q.query_id for q in history.queries] if history is not None else []
+        log.add(QueryRecord(kind, site, time.perf_counter() - start, rows, size, query_ids, text[:TEXT_LIMIT], error, started_at))
+
+
+class _InstrumentedDataFrame:
+    """Proxy for a Snowpark DataFrame: transformations stay lazy, executing methods are recorded."""
+
+    def __init__(self, dataframe, session, log, kind, text, site):
+        self._dataframe = dataframe
+        self._session = session
+        self._log = log
+        self._kind = kind
+        self._text = text
+        self._site = site
+
+    def __getattr__(self, name):
+        attr = getattr(self._dataframe, name)
+        if not callable(attr):
+            return attr
+        if name in _TERMINAL_METHODS:
+            def execute(*args, **kwargs):
+                return _timed(self._log, self._session, self._kind, self._site, self._text, attr, *args, **kwargs)
+            return execute
+
+        def transform(*args, **kwargs):
+            result = attr(*args, **kwargs)
+            if hasattr(result, "collect") and hasattr(result, "schema"):
+                return _InstrumentedDataFrame(result, self._session, self._log, self._kind, f"{self._text} .{name}(...)", self._site)
+            return result
+        return transform
+
+
+class _InstrumentedFileOperation:
+    def __init__(self, file_operation, log):
+        self._file_operation = file_operation
+        self._log = log
+
+    def __getattr__(self, name):
+        return getattr(self._file_operation, name)
+
+    def put_stream(self, input_stream, stage_location, *args, **kwargs):
+        size = input_stream.getbuffer().nbytes if hasattr(input_stream, "getbuffer") else None
+        start = time.perf_counter()
+        error = ""
+        try:
+            return self._file_operation.put_stream(input_stream, stage_location, *args, **kwargs)
+        except Exception as e:
+            error = str(e)[:TEXT_LIMIT]
+            raise
+        finally:
+            self._log.add(QueryRecord("put_stream", call_site(), time.perf_counter() - start, None, size, [], stage_location, error,
+                                      datetime.now(timezone.utc).isoformat()))
+
+    def get_stream(self, stage_location, *args, **kwargs):
+        start = time.perf_counter()
+        error = ""
+        size = None
+        try:
+            stream = self._file_operation.get_stream(stage_location, *args, **kwargs)
+            size = stream.getbuffer().nbytes if hasattr(stream, "getbuffer") else None
+            return stream
+        except Exception as e:
+            error = str(e)[:TEXT_LIMIT]
+            raise
+        finally:
+            self._log.add(QueryRecord("get_stream", call_site(), time.perf_counter() - start, None, size, [], stage_location, error,
+                                      datetime.now(timezone.utc).isoformat()))
+
+
+class InstrumentedSession:
+    """Drop-in wrapper for a Snowpark session that records queries into `log`."""
+
+    def __init__(self, session, log):
+        self._session = session
+        self._log = log
+        self.file = _InstrumentedFileOperation(session.file, log)
+
+    def __getattr__(self, name):
+        return getattr(self._session, name)
+
+    def sql(self, query, params=None):
+        text = " ".join(query.split())
+        dataframe = self._session.sql(query, params=params) if params is not None else self._session.sql(query)
+        return _InstrumentedDataFrame(dataframe, self._session, self._log, "sql", text, call_site())
+
+    def table(self, name):
+        return _InstrumentedDataFrame(self._session.table(name), self._session, self._log, "table", name, call_site())
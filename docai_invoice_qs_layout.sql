@@ -0,0 +1,44 @@
+-- Physical layout of the invoice tables, for deployments created before the CREATE TABLE statements in
+-- docai_invoice_qs_setup.sql / docai_invoice_qs_reconcile.sql declared clustering keys. Safe to re-run.
+--
+-- Nearly every hot path reads or deletes one invoice: the review screen's bronze lookups, the gold
+-- replacement in SP_SUBMIT_REVIEW / SP_BULK_ACCEPT_DOCAI and the auto-promotion, the EXISTS probes of
+-- SP_CHECK_RECONCILE_METRICS and the review status UPDATEs. Clustering on invoice_id lets those prune
+-- to a few micro-partitions. The reconcile results are clustered for the review queue and the
+-- auto-promotion (review_status, then run timestamp) instead, so their invoice_id lookups use search
+-- optimization (Enterprise Edition; skip that section otherwise).
+--
+-- Automatic clustering and search optimization maintain themselves in the background and are billed
+-- as serverless credits. Reclustering does not produce stream records, so the bronze streams are not
+-- affected. Measure before and after with:
+--     python docai_invoice_qs_bench.py --output layout.jsonl layout --connection NAME --label before
+USE ROLE doc_ai_qs_role;
+USE WAREHOUSE doc_ai_qs_wh;
+USE DATABASE doc_ai_qs_db;
+USE SCHEMA doc_ai_schema;
+
+-- Bronze
+ALTER TABLE doc_ai_qs_db.doc_ai_schema.TRANSACT_ITEMS CLUSTER BY (invoice_id);
+ALTER TABLE doc_ai_qs_db.doc_ai_schema.TRANSACT_TOTALS CLUSTER BY (invoice_id);
+ALTER TABLE doc_ai_qs_db.doc_ai_schema.DOCAI_INVOICE_ITEMS CLUSTER BY (invoice_id);
+ALTER TABLE doc_ai_qs_db.doc_ai_schema.DOCAI_INVOICE_TOTALS CLUSTER BY (invoice_id);
+
+-- Gold
+ALTER TABLE doc_ai_qs_db.doc_ai_schema.GOLD_INVOICE_ITEMS CLUSTER BY (invoice_id);
+ALTER TABLE doc_ai_qs_db.doc_ai_schema.GOLD_INVOICE_TOTALS CLUSTER BY (invoice_id);
+
+-- Reconcile
+ALTER TABLE doc_ai_qs_db.doc_ai_schema.RECONCILE_DISCREPANCIES CLUSTER BY (invoice_id);
+ALTER TABLE doc_ai_qs_db.doc_ai_schema.RECONCILE_METRICS_INVOICES CLUSTER BY (invoice_id);
+ALTER TABLE doc_ai_qs_db.doc_ai_schema.RECONCILE_RESULTS_ITEMS CLUSTER BY (review_status, last_reconciled_timestamp);
+ALTER TABLE doc_ai_qs_db.doc_ai_schema.RECONCILE_RESULTS_TOTALS CLUSTER BY (review_status, last_reconciled_timestamp);
+
+-- Search optimization for the invoice_id UPDATEs of the reconcile results (Enterprise Edition)
+ALTER TABLE doc_ai_qs_db.doc_ai_schema.RECONCILE_RESULTS_ITEMS ADD SEARCH OPTIMIZATION ON EQUALITY(invoice_id);
+ALTER TABLE doc_ai_qs_db.doc_ai_schema.RECONCILE_RESULTS_TOTALS ADD SEARCH OPTIMIZATION ON EQUALITY(invoice_id);
+
+-- Clustering depth per table; rerun the benchmark with --label after once it has settled
+SELECT 'TRANSACT_ITEMS' AS table_name, SYSTEM$CLUSTERING_INFORMATION('doc_ai_qs_db.doc_ai_schema.TRANSACT_ITEMS') AS clustering_information
+UNION ALL SELECT 'DOCAI_INVOICE_ITEMS', SYSTEM$CLUSTERING_INFORMATION('doc_ai_qs_db.doc_ai_schema.DOCAI_INVOICE_ITEMS')
+UNION ALL SELECT 'GOLD_INVOICE_ITEMS', SYSTEM$CLUSTERING_INFORMATION('doc_ai_qs_db.doc_ai_schema.GOLD_INVOICE_ITEMS')
+UNION ALL SELECT 'RECONCILE_RESULTS_ITEMS', SYSTEM$CLUSTERING_INFORMATION('doc_ai_qs_db.doc_ai_schema.RECONCILE_RESULTS_ITEMS');
@@ -0,0 +1,785 @@
+"""
+Embedded local backend: an SQLite database standing in for the Snowflake account.
+
+`LocalSession` implements the part of the Snowpark session the app uses (sql().collect() /
+to_pandas() / to_arrow(), table().filter().sort().to_pandas(), write_pandas / write_arrow,
+file.put_stream / get_stream, query_history() and get_current_role()), so the app's data paths run unchanged against it. `LocalWarehouse`
+creates its tables from the CREATE TABLE statements in docai_invoice_qs_setup.sql and
+docai_invoice_qs_reconcile.sql, and implements the procedures the app and the RECONCILE
+task call as Python methods; reconciliation itself is the pandas mirror in
+docai_invoice_qs_reconcile.py.
+
+The few Snowflake-only statements the app issues (INFORMATION_SCHEMA.TABLES, DIRECTORY(),
+QUERY_HISTORY_BY_SESSION, CORTEX.COMPLETE, the summaries MERGE, ALTER STAGE) are answered by statement handlers.
+There are no streams or tasks: `run_reconciliation()` reconciles every invoice, like a
+FULL_REFRESH run, and there is no DocAI PREDICT for uploaded documents.
+"""
+import hashlib
+import io
+import itertools
+import json
+import os
+import random
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from snowflake.snowpark import Row
+
+import docai_invoice_qs_reconcile as reconcile
+from docai_invoice_qs_schema import to_pandas as arrow_to_pandas
+
+_HERE = os.path.dirname(os.path.abspath(__file__))
+SCHEMA_FILES = [os.path.join(_HERE, "docai_invoice_qs_setup.sql"), os.path.join(_HERE, "docai_invoice_qs_reconcile.sql")]
+SAMPLE_DOCUMENTS_DIR = os.path.join(_HERE, "extraction_documents")
+STAGE_NAME = "DOC_AI_STAGE"
+LOCAL_ROLE = '"LOCAL_REVIEWER"'
+
+QueryRecord = namedtuple("QueryRecord", ["query_id", "sql_text"])
+
+_QUALIFIER = re.compile(r"\bDOC_AI_QS_DB\.DOC_AI_SCHEMA\.", re.I)
+_CREATE_TABLE = re.compile(r"CREATE\s+OR\s+REPLACE\s+TABLE\s+(?:\w+\.)*(\w+)\s*\((.*?)\)\s*(?:CLUSTER\s+BY\s*\(([^)]*)\)\s*)?;",
+                           re.I | re.S)
+_WRITE_TARGET = re.compile(r"^\s*(?:INSERT\s+INTO|UPDATE|DELETE\s+FROM|MERGE\s+INTO)\s+(\w+)", re.I)
+_CALL = re.compile(r"^\s*CALL\s+(\w+)\s*\((.*)\)\s*;?\s*$", re.I | re.S)
+
+
+# --- Schema ---
+
+def _sqlite_type(snowflake_type):
+    base = snowflake_type.upper().split("(")[0]
+    if base in ("NUMBER", "DECIMAL", "NUMERIC", "FLOAT", "DOUBLE", "REAL"):
+        return "REAL" if "," in snowflake_type else "NUMERIC"
+    if base in ("INTEGER", "INT", "BIGINT", "BOOLEAN"):
+        return "INTEGER"
+    return "TEXT" # VARCHAR, DATE, TIMESTAMP_*, VARIANT
+
+
+def parse_tables(sql_text):
+    """{TABLE: [(column, sqlite type)]} from the CREATE OR REPLACE TABLE statements in `sql_text`."""
+    tables = {}
+    for name, body, _ in _CREATE_TABLE.findall(re.sub(r"--[^\n]*", "", sql_text)):
+        columns = []
+        for definition in re.split(r",(?![^(]*\))", body):
+            parts = definition.split()
+            if len(parts) >= 2:
+                columns.append((parts[0].lower(), _sqlite_type(" ".join(parts[1:]).split(" DEFAULT")[0])))
+        tables[name.upper()] = columns
+    return tables
+
+
+def parse_clustering(sql_text):
+    """{TABLE: [clustering key columns]} from the CLUSTER BY clauses of the CREATE OR REPLACE TABLE statements."""
+    return {name.upper(): [key.strip().lower() for key in keys.split(",")]
+            for name, _, keys in _CREATE_TABLE.findall(re.sub(r"--[^\n]*", "", sql_text)) if keys}
+
+
+def load_schema(paths=SCHEMA_FILES):
+    tables = {}
+    for path in paths:
+        with open(path) as fh:
+            tables.update(parse_tables(fh.read()))
+    return tables
+
+
+def load_clustering(paths=SCHEMA_FILES):
+    clustering = {}
+    for path in paths:
+        with open(path) as fh:
+            clustering.update(parse_clustering(fh.read()))
+    return clustering
+
+
+def _now():
+    return datetime.now().isoformat(sep=" ", timespec="microseconds")
+
+
+def _sqlite_value(value):
+    if isinstance(value, pd.Timestamp):
+        return value.isoformat(sep=" ")
+    return value
+
+
+def _format_datetimes(values, date_format):
+    """strftime over the distinct values only: dates and run timestamps repeat across many rows."""
+    codes, uniques = pd.factorize(values)
+    formatted = pd.Index(uniques).strftime(date_format).to_numpy(dtype=object)
+    out = np.full(len(values), None, dtype=object)
+    out[codes >= 0] = formatted[codes[codes >= 0]]
+    return pd.Series(out, index=values.index)
+
+
+def _sha2(value, bits=256):
+    """Snowflake SHA2(value, 256) as a SQLite function: hex SHA-256, NULL for NULL."""
+    return hashlib.sha256(str(value).encode("utf-8")).hexdigest() if value is not None else None
+
+
+def _literal(text):
+    """Value of a literal CALL argument: NULL, TRUE/FALSE, a number or a quoted string."""
+    text = text.strip()
+    upper = text.upper()
+    if upper == "NULL":
+        return None
+    if upper in ("TRUE", "FALSE"):
+        return upper == "TRUE"
+    if text.startswith("'"):
+        return text[1:-1].replace("''", "'")
+    return float(text) if "." in text else int(text)
+
+
+def _stage_key(stage_location):
+    """('DOC_AI_STAGE', 'file.pdf') for '@DB.SCHEMA.DOC_AI_STAGE/file.pdf' or '@DOC_AI_STAGE/file.pdf'."""
+    stage, _, path = stage_location.lstrip("@").partition("/")
+    return stage.split(".")[-1].upper(), path
+
+
+# --- Stage files ---
+
+class LocalFileOperation:
+    """Stand-in for `session.file`: keeps staged files in memory and simulates PUT latency."""
+
+    def __init__(self, put_latency=0.0, failure_rate=0.0, seed=0):
+        self.put_latency = put_latency
+        self.failure_rate = failure_rate
+        self.files = {}
+        self.put_calls = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def put_stream(self, input_stream, stage_location, overwrite=False, auto_compress=True):
+        with self._lock:
+            self.put_calls += 1
+            fail = self._rng.random() < self.failure_rate
+        time.sleep(self.put_latency)
+        if fail:
+            raise IOError(f"Simulated PUT failure for {stage_location}")
+        with self._lock:
+            self.files[_stage_key(stage_location)] = input_stream.read()
+
+    def get_stream(self, stage_location, decompress=False):
+        with self._lock:
+            data = self.files.get(_stage_key(stage_location))
+        if data is None:
+            raise FileNotFoundError(f"{stage_location} does not exist in the local stage")
+        return io.BytesIO(data)
+
+    def md5(self, stage, relative_path):
+        with self._lock:
+            data = self.files.get((stage.split(".")[-1].upper(), relative_path))
+        return hashlib.md5(data).hexdigest() if data is not None else None
+
+
+# --- Session ---
+
+class _QueryHistory:
+    def __init__(self, session):
+        self._session = session
+        self.queries = []
+
+    def __enter__(self):
+        with self._session._lock:
+            self._session._histories.append(self)
+        return self
+
+    def __exit__(self, *exc):
+        with self._session._lock:
+            self._session._histories.remove(self)
+
+
+class _LocalResult:
+    """Stand-in for the DataFrame returned by `session.sql()`; the query runs on collect()."""
+
+    def __init__(self, session, query, params):
+        self._session = session
+        self._query = query
+        self._params = params
+
+    def collect(self):
+        return self._session._run(self._query, self._params)
+
+    def to_pandas(self):
+        return self._session._run(self._query, self._params, result="pandas")
+
+    def to_arrow(self):
+        return self._session._run(self._query, self._params, result="arrow")
+
+
+class _LocalTable:
+    """Stand-in for `session.table(name)`: supports the filter/sort/to_pandas chains the app uses."""
+
+    schema = None # InstrumentedSession keeps wrapping results that have a schema
+
+    def __init__(self, session, name, where="", params=(), order=""):
+        self._session = session
+        self._name = name
+        self._where = where
+        self._params = list(params)
+        self._order = order
+
+    @staticmethod
+    def _column_name(expression):
+        return expression.name.strip('"')
+
+    def filter(self, condition):
+        expression = condition._expression
+        if type(expression).__name__ != "EqualTo":
+            raise NotImplementedError(f"LocalSession only supports col(...) == value filters, got {expression!r}")
+        clause = f"{self._column_name(expression.left)} = ?"
+        where = f"{self._where} AND {clause}" if self._where else f" WHERE {clause}"
+        return _LocalTable(self._session, self._name, where, self._params + [expression.right.value], self._order)
+
+    def sort(self, *columns):
+        terms = []
+        for column in columns:
+            expression = column._expression
+            if type(expression).__name__ == "SortOrder":
+                direction = "DESC" if type(expression.direction).__name__ == "Descending" else "ASC"
+                terms.append(f"{self._column_name(expression.child)} {direction}")
+            else:
+                terms.append(self._column_name(expression))
+        return _LocalTable(self._session, self._name, self._where, self._params, " ORDER BY " + ", ".join(terms))
+
+    def _sql(self):
+        return f"SELECT * FROM {self._name}{self._where}{self._order}"
+
+    def collect(self):
+        return self._session._run(self._sql(), self._params)
+
+    def to_pandas(self):
+        return self._session._run(self._sql(), self._params, result="pandas")
+
+    def to_arrow(self):
+        return self._session._run(self._sql(), self._params, result="arrow")
+
+
+class LocalSession:
+    """
+    Stand-in for a Snowpark session with a configurable per-query latency.
+
+    Without a `warehouse` every query returns no rows; with a LocalWarehouse queries and
+    procedure CALLs are answered from its SQLite tables and files are kept in its stage.
+    """
+
+    def __init__(self, query_latency=0.0, file_operation=None, warehouse=None):
+        self.query_latency = query_latency
+        self.warehouse = warehouse
+        self.file = file_operation or (warehouse.files if warehouse is not None else LocalFileOperation())
+        self.queries = []
+        self._histories = []
+        self._query_ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def _run(self, query, params, result="rows"):
+        """Runs `query`; `result` is 'rows' (collect), 'pandas' (to_pandas) or 'arrow' (to_arrow)."""
+        with self._lock:
+            self.queries.append(query)
+            record = QueryRecord(f"local-{next(self._query_ids)}", query)
+            for history in self._histories:
+                history.queries.append(record)
+        time.sleep(self.query_latency)
+        if result == "pandas":
+            return self.warehouse.frame(query, params or []) if self.warehouse is not None else pd.DataFrame()
+        if result == "arrow":
+            return self.warehouse.arrow(query, params or []) if self.warehouse is not None else pa.table({})
+        return self.warehouse.execute(query, params or []) if self.warehouse is not None else []
+
+    def sql(self, query, params=None):
+        return _LocalResult(self, query, params)
+
+    def table(self, name):
+        return _LocalTable(self, name)
+
+    def query_history(self):
+        return _QueryHistory(self)
+
+    def get_current_role(self):
+        return LOCAL_ROLE
+
+    def write_pandas(self, df, table_name, database=None, schema=None, quote_identifiers=True, auto_create_table=False,
+                     overwrite=False, table_type="", **kwargs):
+        """Session.write_pandas: appends `df` to the table (created if missing), or replaces it with `overwrite`."""
+        with self._lock:
+            self.queries.append(f"write_pandas {table_name}")
+        time.sleep(self.query_latency)
+        if self.warehouse is not None:
+            self.warehouse.load(table_name.rsplit(".", 1)[-1].upper(), df, replace=overwrite)
+
+    def write_arrow(self, table, table_name, database=None, schema=None, quote_identifiers=True, auto_create_table=False,
+                    overwrite=False, table_type="", **kwargs):
+        """Session.write_arrow: like write_pandas, for a pyarrow Table."""
+        with self._lock:
+            self.queries.append(f"write_arrow {table_name}")
+        time.sleep(self.query_latency)
+        if self.warehouse is not None:
+            self.warehouse.load(table_name.rsplit(".", 1)[-1].upper(), arrow_to_pandas(table, date_as_object=False), replace=overwrite)
+
+
+# --- Warehouse ---
+
+# SP_REFRESH_RECONCILE_METRICS for the invoices in temp table metrics_affected_invoices
+_REFRESH_METRICS_SQL = """
+CREATE TEMP TABLE metrics_affected_dates AS
+    SELECT invoice_date FROM RECONCILE_METRICS_INVOICES WHERE invoice_id IN (SELECT invoice_id FROM metrics_affected_invoices)
+    UNION
+    SELECT invoice_date FROM TRANSACT_TOTALS WHERE invoice_id IN (SELECT invoice_id FROM metrics_affected_invoices);
+DELETE FROM RECONCILE_METRICS_INVOICES WHERE invoice_id IN (SELECT invoice_id FROM metrics_affected_invoices);
+INSERT INTO RECONCILE_METRICS_INVOICES (invoice_id, invoice_date, total, metric_status, refreshed_timestamp)
+SELECT t.invoice_id, MAX(t.invoice_date), SUM(t.total),
+       CASE
+           WHEN MAX(gt.auto_reconciled) AND MAX(gi.auto_reconciled) THEN 'Auto-reconciled'
+           WHEN MAX(gt.invoice_id) IS NOT NULL AND MAX(gi.invoice_id) IS NOT NULL THEN 'Reviewed'
+           ELSE 'Pending'
+       END,
+       :run_timestamp
+FROM TRANSACT_TOTALS t
+LEFT JOIN (SELECT invoice_id, MAX(reviewed_by = 'Auto-reconciled') AS auto_reconciled FROM GOLD_INVOICE_TOTALS
+           WHERE invoice_id IN (SELECT invoice_id FROM metrics_affected_invoices) GROUP BY invoice_id) gt
+  ON gt.invoice_id = t.invoice_id
+LEFT JOIN (SELECT invoice_id, MAX(reviewed_by = 'Auto-reconciled') AS auto_reconciled FROM GOLD_INVOICE_ITEMS
+           WHERE invoice_id IN (SELECT invoice_id FROM metrics_affected_invoices) GROUP BY invoice_id) gi
+  ON gi.invoice_id = t.invoice_id
+WHERE t.invoice_id IN (SELECT invoice_id FROM metrics_affected_invoices)
+GROUP BY t.invoice_id;
+DELETE FROM RECONCILE_METRICS_DAILY WHERE invoice_date IN (SELECT invoice_date FROM metrics_affected_dates);
+INSERT INTO RECONCILE_METRICS_DAILY (
+    invoice_date, invoice_count, total_amount, reconciled_invoice_count, reconciled_amount,
+    auto_reconciled_invoice_count, auto_reconciled_amount, pending_invoice_count, pending_amount, refreshed_timestamp
+)
+SELECT invoice_date, COUNT(*), SUM(total),
+       SUM(metric_status IN ('Reviewed', 'Auto-reconciled')), SUM(IIF(metric_status IN ('Reviewed', 'Auto-reconciled'), total, 0)),
+       SUM(metric_status = 'Auto-reconciled'), SUM(IIF(metric_status = 'Auto-reconciled', total, 0)),
+       SUM(metric_status = 'Pending'), SUM(IIF(metric_status = 'Pending', total, 0)),
+       :run_timestamp
+FROM RECONCILE_METRICS_INVOICES
+WHERE invoice_date IN (SELECT invoice_date FROM metrics_affected_dates)
+GROUP BY invoice_date;
+DROP TABLE metrics_affected_dates;
+DROP TABLE metrics_affected_invoices;
+"""
+
+# SP_CHECK_RECONCILE_METRICS: dates whose rollup differs from a recomputation over the raw tables
+_CHECK_METRICS_SQL = """
+WITH per_invoice AS (
+    SELECT tt.invoice_id, MAX(tt.invoice_date) AS invoice_date, SUM(tt.total) AS total,
+           EXISTS (SELECT 1 FROM GOLD_INVOICE_TOTALS g WHERE g.invoice_id = tt.invoice_id)
+             AND EXISTS (SELECT 1 FROM GOLD_INVOICE_ITEMS g WHERE g.invoice_id = tt.invoice_id) AS is_reconciled,
+           EXISTS (SELECT 1 FROM GOLD_INVOICE_TOTALS g WHERE g.invoice_id = tt.invoice_id AND g.reviewed_by = 'Auto-reconciled')
+             AND EXISTS (SELECT 1 FROM GOLD_INVOICE_ITEMS g WHERE g.invoice_id = tt.invoice_id AND g.reviewed_by = 'Auto-reconciled') AS is_auto
+    FROM TRANSACT_TOTALS tt
+    GROUP BY tt.invoice_id
+),
+expected AS (
+    SELECT invoice_date, COUNT(*) AS invoice_count, ROUND(SUM(total), 2) AS total_amount,
+           SUM(is_reconciled) AS reconciled_invoice_count, ROUND(SUM(IIF(is_reconciled, total, 0)), 2) AS reconciled_amount,
+           SUM(is_auto) AS auto_reconciled_invoice_count, ROUND(SUM(IIF(is_auto, total, 0)), 2) AS auto_reconciled_amount,
+           COUNT(*) - SUM(is_reconciled) AS pending_invoice_count
+    FROM per_invoice
+    GROUP BY invoice_date
+),
+actual AS (
+    SELECT invoice_date, invoice_count, ROUND(total_amount, 2), reconciled_invoice_count, ROUND(reconciled_amount, 2),
+           auto_reconciled_invoice_count, ROUND(auto_reconciled_amount, 2), pending_invoice_count
+    FROM RECONCILE_METRICS_DAILY
+)
+SELECT DISTINCT invoice_date FROM (
+    SELECT * FROM expected EXCEPT SELECT * FROM actual
+    UNION ALL
+    SELECT * FROM (SELECT * FROM actual EXCEPT SELECT * FROM expected)
+)
+ORDER BY invoice_date
+"""
+
+
+class LocalWarehouse:
+    """
+    SQLite copy of the app's schema that answers the app's queries in place of Snowflake.
+
+    Table names are unqualified and every table is indexed on invoice_id (standing in for
+    clustering / search optimization on it), plus on its CLUSTER BY keys where they differ.
+    Version tokens for INFORMATION_SCHEMA.TABLES.LAST_ALTERED are counters bumped by every write.
+    """
+
+    def __init__(self, path=":memory:", schema=None, clustering=None):
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.create_function("SHA2", 2, _sha2, deterministic=True)
+        self.files = LocalFileOperation()
+        self.tables = schema or load_schema()
+        self.clustering = load_clustering() if clustering is None else clustering
+        self.versions = {}
+        self._lock = threading.RLock()
+        for table, columns in self.tables.items():
+            self.connection.execute(f"DROP TABLE IF EXISTS {table}")
+            self.connection.execute(f"CREATE TABLE {table} ({', '.join(f'{name} {kind}' for name, kind in columns)})")
+        self.create_indexes()
+        self.procedures = {
+            "SP_RUN_ITEM_RECONCILIATION": self.run_item_reconciliation,
+            "SP_RUN_TOTALS_RECONCILIATION": self.run_totals_reconciliation,
+            "SP_REFRESH_RECONCILE_METRICS": self.refresh_metrics,
+            "SP_CHECK_RECONCILE_METRICS": self.check_metrics,
+            "SP_SUBMIT_REVIEW": self.submit_review,
+            "SP_BULK_ACCEPT_DOCAI": self.bulk_accept_docai,
+            "SP_GENERATE_MISMATCH_SUMMARIES": self.generate_mismatch_summaries,
+        }
+        # Snowflake-only statements, answered directly: (pattern, handler(match, params))
+        self.handlers = [
+            (re.compile(r"\bINFORMATION_SCHEMA\.TABLES\b", re.I), self._table_versions),
+            (re.compile(r"\bQUERY_HISTORY_BY_SESSION\(", re.I), self._query_history),
+            (re.compile(r"\bFROM\s+DIRECTORY\(@([\w.]+)\)", re.I), self._directory_md5),
+            (re.compile(r"\bSNOWFLAKE\.CORTEX\.COMPLETE\(", re.I), self._complete),
+            (re.compile(r"^\s*MERGE\s+INTO\s+MISMATCH_SUMMARIES\b", re.I), self._merge_summary),
+            (re.compile(r"^\s*ALTER\s+STAGE\b", re.I), lambda match, params: []),
+        ]
+
+    def create_indexes(self):
+        """The local physical layout: an index on each table's lookup key and one on its clustering keys."""
+        with self._lock:
+            for table, columns in self.tables.items():
+                names = [name for name, _ in columns]
+                key = next((key for key in ("invoice_id", "content_hash", "details_hash", "invoice_date") if key in names), None)
+                if key:
+                    self.connection.execute(f"CREATE INDEX IF NOT EXISTS {table}_KEY ON {table} ({key})")
+                cluster_keys = self.clustering.get(table, [])
+                if cluster_keys and cluster_keys != [key]:
+                    keys = cluster_keys + [name for name in ["invoice_id"] if name in names and name not in cluster_keys]
+                    self.connection.execute(f"CREATE INDEX IF NOT EXISTS {table}_CLUSTER ON {table} ({', '.join(keys)})")
+            self.connection.commit()
+
+    def analyze(self):
+        """Refreshes SQLite's table statistics once data is loaded, so correlated lookups pick the invoice_id index."""
+        with self._lock:
+            self.connection.execute("ANALYZE")
+            self.connection.commit()
+
+    def drop_indexes(self):
+        """Drops every index, leaving only full scans (the layout benchmark's baseline)."""
+        with self._lock:
+            names = [row[0] for row in self.connection.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL")]
+            for name in names:
+                self.connection.execute(f"DROP INDEX {name}")
+            self.connection.commit()
+
+    def _touch(self, tables=None):
+        for table in (tables or self.tables):
+            self.versions[table] = self.versions.get(table, 0) + 1
+
+    def load(self, table, df, replace=False):
+        """Appends `df` (Snowflake-style upper-case columns) to `table`, created if missing; `replace` drops its rows first."""
+        df = df.rename(columns=str.lower)
+        for column in df.columns:
+            if (column.endswith("date") or column.startswith("date_")) and pd.api.types.is_datetime64_any_dtype(df[column]):
+                df[column] = _format_datetimes(df[column], "%Y-%m-%d")
+            elif column.endswith(("timestamp", "modified")):
+                df[column] = _format_datetimes(pd.to_datetime(df[column]), "%Y-%m-%d %H:%M:%S")
+        with self._lock:
+            df.to_sql(table, self.connection, if_exists="replace" if replace else "append", index=False)
+            self.connection.commit()
+            self._touch([table])
+
+    def _translate(self, sql):
+        sql = _QUALIFIER.sub("", sql)
+        sql = sql.replace("ESCAPE '\\\\'", "ESCAPE '\\'") # Snowflake reads ESCAPE '\\' as one backslash; SQLite needs ESCAPE '\'
+        sql = re.sub(r"CURRENT_TIMESTAMP\(\)", "CURRENT_TIMESTAMP", sql, flags=re.I)
+        sql = re.sub(r"^(\s*UPDATE\s+\w+)\s+(\w+)\s+SET\b", r"\1 AS \2 SET", sql, flags=re.I)
+        return re.sub(r"\bFROM VALUES\s+((?:\([^()]*\)\s*,?\s*)+)", r"FROM (VALUES \1)", sql, flags=re.I)
+
+    def execute(self, sql, params=()):
+        """Runs a query, statement or procedure CALL and returns snowpark Rows with upper-case field names."""
+        unqualified = _QUALIFIER.sub("", sql)
+        call = _CALL.match(unqualified)
+        if call:
+            name = call.group(1).upper()
+            args = list(params) if params else [_literal(a) for a in call.group(2).split(",") if a.strip()]
+            return [Row(**{name: self.procedures[name](*args)})]
+        for pattern, handler in self.handlers:
+            match = pattern.search(unqualified)
+            if match:
+                return handler(match, list(params))
+        with self._lock:
+            cursor = self.connection.execute(self._translate(sql), [_sqlite_value(p) for p in params])
+            names = [d[0].upper() for d in cursor.description or []]
+            rows = [Row(**dict(zip(names, values))) for values in cursor.fetchall()]
+            target = _WRITE_TARGET.match(unqualified)
+            if target:
+                self.connection.commit()
+                self._touch([target.group(1).upper()])
+        return rows
+
+    def explain(self, sql, params=()):
+        """SQLite's plan for a query: one 'SCAN ...' (full scan) or 'SEARCH ... USING INDEX ...' step per table access."""
+        with self._lock:
+            cursor = self.connection.execute(f"EXPLAIN QUERY PLAN {self._translate(sql)}", [_sqlite_value(p) for p in params])
+            return [row[-1] for row in cursor.fetchall()]
+
+    def frame(self, sql, params=()):
+        with self._lock:
+            df = pd.read_sql_query(self._translate(sql), self.connection, params=[_sqlite_value(p) for p in params])
+        return df.rename(columns=str.upper)
+
+    def arrow(self, sql, params=()):
+        """Result of a query as a pyarrow Table, built column by column from the SQLite rows."""
+        with self._lock:
+            cursor = self.connection.execute(self._translate(sql), [_sqlite_value(p) for p in params])
+            names = [d[0].upper() for d in cursor.description or []]
+            rows = cursor.fetchall()
+        columns = list(zip(*rows)) if rows else [()] * len(names)
+        return pa.table({name: pa.array(values) for name, values in zip(names, columns)})
+
+    # Snowflake-only statements
+
+    def _table_versions(self, match, params):
+        return [Row(TABLE_SCHEMA="DOC_AI_SCHEMA", TABLE_NAME=table, LAST_ALTERED=self.versions.get(table, 0)) for table in self.tables]
+
+    def _query_history(self, match, params):
+        # SQLite has no result cache: no query is ever served from one
+        return [Row(QUERY_ID=query_id, RESULT_REUSED=False) for query_id in params if query_id]
+
+    def _directory_md5(self, match, params):
+        md5 = self.files.md5(match.group(1), params[0]) if params else None
+        return [Row(MD5=md5)] if md5 else []
+
+    def _complete(self, match, params):
+        return [Row(SUMMARY="Cortex is not available in the local backend; see the mismatch details below.")]
+
+    def _merge_summary(self, match, params):
+        details_hash, invoice_id, summary, model = params
+        self.execute(
+            "INSERT INTO MISMATCH_SUMMARIES (details_hash, invoice_id, summary, model, created_timestamp) "
+            "SELECT ?, ?, ?, ?, ? WHERE NOT EXISTS (SELECT 1 FROM MISMATCH_SUMMARIES WHERE details_hash = ?)",
+            [details_hash, invoice_id, summary, model, _now(), details_hash],
+        )
+        return []
+
+    # Procedures
+
+    def _reconcile(self, source_name, discrepancies_fn, transact_table, docai_table, results_table, gold_table, gold_columns):
+        run_timestamp = _now()
+        discrepancies, invoice_ids = discrepancies_fn(self.frame(f"SELECT * FROM {transact_table}"), self.frame(f"SELECT * FROM {docai_table}"))
+        source = reconcile.summarize_discrepancies(discrepancies, invoice_ids)
+        results = reconcile.merge_results(self.frame(f"SELECT * FROM {results_table}"), source, run_timestamp)
+        promoted = reconcile.ready_for_gold(results, run_timestamp)
+        # Gold rows that already equal bronze are not rewritten
+        unchanged = reconcile.gold_up_to_date(self.frame(f"SELECT * FROM {transact_table}"), self.frame(f"SELECT * FROM {gold_table}"),
+                                              gold_columns, promoted)
+        promoted = [invoice_id for invoice_id in promoted if invoice_id not in unchanged]
+        columns = ", ".join(gold_columns)
+        discrepancies = discrepancies.assign(last_reconciled_timestamp=run_timestamp)
+        for column in ["date_a", "date_b"]:
+            discrepancies[column] = _format_datetimes(discrepancies[column], "%Y-%m-%d")
+        with self._lock, self.connection:
+            # Every invoice is reconciled, so all of this source's discrepancy rows are replaced
+            self.connection.execute("DELETE FROM RECONCILE_DISCREPANCIES WHERE source = ?", [source_name])
+            discrepancies.to_sql("RECONCILE_DISCREPANCIES", self.connection, if_exists="append", index=False)
+            self.connection.execute(f"DELETE FROM {results_table}")
+            results.to_sql(results_table, self.connection, if_exists="append", index=False)
+            self.connection.execute("CREATE TEMP TABLE promoted (invoice_id TEXT PRIMARY KEY)")
+            self.connection.executemany("INSERT INTO promoted VALUES (?)", [(i,) for i in promoted])
+            # Gold rows written by a reviewer are never replaced
+            self.connection.execute(f"""
+                DELETE FROM promoted WHERE invoice_id IN (
+                    SELECT invoice_id FROM {gold_table} WHERE reviewed_by <> '{reconcile.AUTO_RECONCILED}')""")
+            deleted = self.connection.execute(f"DELETE FROM {gold_table} WHERE invoice_id IN (SELECT invoice_id FROM promoted)").rowcount
+            inserted = self.connection.execute(f"""
+                INSERT INTO {gold_table} ({columns}, reviewed_by, reviewed_timestamp)
+                SELECT {columns}, '{reconcile.AUTO_RECONCILED}', ? FROM {transact_table}
+                WHERE invoice_id IN (SELECT invoice_id FROM promoted)""", [run_timestamp]).rowcount
+            self.connection.execute("DROP TABLE promoted")
+            self._touch([results_table, gold_table, "RECONCILE_DISCREPANCIES"])
+        return (f"Reconciliation executed. Discrepancies and auto-reconciled rows merged into {results_table}. "
+                f"Fully auto-reconciled invoices merged into {gold_table} ({inserted} rows inserted, {deleted} rows deleted).")
+
+    def run_item_reconciliation(self, full_refresh=False):
+        return self._reconcile(reconcile.ITEMS_SOURCE, reconcile.item_discrepancies, "TRANSACT_ITEMS", "DOCAI_INVOICE_ITEMS", "RECONCILE_RESULTS_ITEMS",
+                               "GOLD_INVOICE_ITEMS", reconcile.ITEM_COLUMNS)
+
+    def run_totals_reconciliation(self, full_refresh=False):
+        return self._reconcile(reconcile.TOTALS_SOURCE, reconcile.total_discrepancies, "TRANSACT_TOTALS", "DOCAI_INVOICE_TOTALS", "RECONCILE_RESULTS_TOTALS",
+                               "GOLD_INVOICE_TOTALS", reconcile.TOTAL_COLUMNS)
+
+    def refresh_metrics(self, invoice_id=None, full_refresh=False):
+        """SP_REFRESH_RECONCILE_METRICS: one invoice id, a JSON array of ids, or (None) every invoice."""
+        with self._lock, self.connection:
+            self.connection.execute("CREATE TEMP TABLE metrics_affected_invoices (invoice_id TEXT PRIMARY KEY)")
+            if invoice_id is None:
+                self.connection.execute("""
+                    INSERT INTO metrics_affected_invoices
+                    SELECT invoice_id FROM TRANSACT_TOTALS UNION SELECT invoice_id FROM RECONCILE_METRICS_INVOICES""")
+            else:
+                ids = json.loads(invoice_id) if invoice_id.lstrip().startswith("[") else [invoice_id]
+                self.connection.executemany("INSERT OR IGNORE INTO metrics_affected_invoices VALUES (?)", [(i,) for i in ids])
+            refreshed = self.connection.execute("SELECT COUNT(*) FROM metrics_affected_invoices").fetchone()[0]
+            run_timestamp = _now()
+            for statement in _REFRESH_METRICS_SQL.split(";"):
+                if statement.strip():
+                    self.connection.execute(statement, {"run_timestamp": run_timestamp})
+            self._touch(["RECONCILE_METRICS_INVOICES", "RECONCILE_METRICS_DAILY"])
+        return f"Reconciliation metrics refreshed for {refreshed} invoices."
+
+    def check_metrics(self):
+        with self._lock:
+            dates = [row[0] for row in self.connection.execute(_CHECK_METRICS_SQL).fetchall()]
+        if not dates:
+            return "Reconciliation metrics are consistent with the raw tables."
+        return (f"{len(dates)} invoice date(s) differ from the raw tables: {', '.join(str(d) for d in dates)}. "
+                "Run CALL SP_REFRESH_RECONCILE_METRICS(NULL, TRUE); to rebuild.")
+
+    def _mark_reviewed(self, id_table, reviewed_by, review_timestamp, notes):
+        for table in ["RECONCILE_RESULTS_ITEMS", "RECONCILE_RESULTS_TOTALS"]:
+            self.connection.execute(
+                f"UPDATE {table} SET review_status = 'Reviewed', reviewed_by = ?, reviewed_timestamp = ?, notes = ? "
+                f"WHERE invoice_id IN (SELECT invoice_id FROM {id_table})",
+                [reviewed_by, review_timestamp, notes],
+            )
+
+    def submit_review(self, invoice_id, items, totals, reviewed_by, notes):
+        """SP_SUBMIT_REVIEW: replaces the invoice's gold rows and marks it Reviewed in one transaction."""
+        review_timestamp = _now()
+        items, totals = json.loads(items), json.loads(totals)[:1]
+        with self._lock, self.connection:
+            self.connection.execute("CREATE TEMP TABLE submitted (invoice_id TEXT PRIMARY KEY)")
+            self.connection.execute("INSERT INTO submitted VALUES (?)", [invoice_id])
+            self.connection.execute("DELETE FROM GOLD_INVOICE_ITEMS WHERE invoice_id = ?", [invoice_id])
+            self.connection.executemany(
+                "INSERT INTO GOLD_INVOICE_ITEMS (invoice_id, product_name, quantity, unit_price, total_price, reviewed_by, reviewed_timestamp, notes) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [(invoice_id, i["PRODUCT_NAME"], i["QUANTITY"], i["UNIT_PRICE"], i["TOTAL_PRICE"], reviewed_by, review_timestamp, notes)
+                 for i in items],
+            )
+            self.connection.execute("DELETE FROM GOLD_INVOICE_TOTALS WHERE invoice_id = ?", [invoice_id])
+            self.connection.executemany(
+                "INSERT INTO GOLD_INVOICE_TOTALS (invoice_id, invoice_date, subtotal, tax, total, reviewed_by, reviewed_timestamp, notes) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [(invoice_id, str(t["INVOICE_DATE"])[:10], t["SUBTOTAL"], t["TAX"], t["TOTAL"], reviewed_by, review_timestamp, notes)
+                 for t in totals],
+            )
+            self._mark_reviewed("submitted", reviewed_by, review_timestamp, notes)
+            self.connection.execute("DROP TABLE submitted")
+            self._touch(["GOLD_INVOICE_ITEMS", "GOLD_INVOICE_TOTALS", "RECONCILE_RESULTS_ITEMS", "RECONCILE_RESULTS_TOTALS"])
+        self.refresh_metrics(invoice_id)
+        return f"Invoice {invoice_id} reviewed: {len(items)} item row(s) and {len(totals)} totals row(s) written."
+
+    def bulk_accept_docai(self, invoice_ids, reviewed_by, notes):
+        """
+        SP_BULK_ACCEPT_DOCAI: the DocAI rows of every listed invoice with DocAI items and totals replace its gold rows.
+        Returns the procedure's VARIANT as JSON: message, accepted count and skipped ids.
+        """
+        review_timestamp = _now()
+        requested = set(json.loads(invoice_ids))
+        with self._lock, self.connection:
+            self.connection.execute("CREATE TEMP TABLE bulk_accept_invoices (invoice_id TEXT PRIMARY KEY)")
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO bulk_accept_invoices SELECT ? WHERE EXISTS (SELECT 1 FROM DOCAI_INVOICE_TOTALS WHERE invoice_id = ?) "
+                "AND EXISTS (SELECT 1 FROM DOCAI_INVOICE_ITEMS WHERE invoice_id = ?)",
+                [(i, i, i) for i in requested],
+            )
+            accepted_ids = {row[0] for row in self.connection.execute("SELECT invoice_id FROM bulk_accept_invoices")}
+            params = [reviewed_by, review_timestamp, notes]
+            self.connection.execute("DELETE FROM GOLD_INVOICE_ITEMS WHERE invoice_id IN (SELECT invoice_id FROM bulk_accept_invoices)")
+            items_written = self.connection.execute("""
+                INSERT INTO GOLD_INVOICE_ITEMS (invoice_id, product_name, quantity, unit_price, total_price, reviewed_by, reviewed_timestamp, notes)
+                SELECT invoice_id, product_name, quantity, unit_price, total_price, ?, ?, ? FROM DOCAI_INVOICE_ITEMS
+                WHERE invoice_id IN (SELECT invoice_id FROM bulk_accept_invoices)""", params).rowcount
+            self.connection.execute("DELETE FROM GOLD_INVOICE_TOTALS WHERE invoice_id IN (SELECT invoice_id FROM bulk_accept_invoices)")
+            totals_written = self.connection.execute("""
+                INSERT INTO GOLD_INVOICE_TOTALS (invoice_id, invoice_date, subtotal, tax, total, reviewed_by, reviewed_timestamp, notes)
+                SELECT invoice_id, MAX(invoice_date), subtotal, tax, total, ?, ?, ? FROM DOCAI_INVOICE_TOTALS
+                WHERE invoice_id IN (SELECT invoice_id FROM bulk_accept_invoices) GROUP BY invoice_id""", params).rowcount
+            self._mark_reviewed("bulk_accept_invoices", reviewed_by, review_timestamp, notes)
+            self.connection.execute("DROP TABLE bulk_accept_invoices")
+            self._touch(["GOLD_INVOICE_ITEMS", "GOLD_INVOICE_TOTALS", "RECONCILE_RESULTS_ITEMS", "RECONCILE_RESULTS_TOTALS"])
+        self.refresh_metrics(invoice_ids)
+        skipped_ids = sorted(requested - accepted_ids)
+        message = (f"{len(accepted_ids)} invoice(s) accepted with DocAI values: {items_written} item row(s) and "
+                   f"{totals_written} totals row(s) written"
+                   + (f"; {len(skipped_ids)} invoice(s) skipped without DocAI items or totals" if skipped_ids else "") + ".")
+        return json.dumps({"message": message, "accepted": len(accepted_ids), "skipped_invoice_ids": skipped_ids})
+
+    def generate_mismatch_summaries(self):
+        return "Mismatch summaries are not generated in the local backend (no Cortex)."
+
+    # Data
+
+    def load_seed(self):
+        """The seed invoices of docai_invoice_qs_reconcile.sql, with the sample PDFs in the stage."""
+        transact_items, docai_items, transact_totals, docai_totals = reconcile.seed_frames()
+        file_names = {i: f"Custom_Invoice_{i}.pdf" for i in transact_totals["invoice_id"]}
+        self.load("TRANSACT_ITEMS", transact_items)
+        self.load("TRANSACT_TOTALS", transact_totals)
+        self.load("DOCAI_INVOICE_ITEMS", docai_items.assign(file_name=docai_items["invoice_id"].map(file_names)))
+        self.load("DOCAI_INVOICE_TOTALS", docai_totals.assign(file_name=docai_totals["invoice_id"].map(file_names)))
+        for file_name in file_names.values():
+            path = os.path.join(SAMPLE_DOCUMENTS_DIR, file_name)
+            if os.path.exists(path):
+                with open(path, "rb") as fh:
+                    self.files.put_stream(io.BytesIO(fh.read()), f"@{STAGE_NAME}/{file_name}")
+
+    def load_synthetic(self, items, seed=0):
+        """`items` synthetic line items (docai_invoice_qs_synth), without PDFs."""
+        import docai_invoice_qs_synth as synth
+
+        for chunk in synth.iter_chunks(items, seed=seed):
+            self.load("TRANSACT_ITEMS", chunk.transact_items)
+            self.load("TRANSACT_TOTALS", chunk.transact_totals)
+            self.load("DOCAI_INVOICE_ITEMS", chunk.docai_items)
+            self.load("DOCAI_INVOICE_TOTALS", chunk.docai_totals)
+
+    # Task graph
+
+    def _run_stage(self, run_group_id, stage, run):
+        """Runs one stage of the task graph and logs it to PIPELINE_RUN_HISTORY (SP_LOG_PIPELINE_STAGE)."""
+        started = _now()
+        start = time.perf_counter()
+        message = run()
+        with self._lock, self.connection:
+            self.connection.execute("""
+                INSERT INTO PIPELINE_RUN_HISTORY (run_group_id, stage, started_timestamp, completed_timestamp, duration_ms, status_message)
+                VALUES (?, ?, ?, ?, ?, ?)""", [run_group_id, stage, started, _now(), round((time.perf_counter() - start) * 1000), message])
+            self._touch(["PIPELINE_RUN_HISTORY"])
+        return f"{stage}: {message}"
+
+    def record_pipeline_latency(self, run_group_id):
+        """SP_RECORD_PIPELINE_LATENCY; there is no extraction locally, so upload-to-queue latency is NULL."""
+        with self._lock, self.connection:
+            started, queued = self.connection.execute("""
+                SELECT MIN(started_timestamp), MAX(CASE WHEN stage IN ('ITEMS', 'TOTALS') THEN completed_timestamp END)
+                FROM PIPELINE_RUN_HISTORY WHERE run_group_id = ?""", [run_group_id]).fetchone()
+            duration_ms = round((datetime.fromisoformat(queued) - datetime.fromisoformat(started)).total_seconds() * 1000)
+            self.connection.execute("""
+                INSERT INTO PIPELINE_RUN_HISTORY (run_group_id, stage, started_timestamp, completed_timestamp, duration_ms, status_message)
+                VALUES (?, 'PIPELINE', ?, ?, ?, ?)""", [run_group_id, started, queued, duration_ms, "0 documents extracted."])
+            self._touch(["PIPELINE_RUN_HISTORY"])
+        return f"Pipeline run {run_group_id}: {duration_ms} ms processing, n/a ms upload-to-queue."
+
+    def run_reconciliation(self):
+        """
+        What the task graph does after DOCAI_EXTRACT: item and totals reconciliation in parallel,
+        then summaries and the metrics rollup, each stage logged under one run group id.
+        """
+        run_group_id = uuid.uuid4().hex
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            branches = [pool.submit(self._run_stage, run_group_id, "ITEMS", self.run_item_reconciliation),
+                        pool.submit(self._run_stage, run_group_id, "TOTALS", self.run_totals_reconciliation)]
+            messages = [branch.result() for branch in branches]
+        messages.append(self._run_stage(run_group_id, "FINALIZE",
+                                        lambda: f"{self.generate_mismatch_summaries()} {self.refresh_metrics()}"))
+        messages.append(self.record_pipeline_latency(run_group_id))
+        return messages
+
+
+def open_local_session(path=":memory:", items=None, seed=0):
+    """A LocalSession over a new LocalWarehouse loaded with the seed invoices (or `items` synthetic line items) and reconciled."""
+    warehouse = LocalWarehouse(path)
+    if items:
+        warehouse.load_synthetic(items, seed)
+    else:
+        warehouse.load_seed()
+    warehouse.run_reconciliation()
+    warehouse.analyze()
+    return LocalSession(warehouse=warehouse)
@@ -0,0 +1,348 @@
+"""
+Parallel local pre-parser for bulk backfills of invoice PDFs.
+
+Backfill documents in the layout of extraction_documents/Custom_Invoice_*.pdf carry a text
+layer, so most of them can be parsed without DOC_AI_QS_INVOICES!PREDICT. Text is extracted
+with pypdfium2 across a process pool and parsed into DOCAI_INVOICE_ITEMS /
+DOCAI_INVOICE_TOTALS rows, cast the same way as the DOCAI_EXTRACT task
+(docai_invoice_qs_extract). A parse is only trusted if it passes the confidence checks
+(lines present, quantity x price = line total, lines sum to the subtotal, subtotal + tax =
+grand total); the other documents are staged for PREDICT as usual.
+
+Parsed rows are bulk-loaded in batches: each batch is built as Arrow tables in the schemas
+of docai_invoice_qs_schema (the parser's Decimal and date values go in unconverted), written
+to temporary tables with write_arrow and replaces the invoices' DOCAI_* rows in one DELETE + INSERT per table. The
+documents' content hashes go into DOCAI_DOCUMENT_HASHES, so DOCAI_EXTRACT skips PREDICT
+for them if they are staged later (--stage-parsed, for the app's PDF viewer).
+
+Usage:
+    python docai_invoice_qs_preparse.py 'backfill/*.pdf' --out preparsed/ [--workers 8] [--batch-size 5000]
+    python docai_invoice_qs_preparse.py 'backfill/*.pdf' --load [--connection NAME] [--stage-parsed]
+"""
+import argparse
+import glob
+import hashlib
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from decimal import Decimal
+
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+
+import docai_invoice_qs_extract as extract
+from docai_invoice_qs_schema import from_rows
+from docai_invoice_qs_templates import template
+
+DEFAULT_BATCH_SIZE = 5000 # documents per bulk load
+STAGING_TABLES = {"items": "PREPARSE_ITEMS", "totals": "PREPARSE_TOTALS", "documents": "PREPARSE_DOCUMENTS"}
+ITEM_COLUMNS = ["invoice_id", "product_name", "quantity", "unit_price", "total_price", "file_name", "file_size", "last_modified", "snowflake_file_url"]
+TOTAL_COLUMNS = ["invoice_id", "invoice_date", "subtotal", "tax", "total", "file_name", "file_size", "last_modified", "snowflake_file_url"]
+DOCUMENT_SCHEMA = pa.schema([("CONTENT_HASH", pa.string()), ("FILE_NAME", pa.string()), ("FILE_SIZE", pa.int64())])
+
+_TOLERANCE = Decimal("0.01")
+_AMOUNT = r"\$?-?[\d,]*\.\d{2}"
+_INVOICE_ID = re.compile(r"^Invoice(?:\s+ID)?:?\s*(#?\s*\S+)$", re.I)
+_DATE = re.compile(r"^Date:?\s*(.+)$", re.I)
+_ITEM_HEADER = re.compile(r"^Item\s+Quantity\s+Price\s+Total$", re.I)
+_ITEM = re.compile(rf"^(?P<product>.+?)\s+(?P<quantity>-?[\d,]*\.?\d+)\s+(?P<price>{_AMOUNT})\s+(?P<total>{_AMOUNT})$")
+_SUBTOTAL = re.compile(rf"^Subtotal:?\s+({_AMOUNT})$", re.I)
+_TAX = re.compile(rf"^Tax(?:\s*\([^)]*\))?:?\s+({_AMOUNT})$", re.I)
+_GRAND_TOTAL = re.compile(rf"^Grand\s+Total:?\s+({_AMOUNT})$", re.I)
+
+
+@dataclass
+class ParsedDocument:
+    file_name: str
+    file_size: int
+    last_modified: datetime
+    content_hash: str
+    items: list
+    totals: dict
+    issues: list # failed confidence checks; empty when the parse can be trusted
+
+    @property
+    def confident(self):
+        return not self.issues
+
+
+def parse_invoice_text(text, file_meta=None):
+    """(item rows, totals row, unparsed lines) from the text layer of one invoice."""
+    file_meta = file_meta or {}
+    invoice_id = invoice_date = subtotal = tax = total = None
+    items, unparsed, in_items = [], [], False
+    for line in (line.strip() for line in text.splitlines()):
+        if not line:
+            continue
+        if _ITEM_HEADER.match(line):
+            in_items = True
+        elif match := _SUBTOTAL.match(line):
+            subtotal, in_items = match.group(1), False
+        elif match := _TAX.match(line):
+            tax = match.group(1)
+        elif match := _GRAND_TOTAL.match(line):
+            total = match.group(1)
+        elif in_items:
+            match = _ITEM.match(line)
+            if match:
+                items.append(match.groupdict())
+            else:
+                unparsed.append(line)
+        elif invoice_id is None and (match := _INVOICE_ID.match(line)):
+            invoice_id = match.group(1).replace("#", "").strip()
+        elif invoice_date is None and (match := _DATE.match(line)):
+            invoice_date = match.group(1)
+
+    meta = {name: file_meta.get(name) for name in ("file_name", "file_size", "last_modified", "snowflake_file_url")}
+    item_rows = [{
+        "invoice_id": invoice_id,
+        "product_name": item["product"],
+        # Quantity is cast without stripping '$' / ',' (matches the task)
+        "quantity": extract.try_cast_number(item["quantity"], strip_currency=False),
+        "unit_price": extract.try_cast_number(item["price"]),
+        "total_price": extract.try_cast_number(item["total"]),
+        **meta,
+    } for item in items]
+    totals_row = {
+        "invoice_id": invoice_id,
+        "invoice_date": extract.try_cast_date(invoice_date),
+        "subtotal": extract.try_cast_number(subtotal),
+        "tax": extract.try_cast_number(tax),
+        "total": extract.try_cast_number(total),
+        **meta,
+    }
+    return item_rows, totals_row, unparsed
+
+
+def confidence_issues(item_rows, totals_row, unparsed=()):
+    """Failed confidence checks of a parse; an empty list means the rows can be loaded without PREDICT."""
+    issues = []
+    if not totals_row["invoice_id"]:
+        issues.append("no invoice id")
+    if totals_row["invoice_date"] is None:
+        issues.append("no invoice date")
+    if unparsed:
+        issues.append(f"{len(unparsed)} unparsed line(s)")
+    if not item_rows:
+        issues.append("no line items")
+    elif any(row[name] is None for row in item_rows for name in ("quantity", "unit_price", "total_price")):
+        issues.append("unreadable line amount")
+    else:
+        if any(abs(row["quantity"] * row["unit_price"] - row["total_price"]) > _TOLERANCE for row in item_rows):
+            issues.append("quantity x price differs from line total")
+        if totals_row["subtotal"] is None or abs(sum(row["total_price"] for row in item_rows) - totals_row["subtotal"]) > _TOLERANCE:
+            issues.append("line totals do not sum to subtotal")
+    if None in (totals_row["subtotal"], totals_row["tax"], totals_row["total"]):
+        issues.append("unreadable totals")
+    elif abs(totals_row["subtotal"] + totals_row["tax"] - totals_row["total"]) > _TOLERANCE:
+        issues.append("subtotal + tax differs from grand total")
+    return issues
+
+
+def parse_document(path):
+    """Extracts and parses one PDF; runs in the worker processes."""
+    import pypdfium2 as pdfium
+
+    with open(path, "rb") as fh:
+        data = fh.read()
+    file_meta = {
+        "file_name": os.path.basename(path),
+        "file_size": len(data),
+        "last_modified": datetime.fromtimestamp(os.path.getmtime(path), tz=timezone.utc),
+    }
+    try:
+        pdf = pdfium.PdfDocument(data)
+        try:
+            text = "\n".join(page.get_textpage().get_text_range() for page in pdf)
+        finally:
+            pdf.close()
+    except pdfium.PdfiumError as e:
+        return ParsedDocument(**file_meta, content_hash=hashlib.md5(data).hexdigest(), items=[], totals={}, issues=[f"unreadable PDF: {e}"])
+    if not text.strip():
+        return ParsedDocument(**file_meta, content_hash=hashlib.md5(data).hexdigest(), items=[], totals={}, issues=["no text layer"])
+    item_rows, totals_row, unparsed = parse_invoice_text(text, file_meta)
+    return ParsedDocument(**file_meta, content_hash=hashlib.md5(data).hexdigest(), items=item_rows, totals=totals_row,
+                          issues=confidence_issues(item_rows, totals_row, unparsed))
+
+
+@dataclass
+class PreparseBatch:
+    items: pa.Table # DOCAI_INVOICE_ITEMS schema
+    totals: pa.Table # DOCAI_INVOICE_TOTALS schema
+    documents: pa.Table # DOCUMENT_SCHEMA
+    fallback: list # ParsedDocuments that need PREDICT
+
+
+def _batch(documents):
+    parsed = [doc for doc in documents if doc.confident]
+    return PreparseBatch(
+        items=from_rows([row for doc in parsed for row in doc.items], "DOCAI_INVOICE_ITEMS"),
+        totals=from_rows([doc.totals for doc in parsed], "DOCAI_INVOICE_TOTALS"),
+        documents=pa.Table.from_pylist([{"CONTENT_HASH": doc.content_hash, "FILE_NAME": doc.file_name, "FILE_SIZE": doc.file_size}
+                                        for doc in parsed], schema=DOCUMENT_SCHEMA),
+        fallback=[doc for doc in documents if not doc.confident],
+    )
+
+
+def preparse(paths, workers=None, batch_size=DEFAULT_BATCH_SIZE):
+    """Yields a PreparseBatch per `batch_size` documents, parsed across `workers` processes."""
+    workers = workers or os.cpu_count() or 1
+    chunksize = max(1, min(64, len(paths) // (workers * 4)))
+    pending = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for document in pool.map(parse_document, paths, chunksize=chunksize):
+            pending.append(document)
+            if len(pending) >= batch_size:
+                yield _batch(pending)
+                pending = []
+    if pending:
+        yield _batch(pending)
+
+
+# --- Bulk load ---
+
+@template("preparse_delete_replaced")
+def _delete_replaced_sql(target_table, staged_totals):
+    return f"DELETE FROM {target_table} WHERE invoice_id IN (SELECT invoice_id FROM {staged_totals})"
+
+
+@template("preparse_insert_staged")
+def _insert_staged_sql(target_table, staged_table, columns):
+    return f"INSERT INTO {target_table} ({columns}) SELECT {columns} FROM {staged_table}"
+
+
+@template("preparse_register_hashes")
+def _register_hashes_sql(hash_table, staged_documents):
+    return f"""
+        INSERT INTO {hash_table} (content_hash, file_name, file_size, extracted_timestamp, duplicate_count)
+        SELECT d.content_hash, MIN(d.file_name), MIN(d.file_size), CURRENT_TIMESTAMP(), COUNT(*) - 1
+        FROM {staged_documents} d
+        WHERE NOT EXISTS (SELECT 1 FROM {hash_table} h WHERE h.content_hash = d.content_hash)
+        GROUP BY d.content_hash
+    """
+
+
+def load_batch(session, batch, database, schema):
+    """Replaces the DOCAI_* rows of the batch's invoices and registers the parsed documents' hashes."""
+    if not batch.totals.num_rows:
+        return 0
+    qualified = f"{database}.{schema}"
+    for key, table in [("items", batch.items), ("totals", batch.totals), ("documents", batch.documents)]:
+        session.write_arrow(table, STAGING_TABLES[key], database=database, schema=schema, quote_identifiers=False,
+                            auto_create_table=True, table_type="temporary", overwrite=True)
+    staged_totals = f"{qualified}.{STAGING_TABLES['totals']}"
+    for target, key, columns in [("DOCAI_INVOICE_ITEMS", "items", ITEM_COLUMNS), ("DOCAI_INVOICE_TOTALS", "totals", TOTAL_COLUMNS)]:
+        _delete_replaced_sql(f"{qualified}.{target}", staged_totals).collect(session)
+        _insert_staged_sql(f"{qualified}.{target}", f"{qualified}.{STAGING_TABLES[key]}", ", ".join(columns)).collect(session)
+    _register_hashes_sql(f"{qualified}.DOCAI_DOCUMENT_HASHES", f"{qualified}.{STAGING_TABLES['documents']}").collect(session)
+    return batch.totals.num_rows
+
+
+def write_batch(batch, directory, first):
+    """Appends the batch to DOCAI_INVOICE_ITEMS.csv / DOCAI_INVOICE_TOTALS.csv / DOCAI_DOCUMENT_HASHES.csv under `directory`."""
+    os.makedirs(directory, exist_ok=True)
+    for name, table in [("DOCAI_INVOICE_ITEMS", batch.items), ("DOCAI_INVOICE_TOTALS", batch.totals), ("DOCAI_DOCUMENT_HASHES", batch.documents)]:
+        with open(os.path.join(directory, f"{name}.csv"), "wb" if first else "ab") as fh:
+            pa_csv.write_csv(table, fh, pa_csv.WriteOptions(include_header=first))
+
+
+@dataclass
+class PreparseSummary:
+    documents: int = 0
+    parsed: int = 0
+    fallback: list = field(default_factory=list) # (path, issues)
+    parse_seconds: float = 0.0
+    load_seconds: float = 0.0
+    workers: int = 1
+
+    def report(self):
+        seconds = self.parse_seconds + self.load_seconds
+        docs_per_second = self.documents / seconds if seconds else 0.0
+        return {
+            "documents": self.documents, "parsed": self.parsed, "fallback": len(self.fallback), "workers": self.workers,
+            "parse_seconds": round(self.parse_seconds, 3), "load_seconds": round(self.load_seconds, 3),
+            "docs_per_second": round(docs_per_second, 1),
+            "docs_per_second_per_core": round(docs_per_second / min(self.workers, os.cpu_count() or 1), 1),
+        }
+
+
+def run(paths, workers=None, batch_size=DEFAULT_BATCH_SIZE, session=None, database="DOC_AI_QS_DB", schema="DOC_AI_SCHEMA", out=None):
+    """Parses `paths` and loads each batch into `session` and/or writes it under `out`. Returns a PreparseSummary."""
+    summary = PreparseSummary(workers=workers or os.cpu_count() or 1)
+    directory = {os.path.basename(path): path for path in paths}
+    start = time.perf_counter()
+    for batch_no, batch in enumerate(preparse(paths, summary.workers, batch_size)):
+        summary.parse_seconds += time.perf_counter() - start
+        start = time.perf_counter()
+        if session is not None:
+            load_batch(session, batch, database, schema)
+        if out is not None:
+            write_batch(batch, out, batch_no == 0)
+        summary.load_seconds += time.perf_counter() - start
+        summary.documents += batch.totals.num_rows + len(batch.fallback)
+        summary.parsed += batch.totals.num_rows
+        summary.fallback += [(directory[doc.file_name], doc.issues) for doc in batch.fallback]
+        start = time.perf_counter()
+    summary.parse_seconds += time.perf_counter() - start
+    return summary
+
+
+def stage_documents(session, stage_name, paths):
+    """PUTs `paths` to the DocAI stage; DOCAI_EXTRACT runs PREDICT on those whose hash is not registered."""
+    from docai_invoice_qs_upload import upload_batch
+
+    files = []
+    for path in paths:
+        with open(path, "rb") as fh:
+            files.append((os.path.basename(path), fh.read()))
+    return upload_batch(session, stage_name, files)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("patterns", nargs="+", help="PDF paths or glob patterns")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--out", help="write the parsed rows as CSV (ready for COPY INTO) to this directory")
+    parser.add_argument("--load", action="store_true", help="bulk-load into DOCAI_* and stage the fallback documents for PREDICT")
+    parser.add_argument("--connection", help="Snowflake connection name (connections.toml) for --load")
+    parser.add_argument("--stage-parsed", action="store_true", help="with --load, also stage the parsed documents (no PREDICT)")
+    args = parser.parse_args(argv)
+
+    paths = sorted({path for pattern in args.patterns for path in glob.glob(pattern)})
+    if not paths:
+        raise SystemExit(f"No documents match {args.patterns}")
+    session = None
+    if args.load:
+        from docai_invoice_qs_backend import backend_name, connect
+
+        if backend_name() == "local":
+            session = connect()
+        else:
+            from snowflake.snowpark import Session
+
+            session = Session.builder.config("connection_name", args.connection).create() if args.connection else connect()
+    summary = run(paths, args.workers, args.batch_size, session, out=args.out)
+    report = summary.report()
+    if session is not None:
+        stage_paths = [path for path, _ in summary.fallback]
+        if args.stage_parsed:
+            stage_paths = paths
+        if stage_paths:
+            staged = stage_documents(session, "DOC_AI_QS_DB.DOC_AI_SCHEMA.DOC_AI_STAGE", stage_paths)
+            report["staged"] = len(staged.uploaded)
+    if args.out:
+        with open(os.path.join(args.out, "fallback.txt"), "w") as fh:
+            fh.writelines(f"{path}\t{'; '.join(issues)}\n" for path, issues in summary.fallback)
+    for path, issues in summary.fallback:
+        print(f"fallback to PREDICT: {path}: {'; '.join(issues)}", file=sys.stderr)
+    print(report)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,176 @@
+"""
+Change-aware cache of query results, shared by all sessions of the app.
+
+Each entry is keyed by the query (a name plus its parameters) and stamped with the
+version token (INFORMATION_SCHEMA.TABLES.LAST_ALTERED) of every table it reads. An entry
+is served until one of those tables changes; the tokens of all tracked tables are
+fetched with one metadata query, at most once per `check_interval` seconds.
+
+Writes made by the app itself read the tokens with `before_write` and then call
+`record_write`, which drops the entries tagged with the written invoices (or with the
+named groups) and re-stamps the others that were current right before the write, so one
+reviewer's submission does not throw away every other cached result.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from docai_invoice_qs_templates import template
+
+DEFAULT_CAPACITY = 256
+DEFAULT_CHECK_INTERVAL = 2.0
+
+
+class _Entry:
+    __slots__ = ("value", "versions", "tags")
+
+    def __init__(self, value, versions, tags):
+        self.value = value
+        self.versions = versions
+        self.tags = tags
+
+
+@template("table_versions")
+def _table_versions_sql(database, table_count):
+    conditions = " OR ".join("(table_schema = ? AND table_name = ?)" for _ in range(table_count))
+    return f"SELECT table_schema, table_name, last_altered FROM {database}.INFORMATION_SCHEMA.TABLES WHERE {conditions}"
+
+
+def fetch_table_versions(session, tables):
+    """{fully qualified table name: LAST_ALTERED} for `tables`, one query per database."""
+    by_database = {}
+    for table in tables:
+        database, schema, name = table.upper().split(".")
+        by_database.setdefault(database, []).append((schema, name, table))
+    versions = {}
+    for database, entries in by_database.items():
+        params = [value for schema, name, _ in entries for value in (schema, name)]
+        rows = _table_versions_sql(database, len(entries)).collect(session, params)
+        found = {(row["TABLE_SCHEMA"], row["TABLE_NAME"]): row["LAST_ALTERED"] for row in rows}
+        for schema, name, table in entries:
+            versions[table] = found.get((schema, name))
+    return versions
+
+
+class QueryResultCache:
+    """
+    Thread-safe LRU of query results validated against table version tokens.
+
+    Tags are invoice ids and group names; `record_write` invalidates by tag.
+    """
+
+    def __init__(self, session, capacity=DEFAULT_CAPACITY, check_interval=DEFAULT_CHECK_INTERVAL,
+                 version_fn=fetch_table_versions):
+        self.session = session
+        self.capacity = capacity
+        self.check_interval = check_interval
+        self.version_fn = version_fn
+        self._entries = OrderedDict()
+        self._tables = set()
+        self._versions = {}
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.invalidations = 0
+        self.version_checks = 0
+
+    def _current_versions(self, tables, force=False):
+        """Version tokens for `tables`, refreshing all tracked tables if the last check is too old."""
+        with self._lock:
+            new_tables = set(tables) - self._tables
+            self._tables.update(tables)
+            due = force or new_tables or time.monotonic() - self._checked_at >= self.check_interval
+            tracked = sorted(self._tables)
+        if due:
+            versions = self.version_fn(self.session, tracked)
+            with self._lock:
+                self._versions.update(versions)
+                self._checked_at = time.monotonic()
+                self.version_checks += 1
+        with self._lock:
+            return {table: self._versions.get(table) for table in tables}
+
+    def versions(self, tables):
+        """Current version tokens of `tables` (checked at most once per `check_interval`), which start being tracked."""
+        return self._current_versions(tables)
+
+    def get(self, key, tables, loader, tags=(), tag_fn=None):
+        """
+        Returns the cached result of `loader()` for `key`, reloading it if any of `tables` changed.
+
+        `tags` (or `tag_fn(result)`, e.g. the invoice ids a result contains) are what
+        `record_write` invalidates by.
+        """
+        versions = self._current_versions(tables)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.versions == versions:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry.value
+            if entry is not None:
+                self.stale += 1
+            self.misses += 1
+
+        value = loader()
+        entry_tags = frozenset(tags) | frozenset(tag_fn(value) if tag_fn else ())
+        with self._lock:
+            self._entries[key] = _Entry(value, versions, entry_tags)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+        return value
+
+    def invalidate(self, tags):
+        """Drops every entry carrying one of `tags`."""
+        tags = set(tags)
+        with self._lock:
+            doomed = [key for key, entry in self._entries.items() if entry.tags & tags]
+            for key in doomed:
+                del self._entries[key]
+            self.invalidations += len(doomed)
+        return len(doomed)
+
+    def before_write(self):
+        """Version tokens of all tracked tables, read right before the app writes; passed on to `record_write`."""
+        with self._lock:
+            tracked = sorted(self._tables)
+        return self._current_versions(tracked, force=True) if tracked else {}
+
+    def record_write(self, invoice_ids=(), groups=(), before=None):
+        """
+        Called after the app wrote data for `invoice_ids`: drops their entries and entries in
+        `groups`, then checks the others against the post-write version tokens.
+
+        An entry whose tokens equal `before` (from `before_write()`) is re-stamped with the
+        post-write tokens; any other entry reading a changed table is dropped, so a write
+        made elsewhere before `before_write()` is never absorbed. Without `before`, every
+        entry reading a table the write changed is dropped.
+        """
+        self.invalidate(set(invoice_ids) | set(groups))
+        with self._lock:
+            tracked = sorted(self._tables)
+        if not tracked:
+            return
+        after = self._current_versions(tracked, force=True)
+        with self._lock:
+            doomed = []
+            for key, entry in self._entries.items():
+                if all(entry.versions.get(table) == after.get(table) for table in entry.versions):
+                    continue
+                if before is not None and all(entry.versions.get(table) == before.get(table) for table in entry.versions):
+                    entry.versions = {table: after.get(table) for table in entry.versions}
+                else:
+                    doomed.append(key)
+            for key in doomed:
+                del self._entries[key]
+            self.invalidations += len(doomed)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {"hits": self.hits, "misses": self.misses, "stale": self.stale, "invalidations": self.invalidations,
+                    "version_checks": self.version_checks, "entries": len(self._entries),
+                    "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0}
@@ -0,0 +1,202 @@
+"""
+Server-side paginated review queue over RECONCILE_RESULTS_ITEMS / RECONCILE_RESULTS_TOTALS.
+
+Pages are fetched with keyset pagination on (last_reconciled_timestamp, invoice_id),
+newest first, projecting only the columns the queue needs. The keyset and LIMIT are
+applied to each table before the two are merged, so a page reads at most two pages of
+rows rather than the whole filtered queue. The wide
+item_mismatch_details strings are fetched separately, for one page at a time. All queries
+are docai_invoice_qs_templates templates with bound filter values.
+"""
+from dataclasses import dataclass
+
+from docai_invoice_qs_templates import in_list, template
+
+DEFAULT_PAGE_SIZE = 50
+ALL_STATUSES = "All"
+ALL_MISMATCH_TYPES = "All"
+DISCREPANCIES_TABLE_NAME = "RECONCILE_DISCREPANCIES"
+
+
+@dataclass(frozen=True)
+class QueueCursor:
+    """Position after the last row of a page: (last_reconciled_timestamp, invoice_id)."""
+    last_reconciled_timestamp: object
+    invoice_id: str
+
+
+@dataclass
+class QueuePage:
+    rows: list          # dicts with INVOICE_ID, REVIEW_STATUS, LAST_RECONCILED_TIMESTAMP
+    next_cursor: QueueCursor | None
+
+    @property
+    def invoice_ids(self):
+        return [row["INVOICE_ID"] for row in self.rows]
+
+
+def _escape_like(text):
+    return text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def _discrepancies_table(items_table):
+    """RECONCILE_DISCREPANCIES in the schema of `items_table`."""
+    return f"{items_table.rsplit('.', 1)[0]}.{DISCREPANCIES_TABLE_NAME}" if "." in items_table else DISCREPANCIES_TABLE_NAME
+
+
+def _queue_filter(status_filter, invoice_prefix, mismatch_type=ALL_MISMATCH_TYPES):
+    """
+    (shape, filter values) shared by the page, count and id queries; shape is (by_status, by_prefix, by_type).
+    The prefix and mismatch type select invoices, the status selects rows of either table.
+    """
+    by_status, by_prefix = status_filter != ALL_STATUSES, bool(invoice_prefix)
+    by_type = bool(mismatch_type) and mismatch_type != ALL_MISMATCH_TYPES
+    values = {
+        "status": [status_filter] if by_status else [],
+        "invoice": ([_escape_like(invoice_prefix) + "%"] if by_prefix else []) + ([mismatch_type] if by_type else []),
+    }
+    return (by_status, by_prefix, by_type), values
+
+
+def _row_filter(alias, items_table, by_status, by_prefix, by_type):
+    """WHERE clauses on one reconcile table's rows; binds: status, then prefix, then mismatch type."""
+    clauses = []
+    if by_status:
+        clauses.append(f"{alias}.review_status = ?")
+    if by_prefix:
+        clauses.append(f"{alias}.invoice_id LIKE ? ESCAPE '\\\\'")
+    if by_type:
+        # Structured discrepancy rows, not the mismatch strings
+        clauses.append(f"{alias}.invoice_id IN (SELECT invoice_id FROM {_discrepancies_table(items_table)} WHERE mismatch_type = ?)")
+    return clauses
+
+
+def _queue_rows(table, other_table, items_table, shape, after_cursor, limit, ties_to_other):
+    """
+    The queued rows of `table` that carry their invoice's queue position, newest first, at most `limit`.
+
+    An invoice is queued by its items row, its totals row or both, and sorts by the newer
+    of the two. A row is skipped when the other table holds a newer queued row of the same
+    invoice (or an equally new one, if `ties_to_other`), so each invoice comes from exactly
+    one table and the keyset and LIMIT apply per table instead of to the whole queue.
+    """
+    by_status = shape[0]
+    clauses = _row_filter("q", items_table, *shape)
+    newer = ">=" if ties_to_other else ">"
+    other_status = " AND o.review_status = ?" if by_status else ""
+    clauses.append(f"NOT EXISTS (SELECT 1 FROM {other_table} o WHERE o.invoice_id = q.invoice_id{other_status} "
+                   f"AND o.last_reconciled_timestamp {newer} q.last_reconciled_timestamp)")
+    if after_cursor:
+        clauses.append("(q.last_reconciled_timestamp < ? OR (q.last_reconciled_timestamp = ? AND q.invoice_id < ?))")
+    limit_clause = f"LIMIT {int(limit)}" if limit else ""
+    return f"""
+        SELECT * FROM (
+            SELECT q.invoice_id, q.last_reconciled_timestamp FROM {table} q
+            WHERE {" AND ".join(clauses)}
+            ORDER BY q.last_reconciled_timestamp DESC, q.invoice_id DESC
+            {limit_clause}
+        )
+    """
+
+
+def _queue_params(shape, values, cursor=None):
+    """Binds of _queue_page_sql / _queue_invoice_ids_sql in statement order."""
+    keyset = [cursor.last_reconciled_timestamp, cursor.last_reconciled_timestamp, cursor.invoice_id] if cursor is not None else []
+    per_table = values["status"] + values["invoice"] + values["status"] + keyset
+    return per_table + per_table + values["status"] + values["status"]
+
+
+@template("queue_page")
+def _queue_page_sql(items_table, totals_table, shape, after_cursor, limit):
+    """
+    One page (at most `limit` invoices) of the queue after the cursor: bounded per-table
+    candidates merged into the page, then their review status from both tables.
+    """
+    limit_clause = f"LIMIT {int(limit)}" if limit else ""
+    status = " AND {}.review_status = ?" if shape[0] else ""
+    return f"""
+        WITH page AS (
+            SELECT invoice_id, last_reconciled_timestamp FROM (
+                {_queue_rows(items_table, totals_table, items_table, shape, after_cursor, limit, False)}
+                UNION ALL
+                {_queue_rows(totals_table, items_table, items_table, shape, after_cursor, limit, True)}
+            )
+            ORDER BY last_reconciled_timestamp DESC, invoice_id DESC
+            {limit_clause}
+        )
+        SELECT p.invoice_id,
+               CASE WHEN i.review_status >= t.review_status THEN i.review_status
+                    ELSE COALESCE(t.review_status, i.review_status) END AS review_status,
+               p.last_reconciled_timestamp
+        FROM page p
+        LEFT JOIN {items_table} i ON i.invoice_id = p.invoice_id{status.format("i")}
+        LEFT JOIN {totals_table} t ON t.invoice_id = p.invoice_id{status.format("t")}
+        ORDER BY p.last_reconciled_timestamp DESC, p.invoice_id DESC
+    """
+
+
+@template("queue_count")
+def _queue_count_sql(items_table, totals_table, shape):
+    """Queued invoices: queued items rows plus queued totals rows of invoices without one, no aggregation of the union."""
+    items_where = " AND ".join(_row_filter("i", items_table, *shape)) or "TRUE"
+    totals_where = _row_filter("t", items_table, *shape)
+    other_status = " AND i.review_status = ?" if shape[0] else ""
+    totals_where.append(f"NOT EXISTS (SELECT 1 FROM {items_table} i WHERE i.invoice_id = t.invoice_id{other_status})")
+    return f"""
+        SELECT (SELECT COUNT(*) FROM {items_table} i WHERE {items_where})
+             + (SELECT COUNT(*) FROM {totals_table} t WHERE {" AND ".join(totals_where)}) AS N
+    """
+
+
+@template("mismatch_details")
+def _mismatch_details_sql(items_table, totals_table, id_count):
+    placeholders = ", ".join("?" for _ in range(id_count))
+    return f"""
+        SELECT COALESCE(i.invoice_id, t.invoice_id) AS invoice_id,
+               i.item_mismatch_details AS item_details,
+               t.item_mismatch_details AS total_details
+        FROM (SELECT invoice_id, item_mismatch_details FROM {items_table} WHERE invoice_id IN ({placeholders})) i
+        FULL OUTER JOIN (SELECT invoice_id, item_mismatch_details FROM {totals_table} WHERE invoice_id IN ({placeholders})) t
+          ON i.invoice_id = t.invoice_id
+    """
+
+
+def fetch_queue_page(session, items_table, totals_table, status_filter, invoice_prefix="",
+                     cursor=None, page_size=DEFAULT_PAGE_SIZE, mismatch_type=ALL_MISMATCH_TYPES):
+    """Returns one QueuePage of invoices, newest first, starting after `cursor`."""
+    shape, values = _queue_filter(status_filter, invoice_prefix, mismatch_type)
+    query = _queue_page_sql(items_table, totals_table, shape, cursor is not None, int(page_size) + 1)
+    rows = [row.as_dict() for row in query.collect(session, _queue_params(shape, values, cursor))]
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        last = rows[-1]
+        next_cursor = QueueCursor(last["LAST_RECONCILED_TIMESTAMP"], last["INVOICE_ID"])
+    return QueuePage(rows, next_cursor)
+
+
+def count_queue(session, items_table, totals_table, status_filter, invoice_prefix="", mismatch_type=ALL_MISMATCH_TYPES):
+    """Number of distinct invoices in the queue."""
+    shape, values = _queue_filter(status_filter, invoice_prefix, mismatch_type)
+    params = values["status"] + values["invoice"] + values["status"] + values["invoice"] + values["status"]
+    return _queue_count_sql(items_table, totals_table, shape).collect(session, params)[0]["N"]
+
+
+def fetch_mismatch_details(session, items_table, totals_table, invoice_ids):
+    """Returns {invoice_id: (item_mismatch_details, total_mismatch_details)} for `invoice_ids` only."""
+    invoice_ids = list(invoice_ids)
+    if not invoice_ids:
+        return {}
+    _, params = in_list(invoice_ids)
+    rows = _mismatch_details_sql(items_table, totals_table, len(params)).collect(session, params + params)
+    return {row["INVOICE_ID"]: (row["ITEM_DETAILS"] or "", row["TOTAL_DETAILS"] or "") for row in rows}
+
+
+def fetch_queue_invoice_ids(session, items_table, totals_table, status_filter, invoice_prefix="", limit=None,
+                            mismatch_type=ALL_MISMATCH_TYPES):
+    """Invoice ids of the whole filtered queue (ids only), newest first, at most `limit`."""
+    shape, values = _queue_filter(status_filter, invoice_prefix, mismatch_type)
+    query = _queue_page_sql(items_table, totals_table, shape, False, limit)
+    # One Arrow column instead of a Row object per invoice: the whole queue can be tens of thousands of ids
+    ids = query.to_arrow(session, _queue_params(shape, values))
+    return ids.column(0).to_pylist() if ids is not None and ids.num_columns else []
@@ -0,0 +1,392 @@
+"""
+Vectorized pandas mirror of the reconciliation procedures in docai_invoice_qs_reconcile.sql.
+
+Reproduces SP_RUN_ITEM_RECONCILIATION and SP_RUN_TOTALS_RECONCILIATION: occurrence
+numbering per (invoice_id, product_name), the FULL OUTER JOIN, the typed
+RECONCILE_DISCREPANCIES rows, the *_Diff mismatch strings derived from them like the
+LISTAGG(DISTINCT ...)s, and the MERGE status transitions into RECONCILE_RESULTS_*. Used to pre-reconcile backfills offline and to cross-check the
+warehouse procedures.
+
+Usage:
+    python docai_invoice_qs_reconcile.py --check-seed
+    python -m pytest tests          # parity tests (tests/test_reconcile.py)
+"""
+import os
+import re
+import sys
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+AUTO_RECONCILED = "Auto-reconciled"
+PENDING_REVIEW = "Pending Review"
+REVIEWED = "Reviewed"
+
+ITEM_COLUMNS = ["invoice_id", "product_name", "quantity", "unit_price", "total_price"]
+TOTAL_COLUMNS = ["invoice_id", "invoice_date", "subtotal", "tax", "total"]
+RESULT_COLUMNS = [
+    "invoice_id", "item_mismatch_details", "review_status", "last_reconciled_timestamp",
+    "reviewed_by", "reviewed_timestamp", "notes",
+]
+
+# (column, label) pairs in the order the procedures concatenate them
+ITEM_DIFFS = [("quantity", "Qty_Diff"), ("unit_price", "Unit_Price_Diff"), ("total_price", "Total_Price_Diff")]
+TOTAL_DIFFS = [("invoice_date", "date_Diff"), ("subtotal", "subtotal_Diff"), ("tax", "tax_Diff"), ("total", "total_Diff")]
+_FIELD_ORDER = {column: position for position, (column, _) in enumerate(ITEM_DIFFS + TOTAL_DIFFS)}
+IN_A_ONLY = "In Table A Only"
+IN_B_ONLY = "In Table B Only"
+# Label of an item line with a NULL product name (by occurrence), so it is not dropped from the details
+UNNAMED_LINE = "(unnamed line {})"
+MISMATCH_TYPES = [label for _, label in ITEM_DIFFS + TOTAL_DIFFS] + [IN_A_ONLY, IN_B_ONLY]
+
+# RECONCILE_DISCREPANCIES: one row per (invoice, source, product occurrence, field)
+ITEMS_SOURCE = "ITEMS"
+TOTALS_SOURCE = "TOTALS"
+DISCREPANCY_COLUMNS = [
+    "invoice_id", "source", "product_name", "product_occurrence", "field", "mismatch_type",
+    "value_a", "value_b", "date_a", "date_b", "delta",
+]
+
+SEED_SQL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "docai_invoice_qs_reconcile.sql")
+
+
+def _normalize(df, columns):
+    """Lower-cases Snowflake column names and keeps only `columns`."""
+    df = df.rename(columns=str.lower)
+    missing = [c for c in columns if c not in df.columns]
+    if missing:
+        raise ValueError(f"Missing columns: {missing}")
+    return df[columns]
+
+
+def _as_varchar(values):
+    """Equivalent of <NUMBER(x, 2) | DATE>::VARCHAR."""
+    if pd.api.types.is_numeric_dtype(values):
+        return values.map("{:.2f}".format)
+    return pd.to_datetime(values).dt.strftime("%Y-%m-%d")
+
+
+def _discrepancy_rows(joined, diffs, source):
+    """
+    The RECONCILE_DISCREPANCIES rows of one run: one per differing field of a matched row
+    (typed A/B values and delta B - A, in days for dates) and one per one-sided row.
+    """
+    in_a = joined["_in_a"].to_numpy()
+    in_b = joined["_in_b"].to_numpy()
+    keys = pd.DataFrame({
+        "invoice_id": joined["invoice_id"],
+        "source": source,
+        "product_name": joined["product_name"] if "product_name" in joined else None,
+        "product_occurrence": joined["rn_occurrence"] if "rn_occurrence" in joined else np.nan,
+    })
+    frames = []
+    for column, label in diffs:
+        a, b = joined[f"{column}_a"], joined[f"{column}_b"]
+        # IFF(a <> b, ...) is '' when either side is NULL
+        differs = (a.notna() & b.notna() & (a != b)).to_numpy() & in_a & in_b
+        if not differs.any():
+            continue
+        rows = keys[differs].assign(field=column, mismatch_type=label)
+        if pd.api.types.is_numeric_dtype(a):
+            rows = rows.assign(value_a=a[differs].astype(float), value_b=b[differs].astype(float), date_a=pd.NaT, date_b=pd.NaT)
+            rows["delta"] = (rows["value_b"] - rows["value_a"]).round(2)
+        else:
+            rows = rows.assign(value_a=np.nan, value_b=np.nan, date_a=pd.to_datetime(a[differs]), date_b=pd.to_datetime(b[differs]))
+            rows["delta"] = (rows["date_b"] - rows["date_a"]).dt.days.astype(float)
+        frames.append(rows)
+    for mask, label in [(in_a & ~in_b, IN_A_ONLY), (~in_a & in_b, IN_B_ONLY)]:
+        if mask.any():
+            frames.append(keys[mask].assign(field=None, mismatch_type=label, value_a=np.nan, value_b=np.nan,
+                                            date_a=pd.NaT, date_b=pd.NaT, delta=np.nan))
+    if not frames:
+        return pd.DataFrame(columns=DISCREPANCY_COLUMNS)
+    return pd.concat(frames, ignore_index=True)[DISCREPANCY_COLUMNS]
+
+
+def _discrepancy_text(discrepancies):
+    """Per discrepancy row: 'Label(a vs b);' for a field difference, the status for a one-sided row."""
+    text = discrepancies["mismatch_type"].astype(object).copy()
+    numeric = discrepancies["value_a"].notna().to_numpy()
+    dated = discrepancies["date_a"].notna().to_numpy()
+    for mask, a, b in [(numeric, "value_a", "value_b"), (dated, "date_a", "date_b")]:
+        if mask.any():
+            rows = discrepancies[mask]
+            text[mask] = rows["mismatch_type"] + "(" + _as_varchar(rows[a]) + " vs " + _as_varchar(rows[b]) + ");"
+    return text
+
+
+def summarize_discrepancies(discrepancies, invoice_ids):
+    """
+    Derives the ReconciliationSource (invoice_id, item_mismatch_details, review_status) of every
+    id in `invoice_ids` from its discrepancy rows, like the LISTAGGs over RECONCILE_DISCREPANCIES:
+    a row's field differences in field order, then LISTAGG(DISTINCT label || ': ' || row, '; ')
+    per invoice, where label is the product name for items and the invoice id for totals.
+    """
+    unnamed = discrepancies["product_occurrence"].map(lambda occurrence: UNNAMED_LINE.format(int(occurrence)) if pd.notna(occurrence) else None)
+    rows = discrepancies.assign(
+        _text=_discrepancy_text(discrepancies),
+        _order=discrepancies["field"].map(_FIELD_ORDER).fillna(-1),
+        _label=np.where(discrepancies["source"] == ITEMS_SOURCE, discrepancies["product_name"].fillna(unnamed), discrepancies["invoice_id"]),
+    ).sort_values("_order", kind="mergesort")
+    row_keys = ["invoice_id", "source", "product_name", "product_occurrence"]
+    per_row = rows.groupby(row_keys, sort=False, dropna=False).agg(label=("_label", "first"), text=("_text", " ".join)).reset_index()
+    entries = pd.DataFrame({"invoice_id": per_row["invoice_id"], "entry": per_row["label"] + ": " + per_row["text"]})
+    entries = entries[per_row["label"].notna()].drop_duplicates().sort_values(["invoice_id", "entry"], kind="mergesort")
+    details = entries.groupby("invoice_id", sort=False)["entry"].agg("; ".join)
+    all_ids = pd.Index(pd.Series(invoice_ids).dropna().unique(), name="invoice_id")
+    details = details.reindex(all_ids, fill_value="")
+    out = details.rename("item_mismatch_details").reset_index()
+    out["review_status"] = np.where(out["item_mismatch_details"] == "", AUTO_RECONCILED, PENDING_REVIEW)
+    return out.sort_values("invoice_id", kind="mergesort").reset_index(drop=True)
+
+
+def _with_occurrence(df):
+    """ROW_NUMBER() OVER (PARTITION BY invoice_id, product_name ORDER BY quantity, unit_price, total_price)."""
+    df = df.sort_values(
+        ["invoice_id", "product_name", "quantity", "unit_price", "total_price"],
+        kind="mergesort", na_position="last",
+    )
+    return df.assign(rn_occurrence=df.groupby(["invoice_id", "product_name"], sort=False, dropna=False).cumcount() + 1)
+
+
+def _full_outer_join(a, b, keys):
+    a = a.assign(_in_a=True, _key_ok=a[keys].notna().all(axis=1))
+    b = b.assign(_in_b=True, _key_ok=b[keys].notna().all(axis=1))
+    joined = pd.merge(
+        a[a["_key_ok"]].drop(columns="_key_ok"), b[b["_key_ok"]].drop(columns="_key_ok"),
+        on=keys, how="outer", suffixes=("_a", "_b"),
+    )
+    # Rows with a NULL join key can never match: they come through as one-sided rows
+    unmatched_a = a[~a["_key_ok"]].drop(columns="_key_ok").rename(columns=lambda c: c if c in keys or c.startswith("_") else f"{c}_a")
+    unmatched_b = b[~b["_key_ok"]].drop(columns="_key_ok").rename(columns=lambda c: c if c in keys or c.startswith("_") else f"{c}_b")
+    joined = pd.concat([joined, unmatched_a, unmatched_b], ignore_index=True)
+    joined["_in_a"] = joined["_in_a"].fillna(False).astype(bool)
+    joined["_in_b"] = joined["_in_b"].fillna(False).astype(bool)
+    return joined
+
+
+def item_discrepancies(transact_items, docai_items):
+    """(discrepancy rows, reconciled invoice ids) of SP_RUN_ITEM_RECONCILIATION."""
+    a = _with_occurrence(_normalize(transact_items, ITEM_COLUMNS))
+    b = _with_occurrence(_normalize(docai_items, ITEM_COLUMNS))
+    joined = _full_outer_join(a, b, ["invoice_id", "product_name", "rn_occurrence"])
+    return _discrepancy_rows(joined, ITEM_DIFFS, ITEMS_SOURCE), joined["invoice_id"]
+
+
+def total_discrepancies(transact_totals, docai_totals):
+    """(discrepancy rows, reconciled invoice ids) of SP_RUN_TOTALS_RECONCILIATION."""
+    a = _normalize(transact_totals, TOTAL_COLUMNS)
+    b = _normalize(docai_totals, TOTAL_COLUMNS)
+    joined = _full_outer_join(a, b, ["invoice_id"])
+    return _discrepancy_rows(joined, TOTAL_DIFFS, TOTALS_SOURCE), joined["invoice_id"]
+
+
+def reconcile_items(transact_items, docai_items):
+    """Returns the ReconciliationSource of SP_RUN_ITEM_RECONCILIATION: invoice_id, item_mismatch_details, review_status."""
+    return summarize_discrepancies(*item_discrepancies(transact_items, docai_items))
+
+
+def reconcile_totals(transact_totals, docai_totals):
+    """Returns the ReconciliationSource of SP_RUN_TOTALS_RECONCILIATION: invoice_id, item_mismatch_details, review_status."""
+    return summarize_discrepancies(*total_discrepancies(transact_totals, docai_totals))
+
+
+def merge_results(target, source, run_timestamp):
+    """
+    Applies the MERGE INTO RECONCILE_RESULTS_* of the procedures.
+
+    `target` is the current results table (may be empty), `source` the output of
+    reconcile_items/reconcile_totals. Returns the new results table.
+    """
+    if target is None or len(target) == 0:
+        target = pd.DataFrame(columns=RESULT_COLUMNS)
+    target = _normalize(target, RESULT_COLUMNS)
+    merged = target.merge(source, on="invoice_id", how="outer", suffixes=("", "_src"), indicator=True)
+
+    matched = (merged["_merge"] == "both").to_numpy()
+    inserted = (merged["_merge"] == "right_only").to_numpy()
+    touched = matched | inserted
+    source_auto = (merged["review_status_src"] == AUTO_RECONCILED).to_numpy()
+    was_reviewed = (merged["review_status"] == REVIEWED).to_numpy()
+
+    status = np.where(source_auto, AUTO_RECONCILED, np.where(was_reviewed, REVIEWED, PENDING_REVIEW))
+    merged["review_status"] = np.where(matched, status, np.where(inserted, merged["review_status_src"], merged["review_status"]))
+    merged["item_mismatch_details"] = np.where(touched, merged["item_mismatch_details_src"], merged["item_mismatch_details"])
+    merged["last_reconciled_timestamp"] = merged["last_reconciled_timestamp"].astype(object)
+    merged.loc[touched, "last_reconciled_timestamp"] = run_timestamp
+
+    # Review fields are kept when Reviewed, cleared when it is (again) a discrepancy
+    clear = (matched & ~was_reviewed & ~source_auto) | inserted
+    for column in ["reviewed_by", "reviewed_timestamp", "notes"]:
+        merged[column] = merged[column].astype(object)
+        merged.loc[clear, column] = None
+
+    return merged[RESULT_COLUMNS].sort_values("invoice_id", kind="mergesort").reset_index(drop=True)
+
+
+def ready_for_gold(results, run_timestamp):
+    """Invoice ids this run reconciled to Auto-reconciled (reconciled at `run_timestamp`): the candidates for GOLD_*."""
+    results = _normalize(results, RESULT_COLUMNS)
+    mask = (results["review_status"] == AUTO_RECONCILED) & (results["last_reconciled_timestamp"] == run_timestamp)
+    return results.loc[mask, "invoice_id"].tolist()
+
+
+def _row_sets(df, columns):
+    """{invoice_id: sorted tuple of its rows} over `columns` (numbers to cents, dates to ISO), i.e. the invoice's rows as a multiset."""
+    values = []
+    for column in columns[1:]:
+        if column.endswith("date"):
+            values.append(pd.to_datetime(df[column]).dt.strftime("%Y-%m-%d").where(df[column].notna(), None))
+        elif column == "product_name":
+            values.append(df[column])
+        else:
+            values.append(pd.to_numeric(df[column]).round(2))
+    rows = pd.Series(list(zip(*values)), index=df.index, dtype=object)
+    return rows.groupby(df["invoice_id"]).agg(lambda group: tuple(sorted(group, key=repr))).to_dict()
+
+
+def gold_up_to_date(bronze, gold, columns, invoice_ids):
+    """
+    Ids among `invoice_ids` whose GOLD_* rows already equal their TRANSACT_* rows (as multisets
+    over `columns`), which the procedures' gold MERGEs leave untouched.
+    """
+    invoice_ids = set(invoice_ids)
+    bronze, gold = _normalize(bronze, columns), _normalize(gold, columns)
+    bronze_rows = _row_sets(bronze[bronze["invoice_id"].isin(invoice_ids)], columns)
+    gold_rows = _row_sets(gold[gold["invoice_id"].isin(invoice_ids)], columns)
+    return {invoice_id for invoice_id in invoice_ids if invoice_id in gold_rows and gold_rows[invoice_id] == bronze_rows.get(invoice_id)}
+
+
+# --- Partitioned processing for large backfills ---
+
+def _partition_of(invoice_ids, num_partitions):
+    return (pd.util.hash_pandas_object(invoice_ids.astype(str), index=False).to_numpy() % num_partitions).astype(int)
+
+
+def spill_partitions(chunks, directory, side, num_partitions):
+    """Writes each chunk's rows to `num_partitions` hash partitions on invoice_id under `directory`."""
+    for chunk_no, chunk in enumerate(chunks):
+        chunk = chunk.rename(columns=str.lower)
+        parts = _partition_of(chunk["invoice_id"], num_partitions)
+        for part, rows in chunk.groupby(parts, sort=False):
+            rows.to_pickle(os.path.join(directory, f"{side}-{part:05d}-{chunk_no:07d}.pkl"))
+
+
+def _load_partition(directory, side, part, columns):
+    prefix = f"{side}-{part:05d}-"
+    frames = [pd.read_pickle(os.path.join(directory, name)) for name in sorted(os.listdir(directory)) if name.startswith(prefix)]
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=columns)
+
+
+def reconcile_partitioned(reconcile_fn, chunks_a, chunks_b, columns, num_partitions=64, directory=None):
+    """
+    Runs reconcile_items/reconcile_totals over inputs larger than memory.
+
+    `chunks_a`/`chunks_b` are iterables of DataFrames (e.g. pd.read_csv(..., chunksize=...)).
+    Rows are spilled to disk by hash(invoice_id) so every invoice lands in one partition,
+    then each partition is reconciled independently. Yields one result frame per partition.
+    """
+    with tempfile.TemporaryDirectory(dir=directory) as spill_dir:
+        spill_partitions(chunks_a, spill_dir, "a", num_partitions)
+        spill_partitions(chunks_b, spill_dir, "b", num_partitions)
+        for part in range(num_partitions):
+            a = _load_partition(spill_dir, "a", part, columns)
+            b = _load_partition(spill_dir, "b", part, columns)
+            if len(a) or len(b):
+                yield reconcile_fn(a, b)
+
+
+# --- Parity check against the seed data ---
+
+# DocAI values for the seed invoices: the TRANSACT_* seed rows with the intentional
+# modifications (see the comments on the INSERT statements) reverted.
+SEED_DOCAI_ITEM_CORRECTIONS = {
+    ("2010", "Onions (kg)", 4.78): {"unit_price": 4.62, "total_price": 9.24},
+    ("2007", "Yogurt (cup)", 1.66): {"quantity": 2},
+    ("2005", "Butter (pack)", 6.20): {"unit_price": 7.80},
+}
+SEED_DOCAI_TOTAL_CORRECTIONS = {
+    "2004": {"tax": 19.07, "total": 209.73},
+    "2002": {"tax": 10.30},
+}
+EXPECTED_SEED_ITEM_DETAILS = {
+    "2010": "Onions (kg): Unit_Price_Diff(4.78 vs 4.62); Total_Price_Diff(9.54 vs 9.24);",
+    "2007": "Yogurt (cup): Qty_Diff(5.00 vs 2.00);",
+    "2005": "Butter (pack): Unit_Price_Diff(6.20 vs 7.80);",
+}
+# A DocAI line read without its product name: it no longer matches its TRANSACT line, and both
+# sides must still show in the details
+SEED_UNNAMED_DOCAI_LINE = ("2001", "Tomatoes (kg)")
+EXPECTED_SEED_UNNAMED_LINE_DETAILS = "(unnamed line 1): In Table B Only; Tomatoes (kg): In Table A Only"
+EXPECTED_SEED_TOTAL_DETAILS = {
+    "2004": "2004: tax_Diff(99.99 vs 19.07); total_Diff(309.73 vs 209.73);",
+    "2002": "2002: tax_Diff(23.10 vs 10.30);",
+}
+
+
+def load_seed_rows(table, columns, sql_path=SEED_SQL_PATH):
+    """Parses the `INSERT INTO ...<table> (...) VALUES` seed statement into a DataFrame."""
+    with open(sql_path) as fh:
+        sql = fh.read()
+    match = re.search(rf"INSERT INTO \S+\.{table} \([^)]*\) VALUES(.*?);", sql, re.S)
+    if not match:
+        raise ValueError(f"No seed INSERT found for {table}")
+    body = re.sub(r"--[^\n]*", "", match.group(1))
+    rows = []
+    for values in re.findall(r"\(((?:\s*(?:'[^']*'|[-\d.]+)\s*,?)+)\)", body):
+        fields = re.findall(r"'[^']*'|[-\d.]+", values)
+        rows.append([f.strip("'") if f.startswith("'") else float(f) for f in fields])
+    return pd.DataFrame(rows, columns=columns)
+
+
+def seed_frames(sql_path=SEED_SQL_PATH):
+    """Returns (transact_items, docai_items, transact_totals, docai_totals) for the seed invoices."""
+    transact_items = load_seed_rows("TRANSACT_ITEMS", ITEM_COLUMNS, sql_path)
+    transact_totals = load_seed_rows("TRANSACT_TOTALS", TOTAL_COLUMNS, sql_path)
+
+    docai_items = transact_items.copy()
+    for (invoice_id, product_name, unit_price), fixes in SEED_DOCAI_ITEM_CORRECTIONS.items():
+        mask = (docai_items["invoice_id"] == invoice_id) & (docai_items["product_name"] == product_name) & (docai_items["unit_price"] == unit_price)
+        for column, value in fixes.items():
+            docai_items.loc[mask, column] = value
+    docai_totals = transact_totals.copy()
+    for invoice_id, fixes in SEED_DOCAI_TOTAL_CORRECTIONS.items():
+        for column, value in fixes.items():
+            docai_totals.loc[docai_totals["invoice_id"] == invoice_id, column] = value
+    return transact_items, docai_items, transact_totals, docai_totals
+
+
+def check_seed_parity(sql_path=SEED_SQL_PATH):
+    """Reconciles the seed data and returns a list of mismatches against the expected procedure output."""
+    transact_items, docai_items, transact_totals, docai_totals = seed_frames(sql_path)
+    failures = []
+    for name, source, expected in [
+        ("items", reconcile_items(transact_items, docai_items), EXPECTED_SEED_ITEM_DETAILS),
+        ("totals", reconcile_totals(transact_totals, docai_totals), EXPECTED_SEED_TOTAL_DETAILS),
+    ]:
+        for row in source.itertuples(index=False):
+            want = expected.get(row.invoice_id, "")
+            want_status = PENDING_REVIEW if want else AUTO_RECONCILED
+            if row.item_mismatch_details != want or row.review_status != want_status:
+                failures.append(f"{name} {row.invoice_id}: got ({row.item_mismatch_details!r}, {row.review_status}), want ({want!r}, {want_status})")
+
+    invoice_id, product_name = SEED_UNNAMED_DOCAI_LINE
+    unnamed = docai_items.copy()
+    unnamed.loc[(unnamed["invoice_id"] == invoice_id) & (unnamed["product_name"] == product_name), "product_name"] = None
+    source = reconcile_items(transact_items, unnamed).set_index("invoice_id")
+    got = (source.at[invoice_id, "item_mismatch_details"], source.at[invoice_id, "review_status"])
+    if got != (EXPECTED_SEED_UNNAMED_LINE_DETAILS, PENDING_REVIEW):
+        failures.append(f"unnamed line {invoice_id}: got {got}, want ({EXPECTED_SEED_UNNAMED_LINE_DETAILS!r}, {PENDING_REVIEW})")
+    return failures
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["--check-seed"]:
+        print(__doc__.strip(), file=sys.stderr)
+        sys.exit(2)
+    failures = check_seed_parity()
+    for failure in failures:
+        print(failure)
+    print("seed parity: " + ("FAILED" if failures else "OK"))
+    sys.exit(1 if failures else 0)
@@ -4,7 +4,59 @@ USE WAREHOUSE doc_ai_qs_wh;
 USE DATABASE doc_ai_qs_db;
 USE SCHEMA doc_ai_schema;
 
-CREATE OR REPLACE PROCEDURE doc_ai_qs_db.doc_ai_schema.SP_RUN_ITEM_RECONCILIATION()
+-- Capture the invoices touched since the last run from all four bronze streams.
+-- A single MERGE reads every stream, so all four offsets advance together when it commits.
+-- Captured invoices stay queued in RECONCILE_PENDING_INVOICES until both the item and the
+-- totals reconciliation have processed them, so a failed run is retried on the next one.
+CREATE OR REPLACE PROCEDURE doc_ai_qs_db.doc_ai_schema.SP_CAPTURE_CHANGED_INVOICES()
+RETURNS VARCHAR
+LANGUAGE SQL
+AS
+$$
+DECLARE
+  status_message VARCHAR;
+  current_run_timestamp TIMESTAMP_NTZ;
+BEGIN
+    current_run_timestamp := CURRENT_TIMESTAMP();
+MERGE INTO doc_ai_qs_db.doc_ai_schema.RECONCILE_PENDING_INVOICES AS target
+USING (
+    SELECT invoice_id FROM doc_ai_qs_db.doc_ai_schema.BRONZE_DB_STREAM
+    UNION
+    SELECT invoice_id FROM doc_ai_qs_db.doc_ai_schema.BRONZE_DOCAI_STREAM
+    UNION
+    SELECT invoice_id FROM doc_ai_qs_db.doc_ai_schema.BRONZE_DB_ITEMS_STREAM
+    UNION
+    SELECT invoice_id FROM doc_ai_qs_db.doc_ai_schema.BRONZE_DOCAI_ITEMS_STREAM
+  ) AS source
+  ON target.invoice_id = source.invoice_id
+  WHEN MATCHED THEN UPDATE SET
+    target.captured_timestamp = :current_run_timestamp,
+    target.items_reconciled = FALSE,
+    target.totals_reconciled = FALSE
+  WHEN NOT MATCHED AND source.invoice_id IS NOT NULL THEN INSERT (
+    invoice_id,
+    captured_timestamp,
+    items_reconciled,
+    totals_reconciled
+  ) VALUES (
+    source.invoice_id,
+    :current_run_timestamp,
+    FALSE,
+    FALSE
+  );
+
+  status_message := 'Captured ' || SQLROWCOUNT || ' changed invoices into RECONCILE_PENDING_INVOICES.';
+  RETURN status_message;
+
+EXCEPTION
+  WHEN OTHER THEN
+    status_message := 'Error capturing changed invoices: ' || SQLERRM;
+    RETURN status_message;
+END;
+$$;
+
+
+CREATE OR REPLACE PROCEDURE doc_ai_qs_db.doc_ai_schema.SP_RUN_ITEM_RECONCILIATION(FULL_REFRESH BOOLEAN DEFAULT FALSE)
 RETURNS VARCHAR
 LANGUAGE SQL
 AS
@@ -12,10 +64,33 @@ $$
 DECLARE
   status_message VARCHAR;
   current_run_timestamp TIMESTAMP_NTZ; -- Use consistent timestamp for the run
+  gold_rows_inserted INTEGER DEFAULT 0;
+  gold_rows_deleted INTEGER DEFAULT 0;
 BEGIN
     current_run_timestamp := CURRENT_TIMESTAMP();
-MERGE INTO doc_ai_qs_db.doc_ai_schema.RECONCILE_RESULTS_ITEMS AS target
-USING(
+-- Invoices this run reconciles
+CREATE OR REPLACE TEMPORARY TABLE doc_ai_qs_db.doc_ai_schema.ITEM_RECONCILE_SCOPE AS
+    SELECT invoice_id FROM doc_ai_qs_db.doc_ai_schema.TRANSACT_ITEMS
+    WHERE :full_refresh OR invoice_id IN (
+        SELECT invoice_id FROM doc_ai_qs_db.doc_ai_schema.RECONCILE_PENDING_INVOICES
+        WHERE captured_timestamp <= :current_run_timestamp
+    )
+    UNION
+    SELECT invoice_id FROM doc_ai_qs_db.doc_ai_schema.DOCAI_INVOICE_ITEMS
+    WHERE :full_refresh OR invoice_id IN (
+        SELECT invoice_id FROM doc_ai_qs_db.doc_ai_schema.RECONCILE_PENDING_INVOICES
+        WHERE captured_timestamp <= :current_run_timestamp
+    );
+
+-- Replace their item discrepancies: one row per differing field of a matched line occurrence,
+-- one row per line found on one side only
+DELETE FROM doc_ai_qs_db.doc_ai_schema.RECONCILE_DISCREPANCIES
+WHERE source = 'ITEMS'
+AND invoice_id IN (SELECT invoice_id FROM doc_ai_qs_db.doc_ai_schema.ITEM_RECONCILE_SCOPE);
+
+INSERT INTO doc_ai_qs_db.doc_ai_schema.RECONCILE_DISCREPANCIES (
+    invoice_id, source, product_name, product_occurrence, field, mismatch_type, value_a, value_b, delta, last_reconciled_timestamp
+)
     WITH db_items AS (
     SELECT
         invoice_id,
@@ -28,6 +103,7 @@ USING(
             ORDER BY quantity, unit_price, total_price
         ) as rn_occurrence
         FROM doc_ai_qs_db.doc_ai_schema.TRANSACT_ITEMS a
+        WHERE invoice_id IN (SELECT invoice_id FROM doc_ai_qs_db.doc_ai_schema.ITEM_RECONCILE_SCOPE)
     ),
     docai_items AS (
     SELECT
@@ -41,6 +117,7 @@ USING(
             ORDER BY quantity, unit_price, total_price 
         ) as rn_occurrence
     FROM doc_ai_qs_db.doc_ai_schema.DOCAI_INVOICE_ITEMS b
+    WHERE invoice_id IN (SELECT invoice_id FROM doc_ai_qs_db.doc_ai_schema.ITEM_RECONCILE_SCOPE)
     ),
 
     join_table AS (SELECT
@@ -58,47 +135,59 @@ USING(
     b.unit_price AS UnitPrice_B,
     b.total_price AS TotalPrice_B,
 
-    -- Reconciliation Status and Discrepancies
+    -- Reconciliation Status
     CASE
         WHEN a.invoice_id IS NOT NULL AND b.invoice_id IS NOT NULL THEN 'Matched Line Item Occurrence'
         WHEN a.invoice_id IS NOT NULL AND b.invoice_id IS NULL THEN 'In Table A Only'
         WHEN a.invoice_id IS NULL AND b.invoice_id IS NOT NULL THEN 'In Table B Only'
-    END AS Reconciliation_Status,
-
-    CASE
-        WHEN a.invoice_id IS NOT NULL AND b.invoice_id IS NOT NULL THEN
-            TRIM(
-                COALESCE(IFF(a.quantity <> b.quantity, 'Qty_Diff(' || a.quantity::VARCHAR || ' vs ' || b.quantity::VARCHAR || '); ', ''), '') ||
-                COALESCE(IFF(a.unit_price <> b.unit_price, 'Unit_Price_Diff(' || a.unit_price::VARCHAR || ' vs ' || b.unit_price::VARCHAR || '); ', ''), '') ||
-                COALESCE(IFF(a.total_price <> b.total_price, 'Total_Price_Diff(' || a.total_price::VARCHAR || ' vs ' || b.total_price::VARCHAR || '); ', ''), '')
-                -- Add more detailed discrepancy checks as needed
-            )
-        WHEN a.invoice_id IS NOT NULL AND b.invoice_id IS NULL THEN 'In Table A Only'
-        WHEN a.invoice_id IS NULL AND b.invoice_id IS NOT NULL THEN 'In Table B Only'
-        ELSE NULL
-    END AS Discrepancies
+    END AS Reconciliation_Status
 FROM db_items a
 FULL OUTER JOIN docai_items b
     ON a.invoice_id = b.invoice_id
     AND a.product_name = b.product_name
     AND a.rn_occurrence = b.rn_occurrence
+    )
+
+    -- <> is NULL when either side is NULL, so only values present on both sides can differ
+    SELECT Reconciled_invoice_id, 'ITEMS', Reconciled_product_name, Product_Occurrence_Num, 'quantity', 'Qty_Diff',
+           Quantity_A, Quantity_B, Quantity_B - Quantity_A, :current_run_timestamp
+    FROM join_table WHERE Quantity_A <> Quantity_B
+    UNION ALL
+    SELECT Reconciled_invoice_id, 'ITEMS', Reconciled_product_name, Product_Occurrence_Num, 'unit_price', 'Unit_Price_Diff',
+           UnitPrice_A, UnitPrice_B, UnitPrice_B - UnitPrice_A, :current_run_timestamp
+    FROM join_table WHERE UnitPrice_A <> UnitPrice_B
+    UNION ALL
+    SELECT Reconciled_invoice_id, 'ITEMS', Reconciled_product_name, Product_Occurrence_Num, 'total_price', 'Total_Price_Diff',
+           TotalPrice_A, TotalPrice_B, TotalPrice_B - TotalPrice_A, :current_run_timestamp
+    FROM join_table WHERE TotalPrice_A <> TotalPrice_B
+    UNION ALL
+    SELECT Reconciled_invoice_id, 'ITEMS', Reconciled_product_name, Product_Occurrence_Num, NULL, Reconciliation_Status,
+           NULL, NULL, NULL, :current_run_timestamp
+    FROM join_table WHERE Reconciliation_Status <> 'Matched Line Item Occurrence';
+
+MERGE INTO doc_ai_qs_db.doc_ai_schema.RECONCILE_RESULTS_ITEMS AS target
+USING(
+    -- item_mismatch_details is derived from the discrepancy rows, e.g. 'Onions (kg): Unit_Price_Diff(4.78 vs 4.62); Total_Price_Diff(9.54 vs 9.24);'
+    WITH line_discrepancies AS (
+    SELECT
+        invoice_id,
+        -- A NULL name would drop the line from the details below ('x' || NULL is NULL)
+        COALESCE(product_name, '(unnamed line ' || product_occurrence || ')') AS product_name,
+        LISTAGG(
+            IFF(field IS NULL, mismatch_type, mismatch_type || '(' || value_a::VARCHAR || ' vs ' || value_b::VARCHAR || ');'),
+            ' '
+        ) WITHIN GROUP (ORDER BY DECODE(field, 'quantity', 1, 'unit_price', 2, 'total_price', 3, 0)) AS discrepancies
+    FROM doc_ai_qs_db.doc_ai_schema.RECONCILE_DISCREPANCIES
+    WHERE source = 'ITEMS'
+    AND invoice_id IN (SELECT invoice_id FROM doc_ai_qs_db.doc_ai_schema.ITEM_RECONCILE_SCOPE)
+    GROUP BY invoice_id, product_name, product_occurrence
     ),
 
 ReconciliationSource AS (
 SELECT
-    Reconciled_invoice_id AS invoice_id,
-    LISTAGG(
-        DISTINCT CASE
-            WHEN discrepancies IS NOT NULL AND discrepancies <> '' THEN Reconciled_product_name || ': ' || discrepancies
-            ELSE NULL
-        END,
-        '; '
-    ) WITHIN GROUP (ORDER BY -- Corrected ORDER BY clause
-                        CASE
-                            WHEN discrepancies IS NOT NULL AND discrepancies <> '' THEN Reconciled_product_name || ': ' || discrepancies
-                            ELSE NULL
-                        END
-                   ) AS item_mismatch_details,
+    s.invoice_id,
+    LISTAGG(DISTINCT d.product_name || ': ' || d.discrepancies, '; ')
+        WITHIN GROUP (ORDER BY d.product_name || ': ' || d.discrepancies) AS item_mismatch_details,
     CASE
         WHEN item_mismatch_details = '' THEN 'Auto-reconciled'
         ELSE 'Pending Review'
@@ -109,11 +198,12 @@ SELECT
     NULL as notes
     
 FROM
-    join_table 
+    doc_ai_qs_db.doc_ai_schema.ITEM_RECONCILE_SCOPE s
+    LEFT JOIN line_discrepancies d ON d.invoice_id = s.invoice_id
 GROUP BY
-    Reconciled_invoice_id
+    s.invoice_id
 ORDER BY
-    Reconciled_invoice_id
+    s.invoice_id
 )
     -- Select final source for merge
     SELECT * FROM ReconciliationSource
@@ -155,30 +245,74 @@ ORDER BY
     :current_run_timestamp  -- Use variable for consistency
   );
 
-SELECT * FROM TRANSACT_ITEMS;
-
-CREATE OR REPLACE TEMPORARY TABLE ReadyForGold AS(
-    SELECT 
-    *,
-    'Auto-reconciled' AS reviewed_by,
-    :current_run_timestamp AS reviewed_timestamp
-    FROM doc_ai_qs_db.doc_ai_schema.TRANSACT_ITEMS
-    WHERE INVOICE_ID IN (
-        SELECT INVOICE_ID
-        FROM doc_ai_qs_db.doc_ai_schema.RECONCILE_RESULTS_ITEMS
-        WHERE REVIEW_STATUS = 'Auto-reconciled'
+-- Promote the invoices this run reconciled to 'Auto-reconciled', except those whose gold rows a reviewer
+-- wrote and those whose gold rows already equal TRANSACT_ITEMS (compared as multisets, with the gold
+-- column types), so a FULL_REFRESH rewrites only invoices whose bronze rows changed.
+-- Items have no row key, so one MERGE replaces each invoice's gold rows: a single DELETE marker per
+-- invoice removes the previous rows and the TRANSACT_ITEMS rows are inserted in the same statement.
+MERGE INTO doc_ai_qs_db.doc_ai_schema.GOLD_INVOICE_ITEMS AS target
+USING (
+    WITH candidates AS (
+        SELECT r.invoice_id
+        FROM doc_ai_qs_db.doc_ai_schema.RECONCILE_RESULTS_ITEMS r
+        WHERE r.review_status = 'Auto-reconciled'
+        AND r.last_reconciled_timestamp = :current_run_timestamp
+        AND NOT EXISTS (
+            SELECT 1 FROM doc_ai_qs_db.doc_ai_schema.GOLD_INVOICE_ITEMS g
+            WHERE g.invoice_id = r.invoice_id AND g.reviewed_by <> 'Auto-reconciled'
+        )
+    ),
+    bronze_rows AS (
+        SELECT t.invoice_id,
+               HASH_AGG(t.product_name, t.quantity::NUMBER(38, 0), t.unit_price::NUMBER(10, 2), t.total_price::NUMBER(10, 2)) AS rows_hash
+        FROM doc_ai_qs_db.doc_ai_schema.TRANSACT_ITEMS t
+        JOIN candidates c ON t.invoice_id = c.invoice_id
+        GROUP BY t.invoice_id
+    ),
+    gold_rows AS (
+        SELECT g.invoice_id,
+               HASH_AGG(g.product_name, g.quantity::NUMBER(38, 0), g.unit_price::NUMBER(10, 2), g.total_price::NUMBER(10, 2)) AS rows_hash
+        FROM doc_ai_qs_db.doc_ai_schema.GOLD_INVOICE_ITEMS g
+        JOIN candidates c ON g.invoice_id = c.invoice_id
+        GROUP BY g.invoice_id
+    ),
+    promoted AS (
+        SELECT c.invoice_id
+        FROM candidates c
+        LEFT JOIN bronze_rows b ON b.invoice_id = c.invoice_id
+        LEFT JOIN gold_rows g ON g.invoice_id = c.invoice_id
+        WHERE g.rows_hash IS DISTINCT FROM b.rows_hash
     )
-);
-    
-DELETE FROM doc_ai_qs_db.doc_ai_schema.GOLD_INVOICE_ITEMS
-WHERE invoice_id IN (SELECT DISTINCT invoice_id FROM ReadyForGold);
+    SELECT invoice_id, NULL AS product_name, NULL AS quantity, NULL AS unit_price, NULL AS total_price, 'DELETE' AS promote_action
+    FROM promoted
+    UNION ALL
+    SELECT t.invoice_id, t.product_name, t.quantity, t.unit_price, t.total_price, 'INSERT' AS promote_action
+    FROM doc_ai_qs_db.doc_ai_schema.TRANSACT_ITEMS t
+    JOIN promoted p ON t.invoice_id = p.invoice_id
+  ) AS source
+  ON target.invoice_id = source.invoice_id AND source.promote_action = 'DELETE'
+  WHEN MATCHED THEN DELETE
+  WHEN NOT MATCHED AND source.promote_action = 'INSERT' THEN INSERT (
+    invoice_id, product_name, quantity, unit_price, total_price, reviewed_by, reviewed_timestamp
+  ) VALUES (
+    source.invoice_id, source.product_name, source.quantity, source.unit_price, source.total_price, 'Auto-reconciled', :current_run_timestamp
+  );
+
+SELECT "number of rows inserted", "number of rows deleted" INTO :gold_rows_inserted, :gold_rows_deleted
+FROM TABLE(RESULT_SCAN(LAST_QUERY_ID()));
+
+-- Mark the captured invoices as processed by the item reconciliation
+UPDATE doc_ai_qs_db.doc_ai_schema.RECONCILE_PENDING_INVOICES
+SET items_reconciled = TRUE
+WHERE captured_timestamp <= :current_run_timestamp;
 
--- Step 2: Insert all the new line items from incoming_data.
-INSERT INTO doc_ai_qs_db.doc_ai_schema.GOLD_INVOICE_ITEMS (invoice_id, product_name, quantity, unit_price, total_price, reviewed_by, reviewed_timestamp)
-SELECT invoice_id, product_name, quantity, unit_price, total_price, reviewed_by, reviewed_timestamp
-FROM ReadyForGold;
+-- Dequeue invoices that both reconciliations have processed (the two run in parallel in the task graph,
+-- so whichever finishes last dequeues)
+DELETE FROM doc_ai_qs_db.doc_ai_schema.RECONCILE_PENDING_INVOICES
+WHERE items_reconciled AND totals_reconciled;
 
-  status_message := 'Item reconciliation executed. Discrepancies and auto-reconciled items merged into RECONCILE_RESULTS_ITEMS. Fully auto-reconciled invoices merged into GOLD_INVOICE_ITEMS.';
+  status_message := 'Item reconciliation executed. Discrepancies and auto-reconciled items merged into RECONCILE_RESULTS_ITEMS. Fully auto-reconciled invoices merged into GOLD_INVOICE_ITEMS ('
+    || gold_rows_inserted || ' rows inserted, ' || gold_rows_deleted || ' rows deleted).';
   RETURN status_message;
 
 EXCEPTION
@@ -189,7 +323,7 @@ END;
 $$;
 
 
-CREATE OR REPLACE PROCEDURE doc_ai_qs_db.doc_ai_schema.SP_RUN_TOTALS_RECONCILIATION()
+CREATE OR REPLACE PROCEDURE doc_ai_qs_db.doc_ai_schema.SP_RUN_TOTALS_RECONCILIATION(FULL_REFRESH BOOLEAN DEFAULT FALSE)
 RETURNS VARCHAR
 LANGUAGE SQL
 AS
@@ -197,10 +331,32 @@ $$
 DECLARE
   status_message VARCHAR;
   current_run_timestamp TIMESTAMP_NTZ; -- Use consistent timestamp for the run
+  gold_rows_inserted INTEGER DEFAULT 0;
+  gold_rows_updated INTEGER DEFAULT 0;
 BEGIN
     current_run_timestamp := CURRENT_TIMESTAMP();
-MERGE INTO doc_ai_qs_db.doc_ai_schema.RECONCILE_RESULTS_TOTALS AS target
-USING(
+-- Invoices this run reconciles
+CREATE OR REPLACE TEMPORARY TABLE doc_ai_qs_db.doc_ai_schema.TOTALS_RECONCILE_SCOPE AS
+    SELECT invoice_id FROM doc_ai_qs_db.doc_ai_schema.TRANSACT_TOTALS
+    WHERE :full_refresh OR invoice_id IN (
+        SELECT invoice_id FROM doc_ai_qs_db.doc_ai_schema.RECONCILE_PENDING_INVOICES
+        WHERE captured_timestamp <= :current_run_timestamp
+    )
+    UNION
+    SELECT invoice_id FROM doc_ai_qs_db.doc_ai_schema.DOCAI_INVOICE_TOTALS
+    WHERE :full_refresh OR invoice_id IN (
+        SELECT invoice_id FROM doc_ai_qs_db.doc_ai_schema.RECONCILE_PENDING_INVOICES
+        WHERE captured_timestamp <= :current_run_timestamp
+    );
+
+-- Replace their totals discrepancies: one row per differing field, one row per invoice found on one side only
+DELETE FROM doc_ai_qs_db.doc_ai_schema.RECONCILE_DISCREPANCIES
+WHERE source = 'TOTALS'
+AND invoice_id IN (SELECT invoice_id FROM doc_ai_qs_db.doc_ai_schema.TOTALS_RECONCILE_SCOPE);
+
+INSERT INTO doc_ai_qs_db.doc_ai_schema.RECONCILE_DISCREPANCIES (
+    invoice_id, source, field, mismatch_type, value_a, value_b, date_a, date_b, delta, last_reconciled_timestamp
+)
     WITH db_totals AS (
     SELECT
         invoice_id,
@@ -209,6 +365,7 @@ USING(
         tax,
         total
         FROM doc_ai_qs_db.doc_ai_schema.TRANSACT_TOTALS a
+        WHERE invoice_id IN (SELECT invoice_id FROM doc_ai_qs_db.doc_ai_schema.TOTALS_RECONCILE_SCOPE)
     ),
     docai_totals AS (
     SELECT
@@ -218,6 +375,7 @@ USING(
         tax,
         total
     FROM doc_ai_qs_db.doc_ai_schema.DOCAI_INVOICE_TOTALS b
+    WHERE invoice_id IN (SELECT invoice_id FROM doc_ai_qs_db.doc_ai_schema.TOTALS_RECONCILE_SCOPE)
     ),
 
     join_table AS (SELECT
@@ -226,55 +384,71 @@ USING(
     -- Data from Table A
     a.invoice_date AS invoiceDate_A,
     a.subtotal AS subtotal_A,
-    a.tax AS UnitPrice_A,
-    a.total AS TotalPrice_A,
+    a.tax AS tax_A,
+    a.total AS total_A,
 
     -- Data from Table B
     b.invoice_date AS invoiceDate_B,
     b.subtotal AS subtotal_B,
-    b.tax AS UnitPrice_B,
-    b.total AS TotalPrice_B,
+    b.tax AS tax_B,
+    b.total AS total_B,
 
-    -- Reconciliation Status and Discrepancies
+    -- Reconciliation Status
     CASE
         WHEN a.invoice_id IS NOT NULL AND b.invoice_id IS NOT NULL THEN 'Matched Line Item Occurrence'
         WHEN a.invoice_id IS NOT NULL AND b.invoice_id IS NULL THEN 'In Table A Only'
         WHEN a.invoice_id IS NULL AND b.invoice_id IS NOT NULL THEN 'In Table B Only'
-    END AS Reconciliation_Status,
-
-    CASE
-        WHEN a.invoice_id IS NOT NULL AND b.invoice_id IS NOT NULL THEN
-            TRIM(
-                COALESCE(IFF(a.invoice_date <> b.invoice_date, 'date_Diff(' || a.invoice_date::VARCHAR || ' vs ' || b.invoice_date::VARCHAR || '); ', ''), '') ||
-                COALESCE(IFF(a.subtotal <> b.subtotal, 'subtotal_Diff(' || a.subtotal::VARCHAR || ' vs ' || b.subtotal::VARCHAR || '); ', ''), '') ||
-                COALESCE(IFF(a.tax <> b.tax, 'tax_Diff(' || a.tax::VARCHAR || ' vs ' || b.tax::VARCHAR || '); ', ''), '') ||
-                COALESCE(IFF(a.total <> b.total, 'total_Diff(' || a.total::VARCHAR || ' vs ' || b.total::VARCHAR || '); ', ''), '')
-                -- Add more detailed discrepancy checks as needed
-            )
-        WHEN a.invoice_id IS NOT NULL AND b.invoice_id IS NULL THEN 'In Table A Only'
-        WHEN a.invoice_id IS NULL AND b.invoice_id IS NOT NULL THEN 'In Table B Only'
-        ELSE NULL
-    END AS Discrepancies
+    END AS Reconciliation_Status
 FROM db_totals a
 FULL OUTER JOIN docai_totals b
     ON a.invoice_id = b.invoice_id
+    )
+
+    -- <> is NULL when either side is NULL, so only values present on both sides can differ
+    SELECT Reconciled_invoice_id, 'TOTALS', 'invoice_date', 'date_Diff', NULL, NULL, invoiceDate_A, invoiceDate_B,
+           DATEDIFF('day', invoiceDate_A, invoiceDate_B), :current_run_timestamp
+    FROM join_table WHERE invoiceDate_A <> invoiceDate_B
+    UNION ALL
+    SELECT Reconciled_invoice_id, 'TOTALS', 'subtotal', 'subtotal_Diff', subtotal_A, subtotal_B, NULL, NULL,
+           subtotal_B - subtotal_A, :current_run_timestamp
+    FROM join_table WHERE subtotal_A <> subtotal_B
+    UNION ALL
+    SELECT Reconciled_invoice_id, 'TOTALS', 'tax', 'tax_Diff', tax_A, tax_B, NULL, NULL,
+           tax_B - tax_A, :current_run_timestamp
+    FROM join_table WHERE tax_A <> tax_B
+    UNION ALL
+    SELECT Reconciled_invoice_id, 'TOTALS', 'total', 'total_Diff', total_A, total_B, NULL, NULL,
+           total_B - total_A, :current_run_timestamp
+    FROM join_table WHERE total_A <> total_B
+    UNION ALL
+    SELECT Reconciled_invoice_id, 'TOTALS', NULL, Reconciliation_Status, NULL, NULL, NULL, NULL,
+           NULL, :current_run_timestamp
+    FROM join_table WHERE Reconciliation_Status <> 'Matched Line Item Occurrence';
+
+MERGE INTO doc_ai_qs_db.doc_ai_schema.RECONCILE_RESULTS_TOTALS AS target
+USING(
+    -- item_mismatch_details is derived from the discrepancy rows, e.g. '2004: tax_Diff(99.99 vs 19.07); total_Diff(309.73 vs 209.73);'
+    WITH invoice_discrepancies AS (
+    SELECT
+        invoice_id,
+        LISTAGG(
+            CASE
+                WHEN field IS NULL THEN mismatch_type
+                WHEN field = 'invoice_date' THEN mismatch_type || '(' || date_a::VARCHAR || ' vs ' || date_b::VARCHAR || ');'
+                ELSE mismatch_type || '(' || value_a::VARCHAR || ' vs ' || value_b::VARCHAR || ');'
+            END,
+            ' '
+        ) WITHIN GROUP (ORDER BY DECODE(field, 'invoice_date', 4, 'subtotal', 5, 'tax', 6, 'total', 7, 0)) AS discrepancies
+    FROM doc_ai_qs_db.doc_ai_schema.RECONCILE_DISCREPANCIES
+    WHERE source = 'TOTALS'
+    AND invoice_id IN (SELECT invoice_id FROM doc_ai_qs_db.doc_ai_schema.TOTALS_RECONCILE_SCOPE)
+    GROUP BY invoice_id
     ),
 
 ReconciliationSource AS (
 SELECT
-    Reconciled_invoice_id AS invoice_id,
-    LISTAGG(
-        DISTINCT CASE
-            WHEN discrepancies IS NOT NULL AND discrepancies <> '' THEN Reconciled_invoice_id || ': ' || discrepancies
-            ELSE NULL
-        END,
-        '; '
-    ) WITHIN GROUP (ORDER BY
-                        CASE
-                            WHEN discrepancies IS NOT NULL AND discrepancies <> '' THEN Reconciled_invoice_id || ': ' || discrepancies
-                            ELSE NULL
-                        END
-                   ) AS item_mismatch_details,
+    s.invoice_id,
+    COALESCE(MAX(d.invoice_id || ': ' || d.discrepancies), '') AS item_mismatch_details,
     CASE
         WHEN item_mismatch_details = '' THEN 'Auto-reconciled'
         ELSE 'Pending Review'
@@ -285,11 +459,12 @@ SELECT
     NULL as notes
     
 FROM
-    join_table 
+    doc_ai_qs_db.doc_ai_schema.TOTALS_RECONCILE_SCOPE s
+    LEFT JOIN invoice_discrepancies d ON d.invoice_id = s.invoice_id
 GROUP BY
-    Reconciled_invoice_id
+    s.invoice_id
 ORDER BY
-    Reconciled_invoice_id
+    s.invoice_id
 )
     -- Select final source for merge
     SELECT * FROM ReconciliationSource
@@ -331,34 +506,51 @@ ORDER BY
     :current_run_timestamp  -- Use variable for consistency
   );
 
-SELECT * FROM TRANSACT_TOTALS;
-
-CREATE OR REPLACE TEMPORARY TABLE ReadyForGold AS(
-    SELECT 
-    *,
-    'Auto-reconciled' AS reviewed_by,
-    :current_run_timestamp AS reviewed_timestamp
-    FROM doc_ai_qs_db.doc_ai_schema.TRANSACT_TOTALS
-    WHERE INVOICE_ID IN (
-        SELECT INVOICE_ID
-        FROM doc_ai_qs_db.doc_ai_schema.RECONCILE_RESULTS_TOTALS
-        WHERE REVIEW_STATUS = 'Auto-reconciled'
-    )
-);
-    
-DELETE FROM doc_ai_qs_db.doc_ai_schema.GOLD_INVOICE_TOTALS
-WHERE invoice_id IN (SELECT DISTINCT invoice_id FROM ReadyForGold);
+-- Promote the invoices this run reconciled to 'Auto-reconciled', except those whose gold row a reviewer
+-- wrote and those whose gold row already equals TRANSACT_TOTALS, so a FULL_REFRESH rewrites only
+-- invoices whose bronze row changed.
+MERGE INTO doc_ai_qs_db.doc_ai_schema.GOLD_INVOICE_TOTALS AS target
+USING (
+    SELECT t.invoice_id, t.invoice_date, t.subtotal, t.tax, t.total
+    FROM doc_ai_qs_db.doc_ai_schema.TRANSACT_TOTALS t
+    JOIN doc_ai_qs_db.doc_ai_schema.RECONCILE_RESULTS_TOTALS r
+      ON t.invoice_id = r.invoice_id
+    WHERE r.review_status = 'Auto-reconciled'
+    AND r.last_reconciled_timestamp = :current_run_timestamp
+  ) AS source
+  ON target.invoice_id = source.invoice_id
+  WHEN MATCHED AND target.reviewed_by = 'Auto-reconciled'
+    AND (target.invoice_date IS DISTINCT FROM source.invoice_date
+         OR target.subtotal IS DISTINCT FROM source.subtotal::NUMBER(10, 2)
+         OR target.tax IS DISTINCT FROM source.tax::NUMBER(10, 2)
+         OR target.total IS DISTINCT FROM source.total::NUMBER(10, 2)) THEN UPDATE SET
+    target.invoice_date = source.invoice_date,
+    target.subtotal = source.subtotal,
+    target.tax = source.tax,
+    target.total = source.total,
+    target.reviewed_by = 'Auto-reconciled',
+    target.reviewed_timestamp = :current_run_timestamp,
+    target.notes = NULL
+  WHEN NOT MATCHED THEN INSERT (
+    invoice_id, invoice_date, subtotal, tax, total, reviewed_by, reviewed_timestamp
+  ) VALUES (
+    source.invoice_id, source.invoice_date, source.subtotal, source.tax, source.total, 'Auto-reconciled', :current_run_timestamp
+  );
 
--- Step 2: Insert all the new line TOTALS from incoming_data.
-INSERT INTO doc_ai_qs_db.doc_ai_schema.GOLD_INVOICE_TOTALS (invoice_id, invoice_date, subtotal, tax, total, reviewed_by, reviewed_timestamp)
-SELECT invoice_id, invoice_date, subtotal, tax, total, reviewed_by, reviewed_timestamp
-FROM ReadyForGold;
+SELECT "number of rows inserted", "number of rows updated" INTO :gold_rows_inserted, :gold_rows_updated
+FROM TABLE(RESULT_SCAN(LAST_QUERY_ID()));
 
--- Clearing our streams of data
-CREATE TEMPORARY TABLE table1 AS SELECT * FROM doc_ai_qs_db.doc_ai_schema.BRONZE_DB_STREAM WHERE 0 = 1;
-CREATE TEMPORARY TABLE table2 AS SELECT * FROM doc_ai_qs_db.doc_ai_schema.BRONZE_DOCAI_STREAM WHERE 0 = 1;
+-- Mark the captured invoices as processed by the totals reconciliation
+UPDATE doc_ai_qs_db.doc_ai_schema.RECONCILE_PENDING_INVOICES
+SET totals_reconciled = TRUE
+WHERE captured_timestamp <= :current_run_timestamp;
 
-  status_message := 'Item reconciliation executed. Discrepancies and auto-reconciled items merged into RECONCILE_RESULTS_TOTALS. Fully auto-reconciled invoices merged into GOLD_INVOICE_TOTALS.';
+-- Dequeue invoices that both reconciliations have processed
+DELETE FROM doc_ai_qs_db.doc_ai_schema.RECONCILE_PENDING_INVOICES
+WHERE items_reconciled AND totals_reconciled;
+
+  status_message := 'Item reconciliation executed. Discrepancies and auto-reconciled items merged into RECONCILE_RESULTS_TOTALS. Fully auto-reconciled invoices merged into GOLD_INVOICE_TOTALS ('
+    || gold_rows_inserted || ' rows inserted, ' || gold_rows_updated || ' rows updated).';
   RETURN status_message;
 
 EXCEPTION
@@ -368,7 +560,554 @@ EXCEPTION
 END;
 $$;
 
+-- Keeps RECONCILE_METRICS_INVOICES / RECONCILE_METRICS_DAILY up to date for the app's metrics panel.
+-- Only invoices reconciled since the previous refresh (or the given INVOICE_ID(s), after a manual review)
+-- are re-evaluated, and only the invoice dates they belong to are re-aggregated.
+CREATE OR REPLACE PROCEDURE doc_ai_qs_db.doc_ai_schema.SP_REFRESH_RECONCILE_METRICS(INVOICE_ID VARCHAR DEFAULT NULL, FULL_REFRESH BOOLEAN DEFAULT FALSE)
+RETURNS VARCHAR
+LANGUAGE SQL
+AS
+$$
+DECLARE
+  status_message VARCHAR;
+  current_run_timestamp TIMESTAMP_NTZ;
+  watermark TIMESTAMP_NTZ;
+  invoices_refreshed INTEGER DEFAULT 0;
+BEGIN
+    current_run_timestamp := CURRENT_TIMESTAMP();
+    SELECT COALESCE(MAX(refreshed_timestamp), '1970-01-01'::TIMESTAMP_NTZ) INTO :watermark
+    FROM doc_ai_qs_db.doc_ai_schema.RECONCILE_METRICS_REFRESH_LOG;
+
+CREATE OR REPLACE TEMPORARY TABLE metrics_affected_invoices AS
+    -- INVOICE_ID is a single invoice id or a JSON array of ids (bulk review)
+    SELECT f.value::VARCHAR AS invoice_id
+    FROM TABLE(FLATTEN(INPUT => IFF(IS_ARRAY(TRY_PARSE_JSON(:invoice_id)), TRY_PARSE_JSON(:invoice_id), ARRAY_CONSTRUCT(:invoice_id)))) f
+    WHERE :invoice_id IS NOT NULL
+    UNION
+    SELECT invoice_id FROM doc_ai_qs_db.doc_ai_schema.RECONCILE_RESULTS_ITEMS
+    WHERE :invoice_id IS NULL AND (:full_refresh OR last_reconciled_timestamp > :watermark)
+    UNION
+    SELECT invoice_id FROM doc_ai_qs_db.doc_ai_schema.RECONCILE_RESULTS_TOTALS
+    WHERE :invoice_id IS NULL AND (:full_refresh OR last_reconciled_timestamp > :watermark)
+    UNION
+    SELECT invoice_id FROM doc_ai_qs_db.doc_ai_schema.TRANSACT_TOTALS
+    WHERE :invoice_id IS NULL AND :full_refresh
+    UNION
+    SELECT invoice_id FROM doc_ai_qs_db.doc_ai_schema.RECONCILE_METRICS_INVOICES
+    WHERE :invoice_id IS NULL AND :full_refresh;
+
+-- Dates to re-aggregate: the affected invoices' previous dates and their current ones
+CREATE OR REPLACE TEMPORARY TABLE metrics_affected_dates AS
+    SELECT m.invoice_date FROM doc_ai_qs_db.doc_ai_schema.RECONCILE_METRICS_INVOICES m
+    JOIN metrics_affected_invoices a ON m.invoice_id = a.invoice_id
+    UNION
+    SELECT t.invoice_date FROM doc_ai_qs_db.doc_ai_schema.TRANSACT_TOTALS t
+    JOIN metrics_affected_invoices a ON t.invoice_id = a.invoice_id;
+
+MERGE INTO doc_ai_qs_db.doc_ai_schema.RECONCILE_METRICS_INVOICES AS target
+USING (
+    SELECT
+        a.invoice_id,
+        tt.invoice_date,
+        tt.total,
+        tt.invoice_id IS NOT NULL AS in_transact,
+        CASE
+            WHEN gt.auto_reconciled AND gi.auto_reconciled THEN 'Auto-reconciled'
+            WHEN gt.invoice_id IS NOT NULL AND gi.invoice_id IS NOT NULL THEN 'Reviewed'
+            ELSE 'Pending'
+        END AS metric_status
+    FROM metrics_affected_invoices a
+    LEFT JOIN (
+        SELECT t.invoice_id, MAX(t.invoice_date) AS invoice_date, SUM(t.total) AS total
+        FROM doc_ai_qs_db.doc_ai_schema.TRANSACT_TOTALS t
+        JOIN metrics_affected_invoices a ON t.invoice_id = a.invoice_id
+        GROUP BY t.invoice_id
+    ) tt ON tt.invoice_id = a.invoice_id
+    LEFT JOIN (
+        SELECT g.invoice_id, BOOLOR_AGG(g.reviewed_by = 'Auto-reconciled') AS auto_reconciled
+        FROM doc_ai_qs_db.doc_ai_schema.GOLD_INVOICE_TOTALS g
+        JOIN metrics_affected_invoices a ON g.invoice_id = a.invoice_id
+        GROUP BY g.invoice_id
+    ) gt ON gt.invoice_id = a.invoice_id
+    LEFT JOIN (
+        SELECT g.invoice_id, BOOLOR_AGG(g.reviewed_by = 'Auto-reconciled') AS auto_reconciled
+        FROM doc_ai_qs_db.doc_ai_schema.GOLD_INVOICE_ITEMS g
+        JOIN metrics_affected_invoices a ON g.invoice_id = a.invoice_id
+        GROUP BY g.invoice_id
+    ) gi ON gi.invoice_id = a.invoice_id
+  ) AS source
+  ON target.invoice_id = source.invoice_id
+  WHEN MATCHED AND NOT source.in_transact THEN DELETE
+  WHEN MATCHED THEN UPDATE SET
+    target.invoice_date = source.invoice_date,
+    target.total = source.total,
+    target.metric_status = source.metric_status,
+    target.refreshed_timestamp = :current_run_timestamp
+  WHEN NOT MATCHED AND source.in_transact THEN INSERT (
+    invoice_id, invoice_date, total, metric_status, refreshed_timestamp
+  ) VALUES (
+    source.invoice_id, source.invoice_date, source.total, source.metric_status, :current_run_timestamp
+  );
+
+    invoices_refreshed := SQLROWCOUNT;
+
+MERGE INTO doc_ai_qs_db.doc_ai_schema.RECONCILE_METRICS_DAILY AS target
+USING (
+    SELECT
+        d.invoice_date,
+        COUNT(m.invoice_id) AS invoice_count,
+        COALESCE(SUM(m.total), 0) AS total_amount,
+        COUNT_IF(m.metric_status IN ('Reviewed', 'Auto-reconciled')) AS reconciled_invoice_count,
+        COALESCE(SUM(IFF(m.metric_status IN ('Reviewed', 'Auto-reconciled'), m.total, 0)), 0) AS reconciled_amount,
+        COUNT_IF(m.metric_status = 'Auto-reconciled') AS auto_reconciled_invoice_count,
+        COALESCE(SUM(IFF(m.metric_status = 'Auto-reconciled', m.total, 0)), 0) AS auto_reconciled_amount,
+        COUNT_IF(m.metric_status = 'Pending') AS pending_invoice_count,
+        COALESCE(SUM(IFF(m.metric_status = 'Pending', m.total, 0)), 0) AS pending_amount
+    FROM metrics_affected_dates d
+    LEFT JOIN doc_ai_qs_db.doc_ai_schema.RECONCILE_METRICS_INVOICES m
+      ON EQUAL_NULL(m.invoice_date, d.invoice_date)
+    GROUP BY d.invoice_date
+  ) AS source
+  ON EQUAL_NULL(target.invoice_date, source.invoice_date)
+  WHEN MATCHED AND source.invoice_count = 0 THEN DELETE
+  WHEN MATCHED THEN UPDATE SET
+    target.invoice_count = source.invoice_count,
+    target.total_amount = source.total_amount,
+    target.reconciled_invoice_count = source.reconciled_invoice_count,
+    target.reconciled_amount = source.reconciled_amount,
+    target.auto_reconciled_invoice_count = source.auto_reconciled_invoice_count,
+    target.auto_reconciled_amount = source.auto_reconciled_amount,
+    target.pending_invoice_count = source.pending_invoice_count,
+    target.pending_amount = source.pending_amount,
+    target.refreshed_timestamp = :current_run_timestamp
+  WHEN NOT MATCHED AND source.invoice_count > 0 THEN INSERT (
+    invoice_date, invoice_count, total_amount, reconciled_invoice_count, reconciled_amount,
+    auto_reconciled_invoice_count, auto_reconciled_amount, pending_invoice_count, pending_amount, refreshed_timestamp
+  ) VALUES (
+    source.invoice_date, source.invoice_count, source.total_amount, source.reconciled_invoice_count, source.reconciled_amount,
+    source.auto_reconciled_invoice_count, source.auto_reconciled_amount, source.pending_invoice_count, source.pending_amount, :current_run_timestamp
+  );
+
+-- Single-invoice refreshes (manual review) must not move the watermark used by the task
+INSERT INTO doc_ai_qs_db.doc_ai_schema.RECONCILE_METRICS_REFRESH_LOG (refreshed_timestamp, invoices_refreshed, full_refresh)
+SELECT :current_run_timestamp, :invoices_refreshed, :full_refresh
+WHERE :invoice_id IS NULL;
+
+  status_message := 'Reconciliation metrics refreshed for ' || invoices_refreshed || ' invoices.';
+  RETURN status_message;
+
+EXCEPTION
+  WHEN OTHER THEN
+    status_message := 'Error refreshing reconciliation metrics: ' || SQLERRM;
+    RETURN status_message;
+END;
+$$;
+
+
+-- Recomputes the metrics from the raw TRANSACT_TOTALS / GOLD_* tables and compares them with RECONCILE_METRICS_DAILY.
+CREATE OR REPLACE PROCEDURE doc_ai_qs_db.doc_ai_schema.SP_CHECK_RECONCILE_METRICS()
+RETURNS VARCHAR
+LANGUAGE SQL
+AS
+$$
+DECLARE
+  mismatched_days INTEGER;
+  mismatched_dates VARCHAR;
+BEGIN
+SELECT COUNT(*), LISTAGG(COALESCE(invoice_date::VARCHAR, 'NULL'), ', ') WITHIN GROUP (ORDER BY invoice_date)
+INTO :mismatched_days, :mismatched_dates
+FROM (
+    WITH per_invoice AS (
+        SELECT
+            tt.invoice_id,
+            MAX(tt.invoice_date) AS invoice_date,
+            SUM(tt.total) AS total,
+            EXISTS (SELECT 1 FROM doc_ai_qs_db.doc_ai_schema.GOLD_INVOICE_TOTALS git WHERE git.invoice_id = tt.invoice_id)
+              AND EXISTS (SELECT 1 FROM doc_ai_qs_db.doc_ai_schema.GOLD_INVOICE_ITEMS gii WHERE gii.invoice_id = tt.invoice_id) AS is_reconciled,
+            EXISTS (SELECT 1 FROM doc_ai_qs_db.doc_ai_schema.GOLD_INVOICE_TOTALS git WHERE git.invoice_id = tt.invoice_id AND git.reviewed_by = 'Auto-reconciled')
+              AND EXISTS (SELECT 1 FROM doc_ai_qs_db.doc_ai_schema.GOLD_INVOICE_ITEMS gii WHERE gii.invoice_id = tt.invoice_id AND gii.reviewed_by = 'Auto-reconciled') AS is_auto
+        FROM doc_ai_qs_db.doc_ai_schema.TRANSACT_TOTALS tt
+        GROUP BY tt.invoice_id
+    ),
+    expected AS (
+        SELECT
+            invoice_date,
+            COUNT(*) AS invoice_count,
+            COALESCE(SUM(total), 0) AS total_amount,
+            COUNT_IF(is_reconciled) AS reconciled_invoice_count,
+            COALESCE(SUM(IFF(is_reconciled, total, 0)), 0) AS reconciled_amount,
+            COUNT_IF(is_auto) AS auto_reconciled_invoice_count,
+            COALESCE(SUM(IFF(is_auto, total, 0)), 0) AS auto_reconciled_amount
+        FROM per_invoice
+        GROUP BY invoice_date
+    )
+    SELECT COALESCE(e.invoice_date, d.invoice_date) AS invoice_date
+    FROM expected e
+    FULL OUTER JOIN doc_ai_qs_db.doc_ai_schema.RECONCILE_METRICS_DAILY d
+      ON EQUAL_NULL(e.invoice_date, d.invoice_date)
+    WHERE NOT EQUAL_NULL(e.invoice_count, d.invoice_count)
+       OR NOT EQUAL_NULL(e.total_amount, d.total_amount)
+       OR NOT EQUAL_NULL(e.reconciled_invoice_count, d.reconciled_invoice_count)
+       OR NOT EQUAL_NULL(e.reconciled_amount, d.reconciled_amount)
+       OR NOT EQUAL_NULL(e.auto_reconciled_invoice_count, d.auto_reconciled_invoice_count)
+       OR NOT EQUAL_NULL(e.auto_reconciled_amount, d.auto_reconciled_amount)
+       OR NOT EQUAL_NULL(e.invoice_count - e.reconciled_invoice_count, d.pending_invoice_count)
+);
+
+  IF (mismatched_days = 0) THEN
+    RETURN 'Reconciliation metrics are consistent with the raw tables.';
+  END IF;
+  RETURN mismatched_days || ' invoice date(s) differ from the raw tables: ' || mismatched_dates
+      || '. Run CALL SP_REFRESH_RECONCILE_METRICS(NULL, TRUE); to rebuild.';
+END;
+$$;
+
+-- Write path for a manual review: replaces the invoice's gold rows with the reviewed items / totals and
+-- marks it Reviewed in both reconcile tables, all in one transaction. The client sends ITEMS and TOTALS
+-- as JSON arrays of row objects (upper-case column names) in the same CALL, so nothing is staged or re-read.
+CREATE OR REPLACE PROCEDURE doc_ai_qs_db.doc_ai_schema.SP_SUBMIT_REVIEW(INVOICE_ID VARCHAR, ITEMS VARCHAR, TOTALS VARCHAR, REVIEWED_BY VARCHAR, NOTES VARCHAR)
+RETURNS VARCHAR
+LANGUAGE SQL
+AS
+$$
+DECLARE
+  review_timestamp TIMESTAMP_NTZ DEFAULT CURRENT_TIMESTAMP()::TIMESTAMP_NTZ;
+  items_written INTEGER DEFAULT 0;
+  totals_written INTEGER DEFAULT 0;
+BEGIN
+BEGIN TRANSACTION;
+
+-- Same DELETE marker pattern as the auto-promotion: the previous gold rows go and the reviewed rows
+-- come in with a single MERGE
+MERGE INTO doc_ai_qs_db.doc_ai_schema.GOLD_INVOICE_ITEMS AS target
+USING (
+    SELECT :invoice_id AS invoice_id, NULL AS product_name, NULL AS quantity, NULL AS unit_price, NULL AS total_price, 'DELETE' AS promote_action
+    UNION ALL
+    SELECT
+        :invoice_id,
+        f.value:"PRODUCT_NAME"::VARCHAR,
+        f.value:"QUANTITY"::NUMBER,
+        f.value:"UNIT_PRICE"::DECIMAL(10,2),
+        f.value:"TOTAL_PRICE"::DECIMAL(10,2),
+        'INSERT'
+    FROM TABLE(FLATTEN(INPUT => PARSE_JSON(:items))) f
+  ) AS source
+  ON target.invoice_id = source.invoice_id AND source.promote_action = 'DELETE'
+  WHEN MATCHED THEN DELETE
+  WHEN NOT MATCHED AND source.promote_action = 'INSERT' THEN INSERT (
+    invoice_id, product_name, quantity, unit_price, total_price, reviewed_by, reviewed_timestamp, notes
+  ) VALUES (
+    source.invoice_id, source.product_name, source.quantity, source.unit_price, source.total_price, :reviewed_by, :review_timestamp, :notes
+  );
+
+SELECT "number of rows inserted" INTO :items_written FROM TABLE(RESULT_SCAN(LAST_QUERY_ID()));
+
+MERGE INTO doc_ai_qs_db.doc_ai_schema.GOLD_INVOICE_TOTALS AS target
+USING (
+    SELECT
+        :invoice_id AS invoice_id,
+        f.value:"INVOICE_DATE"::DATE AS invoice_date,
+        f.value:"SUBTOTAL"::DECIMAL(10,2) AS subtotal,
+        f.value:"TAX"::DECIMAL(10,2) AS tax,
+        f.value:"TOTAL"::DECIMAL(10,2) AS total
+    FROM TABLE(FLATTEN(INPUT => PARSE_JSON(:totals))) f
+    QUALIFY ROW_NUMBER() OVER (ORDER BY f.index) = 1
+  ) AS source
+  ON target.invoice_id = source.invoice_id
+  WHEN MATCHED THEN UPDATE SET
+    target.invoice_date = source.invoice_date,
+    target.subtotal = source.subtotal,
+    target.tax = source.tax,
+    target.total = source.total,
+    target.reviewed_by = :reviewed_by,
+    target.reviewed_timestamp = :review_timestamp,
+    target.notes = :notes
+  WHEN NOT MATCHED THEN INSERT (
+    invoice_id, invoice_date, subtotal, tax, total, reviewed_by, reviewed_timestamp, notes
+  ) VALUES (
+    source.invoice_id, source.invoice_date, source.subtotal, source.tax, source.total, :reviewed_by, :review_timestamp, :notes
+  );
+
+totals_written := SQLROWCOUNT;
+
+UPDATE doc_ai_qs_db.doc_ai_schema.RECONCILE_RESULTS_ITEMS
+SET review_status = 'Reviewed', reviewed_by = :reviewed_by, reviewed_timestamp = :review_timestamp, notes = :notes
+WHERE invoice_id = :invoice_id;
+
+UPDATE doc_ai_qs_db.doc_ai_schema.RECONCILE_RESULTS_TOTALS
+SET review_status = 'Reviewed', reviewed_by = :reviewed_by, reviewed_timestamp = :review_timestamp, notes = :notes
+WHERE invoice_id = :invoice_id;
+
+COMMIT;
+
+-- Metrics are derived data and are rebuilt by the task if this refresh fails
+CALL doc_ai_qs_db.doc_ai_schema.SP_REFRESH_RECONCILE_METRICS(:invoice_id);
+
+  RETURN 'Invoice ' || invoice_id || ' reviewed: ' || items_written || ' item row(s) and ' || totals_written || ' totals row(s) written.';
+
+EXCEPTION
+  WHEN OTHER THEN
+    -- Nothing is written unless everything is; re-raise so the caller sees the failure
+    ROLLBACK;
+    RAISE;
+END;
+$$;
+
+-- Bulk review: accepts the DocAI-extracted values for many invoices at once. INVOICE_IDS is a JSON array
+-- of ids; their DOCAI_INVOICE_ITEMS / DOCAI_INVOICE_TOTALS rows replace the gold rows and the invoices are
+-- marked Reviewed, in one transaction and without the rows leaving the warehouse. Invoices missing DocAI
+-- items or totals are skipped. Returns an object with the message, the accepted count and the skipped ids.
+CREATE OR REPLACE PROCEDURE doc_ai_qs_db.doc_ai_schema.SP_BULK_ACCEPT_DOCAI(INVOICE_IDS VARCHAR, REVIEWED_BY VARCHAR, NOTES VARCHAR)
+RETURNS VARIANT
+LANGUAGE SQL
+AS
+$$
+DECLARE
+  review_timestamp TIMESTAMP_NTZ DEFAULT CURRENT_TIMESTAMP()::TIMESTAMP_NTZ;
+  invoices_accepted INTEGER DEFAULT 0;
+  invoices_skipped INTEGER DEFAULT 0;
+  skipped_invoice_ids ARRAY DEFAULT ARRAY_CONSTRUCT();
+  items_written INTEGER DEFAULT 0;
+  totals_written INTEGER DEFAULT 0;
+BEGIN
+-- Created before the transaction starts: DDL would commit it
+-- Both DocAI items and totals are required: totals alone would leave a gold invoice without lines
+CREATE OR REPLACE TEMPORARY TABLE bulk_accept_invoices AS
+    SELECT DISTINCT f.value::VARCHAR AS invoice_id
+    FROM TABLE(FLATTEN(INPUT => PARSE_JSON(:invoice_ids))) f
+    WHERE EXISTS (SELECT 1 FROM doc_ai_qs_db.doc_ai_schema.DOCAI_INVOICE_TOTALS d WHERE d.invoice_id = f.value::VARCHAR)
+    AND EXISTS (SELECT 1 FROM doc_ai_qs_db.doc_ai_schema.DOCAI_INVOICE_ITEMS d WHERE d.invoice_id = f.value::VARCHAR);
+
+invoices_accepted := SQLROWCOUNT;
+
+SELECT ARRAY_AGG(DISTINCT f.value::VARCHAR) WITHIN GROUP (ORDER BY f.value::VARCHAR) INTO :skipped_invoice_ids
+FROM TABLE(FLATTEN(INPUT => PARSE_JSON(:invoice_ids))) f
+WHERE NOT EXISTS (SELECT 1 FROM bulk_accept_invoices b WHERE b.invoice_id = f.value::VARCHAR);
+
+invoices_skipped := ARRAY_SIZE(skipped_invoice_ids);
+
+BEGIN TRANSACTION;
+
+MERGE INTO doc_ai_qs_db.doc_ai_schema.GOLD_INVOICE_ITEMS AS target
+USING (
+    SELECT invoice_id, NULL AS product_name, NULL AS quantity, NULL AS unit_price, NULL AS total_price, 'DELETE' AS promote_action
+    FROM bulk_accept_invoices
+    UNION ALL
+    SELECT d.invoice_id, d.product_name, d.quantity, d.unit_price, d.total_price, 'INSERT' AS promote_action
+    FROM doc_ai_qs_db.doc_ai_schema.DOCAI_INVOICE_ITEMS d
+    JOIN bulk_accept_invoices b ON d.invoice_id = b.invoice_id
+  ) AS source
+  ON target.invoice_id = source.invoice_id AND source.promote_action = 'DELETE'
+  WHEN MATCHED THEN DELETE
+  WHEN NOT MATCHED AND source.promote_action = 'INSERT' THEN INSERT (
+    invoice_id, product_name, quantity, unit_price, total_price, reviewed_by, reviewed_timestamp, notes
+  ) VALUES (
+    source.invoice_id, source.product_name, source.quantity, source.unit_price, source.total_price, :reviewed_by, :review_timestamp, :notes
+  );
+
+SELECT "number of rows inserted" INTO :items_written FROM TABLE(RESULT_SCAN(LAST_QUERY_ID()));
+
+MERGE INTO doc_ai_qs_db.doc_ai_schema.GOLD_INVOICE_TOTALS AS target
+USING (
+    SELECT d.invoice_id, d.invoice_date, d.subtotal, d.tax, d.total
+    FROM doc_ai_qs_db.doc_ai_schema.DOCAI_INVOICE_TOTALS d
+    JOIN bulk_accept_invoices b ON d.invoice_id = b.invoice_id
+    QUALIFY ROW_NUMBER() OVER (PARTITION BY d.invoice_id ORDER BY d.invoice_date DESC) = 1
+  ) AS source
+  ON target.invoice_id = source.invoice_id
+  WHEN MATCHED THEN UPDATE SET
+    target.invoice_date = source.invoice_date,
+    target.subtotal = source.subtotal,
+    target.tax = source.tax,
+    target.total = source.total,
+    target.reviewed_by = :reviewed_by,
+    target.reviewed_timestamp = :review_timestamp,
+    target.notes = :notes
+  WHEN NOT MATCHED THEN INSERT (
+    invoice_id, invoice_date, subtotal, tax, total, reviewed_by, reviewed_timestamp, notes
+  ) VALUES (
+    source.invoice_id, source.invoice_date, source.subtotal, source.tax, source.total, :reviewed_by, :review_timestamp, :notes
+  );
+
+totals_written := SQLROWCOUNT;
+
+UPDATE doc_ai_qs_db.doc_ai_schema.RECONCILE_RESULTS_ITEMS r
+SET review_status = 'Reviewed', reviewed_by = :reviewed_by, reviewed_timestamp = :review_timestamp, notes = :notes
+FROM bulk_accept_invoices b
+WHERE r.invoice_id = b.invoice_id;
+
+UPDATE doc_ai_qs_db.doc_ai_schema.RECONCILE_RESULTS_TOTALS r
+SET review_status = 'Reviewed', reviewed_by = :reviewed_by, reviewed_timestamp = :review_timestamp, notes = :notes
+FROM bulk_accept_invoices b
+WHERE r.invoice_id = b.invoice_id;
+
+COMMIT;
+
+CALL doc_ai_qs_db.doc_ai_schema.SP_REFRESH_RECONCILE_METRICS(:invoice_ids);
+
+  RETURN OBJECT_CONSTRUCT(
+      'message', invoices_accepted || ' invoice(s) accepted with DocAI values: ' || items_written || ' item row(s) and '
+          || totals_written || ' totals row(s) written'
+          || IFF(invoices_skipped > 0, '; ' || invoices_skipped || ' invoice(s) skipped without DocAI items or totals', '') || '.',
+      'accepted', invoices_accepted,
+      'skipped_invoice_ids', skipped_invoice_ids);
+
+EXCEPTION
+  WHEN OTHER THEN
+    ROLLBACK;
+    RAISE;
+END;
+$$;
+
+-- Pre-generates Cortex summaries for every invoice left in 'Pending Review', in one set-based statement.
+-- Summaries are keyed by a hash of the invoice's combined item + totals mismatch details, so only
+-- invoices whose details changed since their last summary are sent to Cortex.
+-- The prompt and hash must stay in sync with docai_invoice_qs_summaries.py (summary_keys; checked by
+-- python docai_invoice_qs_summaries.py --check-hash).
+CREATE OR REPLACE PROCEDURE doc_ai_qs_db.doc_ai_schema.SP_GENERATE_MISMATCH_SUMMARIES()
+RETURNS VARCHAR
+LANGUAGE SQL
+AS
+$$
+DECLARE
+  summaries_generated INTEGER DEFAULT 0;
+  status_message VARCHAR;
+BEGIN
+INSERT INTO doc_ai_qs_db.doc_ai_schema.MISMATCH_SUMMARIES (details_hash, invoice_id, summary, model, created_timestamp)
+WITH pending_details AS (
+    -- Both sides' details whatever their status, as the app reads and hashes them, so its lookup hits
+    SELECT
+        COALESCE(i.invoice_id, t.invoice_id) AS invoice_id,
+        COALESCE(i.item_mismatch_details, '') AS item_details,
+        COALESCE(t.item_mismatch_details, '') AS total_details
+    FROM doc_ai_qs_db.doc_ai_schema.RECONCILE_RESULTS_ITEMS i
+    FULL OUTER JOIN doc_ai_qs_db.doc_ai_schema.RECONCILE_RESULTS_TOTALS t
+      ON i.invoice_id = t.invoice_id
+    WHERE i.review_status = 'Pending Review' OR t.review_status = 'Pending Review'
+),
+uncached AS (
+    SELECT
+        SHA2(invoice_id || '|' || item_details || '|' || total_details, 256) AS details_hash,
+        invoice_id,
+        item_details || total_details AS all_details
+    FROM pending_details
+    WHERE item_details || total_details <> ''
+)
+SELECT
+    u.details_hash,
+    u.invoice_id,
+    SNOWFLAKE.CORTEX.COMPLETE('llama3.1-70b',
+        'Based on the following item mismatch details for invoice ' || u.invoice_id || ', please provide a concise summary of the differences.\n'
+        || 'Focus on the types of mismatches and affected items or amounts, do not use the words expected or actual.\n'
+        || '\nMismatch Details:\n---\n' || u.all_details || '\n---'),
+    'llama3.1-70b',
+    CURRENT_TIMESTAMP()
+FROM uncached u
+WHERE NOT EXISTS (SELECT 1 FROM doc_ai_qs_db.doc_ai_schema.MISMATCH_SUMMARIES s WHERE s.details_hash = u.details_hash);
+
+  summaries_generated := SQLROWCOUNT;
+  status_message := 'Mismatch summaries generated: ' || summaries_generated || '.';
+  RETURN status_message;
+
+EXCEPTION
+  WHEN OTHER THEN
+    status_message := 'Error generating mismatch summaries: ' || SQLERRM;
+    RETURN status_message;
+END;
+$$;
+
+-- Records one stage of a run of the task graph in PIPELINE_RUN_HISTORY.
+CREATE OR REPLACE PROCEDURE doc_ai_qs_db.doc_ai_schema.SP_LOG_PIPELINE_STAGE(
+    RUN_GROUP_ID VARCHAR, STAGE VARCHAR, STARTED_TIMESTAMP TIMESTAMP_NTZ, INVOICE_COUNT NUMBER, STATUS_MESSAGE VARCHAR)
+RETURNS VARCHAR
+LANGUAGE SQL
+AS
+$$
+BEGIN
+INSERT INTO doc_ai_qs_db.doc_ai_schema.PIPELINE_RUN_HISTORY (
+    run_group_id, stage, started_timestamp, completed_timestamp, duration_ms, invoice_count, status_message)
+SELECT :run_group_id, :stage, :started_timestamp, SYSDATE(), DATEDIFF('millisecond', :started_timestamp, SYSDATE()), :invoice_count, :status_message;
+
+  RETURN stage || ': ' || COALESCE(status_message, '');
+END;
+$$;
+
+-- Closes a run of the task graph with its PIPELINE row: processing time from the start of extraction
+-- until both reconciliations committed (when the invoices are in the review queue), and the
+-- upload-to-queue latency of the documents the run extracted. trigger_wait_ms is the part of that
+-- latency spent before extraction started.
+CREATE OR REPLACE PROCEDURE doc_ai_qs_db.doc_ai_schema.SP_RECORD_PIPELINE_LATENCY(RUN_GROUP_ID VARCHAR)
+RETURNS VARCHAR
+LANGUAGE SQL
+AS
+$$
+DECLARE
+  status_message VARCHAR;
+BEGIN
+INSERT INTO doc_ai_qs_db.doc_ai_schema.PIPELINE_RUN_HISTORY (
+    run_group_id, stage, started_timestamp, completed_timestamp, duration_ms, invoice_count,
+    first_upload_timestamp, last_upload_timestamp, upload_to_queue_ms, trigger_wait_ms, status_message)
+WITH stages AS (
+    SELECT
+        MIN(started_timestamp) AS started_timestamp,
+        MAX(IFF(stage IN ('ITEMS', 'TOTALS'), completed_timestamp, NULL)) AS queued_timestamp,
+        MAX(IFF(stage = 'EXTRACT', started_timestamp, NULL)) AS extract_started_timestamp,
+        MAX(IFF(stage = 'EXTRACT', invoice_count, NULL)) AS documents,
+        MAX(IFF(stage = 'CAPTURE', invoice_count, NULL)) AS invoices,
+        MAX(first_upload_timestamp) AS first_upload_timestamp,
+        MAX(last_upload_timestamp) AS last_upload_timestamp
+    FROM doc_ai_qs_db.doc_ai_schema.PIPELINE_RUN_HISTORY
+    WHERE run_group_id = :run_group_id
+)
+SELECT
+    :run_group_id,
+    'PIPELINE',
+    started_timestamp,
+    queued_timestamp,
+    DATEDIFF('millisecond', started_timestamp, queued_timestamp),
+    invoices,
+    first_upload_timestamp,
+    last_upload_timestamp,
+    DATEDIFF('millisecond', first_upload_timestamp, queued_timestamp),
+    DATEDIFF('millisecond', last_upload_timestamp, extract_started_timestamp),
+    COALESCE(documents, 0) || ' documents extracted, ' || COALESCE(invoices, 0) || ' invoices reconciled.'
+FROM stages;
+
+  SELECT 'Pipeline run ' || :run_group_id || ': ' || duration_ms || ' ms processing, '
+      || COALESCE(upload_to_queue_ms::VARCHAR, 'n/a') || ' ms upload-to-queue.'
+  INTO :status_message
+  FROM doc_ai_qs_db.doc_ai_schema.PIPELINE_RUN_HISTORY
+  WHERE run_group_id = :run_group_id AND stage = 'PIPELINE';
+  RETURN status_message;
+
+EXCEPTION
+  WHEN OTHER THEN
+    status_message := 'Error recording pipeline latency: ' || SQLERRM;
+    RETURN status_message;
+END;
+$$;
+
+-- One row per (invoice, product occurrence, field) difference found by the last reconciliation of the invoice,
+-- or per line / totals row found on one side only (field NULL). Values are typed: NUMBER fields in value_a / value_b,
+-- invoice_date in date_a / date_b; delta is B - A (in days for dates). A is TRANSACT_*, B is DOCAI_*.
+CREATE OR REPLACE TABLE doc_ai_qs_db.doc_ai_schema.RECONCILE_DISCREPANCIES (
+    invoice_id VARCHAR,
+    source VARCHAR, -- 'ITEMS' or 'TOTALS'
+    product_name VARCHAR, -- NULL for totals
+    product_occurrence NUMBER, -- occurrence of the product on the invoice; NULL for totals
+    field VARCHAR, -- 'quantity', 'unit_price', 'total_price', 'invoice_date', 'subtotal', 'tax', 'total' or NULL
+    mismatch_type VARCHAR, -- 'Qty_Diff', 'Unit_Price_Diff', ..., 'In Table A Only', 'In Table B Only'
+    value_a NUMBER(12, 2),
+    value_b NUMBER(12, 2),
+    date_a DATE,
+    date_b DATE,
+    delta NUMBER(12, 2),
+    last_reconciled_timestamp TIMESTAMP_NTZ
+) CLUSTER BY (invoice_id);
+
 -- Redefine the target table to capture specific column discrepancies
+-- The results tables are clustered for the review queue and the auto-promotion (status + run timestamp);
+-- their invoice_id UPDATEs use search optimization, added by docai_invoice_qs_layout.sql (Enterprise Edition)
 CREATE OR REPLACE TABLE doc_ai_qs_db.doc_ai_schema.RECONCILE_RESULTS_ITEMS (
     invoice_id VARCHAR,
     item_mismatch_details VARCHAR,
@@ -377,7 +1116,7 @@ CREATE OR REPLACE TABLE doc_ai_qs_db.doc_ai_schema.RECONCILE_RESULTS_ITEMS (
     reviewed_by VARCHAR,
     reviewed_timestamp TIMESTAMP_NTZ,
     notes VARCHAR
-);
+) CLUSTER BY (review_status, last_reconciled_timestamp);
 
 -- Redefine the target table to capture specific column discrepancies
 CREATE OR REPLACE TABLE doc_ai_qs_db.doc_ai_schema.RECONCILE_RESULTS_TOTALS (
@@ -389,7 +1128,7 @@ CREATE OR REPLACE TABLE doc_ai_qs_db.doc_ai_schema.RECONCILE_RESULTS_TOTALS (
     reviewed_timestamp TIMESTAMP_NTZ,
     notes VARCHAR
     
-);
+) CLUSTER BY (review_status, last_reconciled_timestamp);
 
  -- Gold table for corrected transaction items
 CREATE OR REPLACE TABLE doc_ai_qs_db.doc_ai_schema.GOLD_INVOICE_ITEMS (
@@ -402,7 +1141,7 @@ CREATE OR REPLACE TABLE doc_ai_qs_db.doc_ai_schema.GOLD_INVOICE_ITEMS (
     reviewed_timestamp TIMESTAMP_NTZ,
     notes VARCHAR
 
-);
+) CLUSTER BY (invoice_id);
 
 -- Gold table for corrected transaction totals
 CREATE OR REPLACE TABLE doc_ai_qs_db.doc_ai_schema.GOLD_INVOICE_TOTALS (
@@ -415,6 +1154,51 @@ CREATE OR REPLACE TABLE doc_ai_qs_db.doc_ai_schema.GOLD_INVOICE_TOTALS (
     reviewed_timestamp TIMESTAMP_NTZ,
     notes VARCHAR
 
+) CLUSTER BY (invoice_id);
+
+-- Per-invoice reconciliation state and per-day rollup maintained by SP_REFRESH_RECONCILE_METRICS
+CREATE OR REPLACE TABLE doc_ai_qs_db.doc_ai_schema.RECONCILE_METRICS_INVOICES (
+    invoice_id VARCHAR,
+    invoice_date DATE,
+    total DECIMAL(12,2),
+    metric_status VARCHAR, -- 'Auto-reconciled', 'Reviewed' or 'Pending'
+    refreshed_timestamp TIMESTAMP_NTZ
+) CLUSTER BY (invoice_id);
+
+CREATE OR REPLACE TABLE doc_ai_qs_db.doc_ai_schema.RECONCILE_METRICS_DAILY (
+    invoice_date DATE,
+    invoice_count NUMBER,
+    total_amount DECIMAL(18,2),
+    reconciled_invoice_count NUMBER,
+    reconciled_amount DECIMAL(18,2),
+    auto_reconciled_invoice_count NUMBER,
+    auto_reconciled_amount DECIMAL(18,2),
+    pending_invoice_count NUMBER,
+    pending_amount DECIMAL(18,2),
+    refreshed_timestamp TIMESTAMP_NTZ
+);
+
+CREATE OR REPLACE TABLE doc_ai_qs_db.doc_ai_schema.RECONCILE_METRICS_REFRESH_LOG (
+    refreshed_timestamp TIMESTAMP_NTZ,
+    invoices_refreshed NUMBER,
+    full_refresh BOOLEAN
+);
+
+-- Cortex summaries of mismatch details, keyed by SHA2 of invoice_id + item + totals mismatch details
+CREATE OR REPLACE TABLE doc_ai_qs_db.doc_ai_schema.MISMATCH_SUMMARIES (
+    details_hash VARCHAR(64),
+    invoice_id VARCHAR,
+    summary VARCHAR,
+    model VARCHAR,
+    created_timestamp TIMESTAMP_TZ
+);
+
+-- Invoices captured from the bronze streams that still need to be reconciled
+CREATE OR REPLACE TABLE doc_ai_qs_db.doc_ai_schema.RECONCILE_PENDING_INVOICES (
+    invoice_id VARCHAR,
+    captured_timestamp TIMESTAMP_NTZ,
+    items_reconciled BOOLEAN,
+    totals_reconciled BOOLEAN
 );
 
 -- CREATE A STREAM TO MONITOR THE Bronze db table for new items to pass to our reconciliation task
@@ -424,17 +1208,100 @@ ON TABLE doc_ai_qs_db.doc_ai_schema.TRANSACT_TOTALS;
 CREATE OR REPLACE STREAM doc_ai_qs_db.doc_ai_schema.BRONZE_DOCAI_STREAM 
 ON TABLE doc_ai_qs_db.doc_ai_schema.DOCAI_INVOICE_TOTALS;
 
--- CREATE A TASK TO RUN WHEN THE STREAM DETECTS NEW INFO IN OUR MAIN DB TABLE OR DOCAI TABLE
-create or replace task doc_ai_qs_db.doc_ai_schema.RECONCILE
+-- Item-level streams so invoices whose line items change (but not totals) are reconciled too
+CREATE OR REPLACE STREAM doc_ai_qs_db.doc_ai_schema.BRONZE_DB_ITEMS_STREAM 
+ON TABLE doc_ai_qs_db.doc_ai_schema.TRANSACT_ITEMS;
+
+CREATE OR REPLACE STREAM doc_ai_qs_db.doc_ai_schema.BRONZE_DOCAI_ITEMS_STREAM 
+ON TABLE doc_ai_qs_db.doc_ai_schema.DOCAI_INVOICE_ITEMS;
+
+-- TASK GRAPH: DOCAI_EXTRACT -> RECONCILE_CAPTURE -> (RECONCILE_ITEMS || RECONCILE_TOTALS) -> RECONCILE_FINALIZE
+-- Reconciliation runs as successors of extraction instead of polling on its own schedule, and the item and
+-- totals reconciliations run in parallel. Every stage logs its duration to PIPELINE_RUN_HISTORY.
+-- The root is a triggered task: it also starts on changes to the bronze tables (e.g. ERP rows in TRANSACT_*),
+-- in which case extraction finds nothing to do and the graph only reconciles.
+-- For a one-off full rebuild run: CALL SP_RUN_ITEM_RECONCILIATION(TRUE); CALL SP_RUN_TOTALS_RECONCILIATION(TRUE);
+DROP TASK IF EXISTS doc_ai_qs_db.doc_ai_schema.RECONCILE; -- Replaced by the task graph below
+
+-- Tasks can only be added to a graph while its root is suspended
+ALTER TASK doc_ai_qs_db.doc_ai_schema.DOCAI_EXTRACT SUSPEND;
+
+ALTER TASK doc_ai_qs_db.doc_ai_schema.DOCAI_EXTRACT MODIFY WHEN
+	SYSTEM$STREAM_HAS_DATA('INVOICE_STREAM')
+	  OR SYSTEM$STREAM_HAS_DATA('BRONZE_DB_STREAM') OR SYSTEM$STREAM_HAS_DATA('BRONZE_DOCAI_STREAM')
+	  OR SYSTEM$STREAM_HAS_DATA('BRONZE_DB_ITEMS_STREAM') OR SYSTEM$STREAM_HAS_DATA('BRONZE_DOCAI_ITEMS_STREAM');
+
+-- Reads all four bronze streams after extraction has written DOCAI_*, so this run's documents are captured
+create or replace task doc_ai_qs_db.doc_ai_schema.RECONCILE_CAPTURE
+	warehouse=doc_ai_qs_wh
+	after doc_ai_qs_db.doc_ai_schema.DOCAI_EXTRACT
+	as DECLARE
+        started_timestamp TIMESTAMP_NTZ DEFAULT SYSDATE();
+        run_group_id VARCHAR DEFAULT SYSTEM$TASK_RUNTIME_INFO('CURRENT_TASK_GRAPH_RUN_GROUP_ID');
+        status_message VARCHAR;
+        invoice_count NUMBER;
+    BEGIN
+        CALL doc_ai_qs_db.doc_ai_schema.SP_CAPTURE_CHANGED_INVOICES();
+        SELECT $1 INTO :status_message FROM TABLE(RESULT_SCAN(LAST_QUERY_ID()));
+        SELECT COUNT(*) INTO :invoice_count FROM doc_ai_qs_db.doc_ai_schema.RECONCILE_PENDING_INVOICES;
+        CALL doc_ai_qs_db.doc_ai_schema.SP_LOG_PIPELINE_STAGE(:run_group_id, 'CAPTURE', :started_timestamp, :invoice_count, :status_message);
+    END;
+
+create or replace task doc_ai_qs_db.doc_ai_schema.RECONCILE_ITEMS
+	warehouse=doc_ai_qs_wh
+	after doc_ai_qs_db.doc_ai_schema.RECONCILE_CAPTURE
+	as DECLARE
+        started_timestamp TIMESTAMP_NTZ DEFAULT SYSDATE();
+        reconciled_after TIMESTAMP_NTZ DEFAULT CURRENT_TIMESTAMP(); -- same clock as last_reconciled_timestamp
+        run_group_id VARCHAR DEFAULT SYSTEM$TASK_RUNTIME_INFO('CURRENT_TASK_GRAPH_RUN_GROUP_ID');
+        status_message VARCHAR;
+        invoice_count NUMBER;
+    BEGIN
+        CALL doc_ai_qs_db.doc_ai_schema.SP_RUN_ITEM_RECONCILIATION();
+        SELECT $1 INTO :status_message FROM TABLE(RESULT_SCAN(LAST_QUERY_ID()));
+        SELECT COUNT(*) INTO :invoice_count FROM doc_ai_qs_db.doc_ai_schema.RECONCILE_RESULTS_ITEMS
+        WHERE last_reconciled_timestamp >= :reconciled_after;
+        CALL doc_ai_qs_db.doc_ai_schema.SP_LOG_PIPELINE_STAGE(:run_group_id, 'ITEMS', :started_timestamp, :invoice_count, :status_message);
+    END;
+
+create or replace task doc_ai_qs_db.doc_ai_schema.RECONCILE_TOTALS
+	warehouse=doc_ai_qs_wh
+	after doc_ai_qs_db.doc_ai_schema.RECONCILE_CAPTURE
+	as DECLARE
+        started_timestamp TIMESTAMP_NTZ DEFAULT SYSDATE();
+        reconciled_after TIMESTAMP_NTZ DEFAULT CURRENT_TIMESTAMP();
+        run_group_id VARCHAR DEFAULT SYSTEM$TASK_RUNTIME_INFO('CURRENT_TASK_GRAPH_RUN_GROUP_ID');
+        status_message VARCHAR;
+        invoice_count NUMBER;
+    BEGIN
+        CALL doc_ai_qs_db.doc_ai_schema.SP_RUN_TOTALS_RECONCILIATION();
+        SELECT $1 INTO :status_message FROM TABLE(RESULT_SCAN(LAST_QUERY_ID()));
+        SELECT COUNT(*) INTO :invoice_count FROM doc_ai_qs_db.doc_ai_schema.RECONCILE_RESULTS_TOTALS
+        WHERE last_reconciled_timestamp >= :reconciled_after;
+        CALL doc_ai_qs_db.doc_ai_schema.SP_LOG_PIPELINE_STAGE(:run_group_id, 'TOTALS', :started_timestamp, :invoice_count, :status_message);
+    END;
+
+-- Runs once both reconciliations have finished: summaries, the metrics rollup and the run's latency
+create or replace task doc_ai_qs_db.doc_ai_schema.RECONCILE_FINALIZE
 	warehouse=doc_ai_qs_wh
-	schedule='3 MINUTE'
-	when SYSTEM$STREAM_HAS_DATA('BRONZE_DB_STREAM') OR SYSTEM$STREAM_HAS_DATA('BRONZE_DOCAI_STREAM')
-	as BEGIN
-        CALL SP_RUN_ITEM_RECONCILIATION();
-        CALL SP_RUN_TOTALS_RECONCILIATION();
+	after doc_ai_qs_db.doc_ai_schema.RECONCILE_ITEMS, doc_ai_qs_db.doc_ai_schema.RECONCILE_TOTALS
+	as DECLARE
+        started_timestamp TIMESTAMP_NTZ DEFAULT SYSDATE();
+        run_group_id VARCHAR DEFAULT SYSTEM$TASK_RUNTIME_INFO('CURRENT_TASK_GRAPH_RUN_GROUP_ID');
+        summaries_message VARCHAR;
+        metrics_message VARCHAR;
+    BEGIN
+        CALL doc_ai_qs_db.doc_ai_schema.SP_GENERATE_MISMATCH_SUMMARIES();
+        SELECT $1 INTO :summaries_message FROM TABLE(RESULT_SCAN(LAST_QUERY_ID()));
+        CALL doc_ai_qs_db.doc_ai_schema.SP_REFRESH_RECONCILE_METRICS();
+        SELECT $1 INTO :metrics_message FROM TABLE(RESULT_SCAN(LAST_QUERY_ID()));
+        CALL doc_ai_qs_db.doc_ai_schema.SP_LOG_PIPELINE_STAGE(:run_group_id, 'FINALIZE', :started_timestamp, NULL,
+            :summaries_message || ' ' || :metrics_message);
+        CALL doc_ai_qs_db.doc_ai_schema.SP_RECORD_PIPELINE_LATENCY(:run_group_id);
     END;
 
-ALTER TASK doc_ai_qs_db.doc_ai_schema.RECONCILE RESUME;
+-- Resumes the root and every task after it
+SELECT SYSTEM$TASK_DEPENDENTS_ENABLE('doc_ai_qs_db.doc_ai_schema.DOCAI_EXTRACT');
     
 
 
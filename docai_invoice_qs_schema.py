@@ -0,0 +1,126 @@
+"""
+Typed schemas of the bronze and gold invoice tables, and Arrow transfer of their rows.
+
+TABLE_SCHEMAS mirrors the CREATE TABLE statements of TRANSACT_*, DOCAI_INVOICE_* and
+GOLD_INVOICE_* (docai_invoice_qs_setup.sql / docai_invoice_qs_reconcile.sql): NUMBER(p, s)
+columns are decimal128(p, s), DATE is date32 and TIMESTAMP_TZ / TIMESTAMP_NTZ are
+microsecond timestamps with / without a UTC zone.
+
+Reads fetch a query's result as one Arrow table (DataFrame.to_arrow()), cast it to the
+table's schema in Arrow and convert it to pandas once: decimals become float64 for the
+editors and charts, dates python dates, strings Arrow-backed. Writes build Arrow tables
+in the same schema and upload them with Session.write_arrow.
+"""
+from decimal import Decimal
+
+import pyarrow as pa
+import pyarrow.compute as pc
+
+TIMESTAMP_NTZ = pa.timestamp("us")
+TIMESTAMP_TZ = pa.timestamp("us", tz="UTC")
+
+
+def _number(precision, scale=0):
+    return pa.decimal128(precision, scale)
+
+
+def _schema(*fields):
+    return pa.schema([pa.field(name.upper(), kind) for name, kind in fields])
+
+
+_DOCUMENT_FIELDS = [("file_name", pa.string()), ("file_size", _number(12, 2)), ("last_modified", TIMESTAMP_TZ),
+                    ("snowflake_file_url", pa.string())]
+_REVIEW_FIELDS = [("reviewed_by", pa.string()), ("reviewed_timestamp", TIMESTAMP_NTZ), ("notes", pa.string())]
+
+TABLE_SCHEMAS = {
+    "TRANSACT_ITEMS": _schema(
+        ("invoice_id", pa.string()), ("product_name", pa.string()),
+        ("quantity", _number(10, 2)), ("unit_price", _number(10, 2)), ("total_price", _number(12, 2)),
+    ),
+    "TRANSACT_TOTALS": _schema(
+        ("invoice_id", pa.string()), ("invoice_date", pa.date32()),
+        ("subtotal", _number(10, 2)), ("tax", _number(10, 2)), ("total", _number(12, 2)),
+    ),
+    "DOCAI_INVOICE_ITEMS": _schema(
+        ("invoice_id", pa.string()), ("product_name", pa.string()),
+        ("quantity", _number(12, 2)), ("unit_price", _number(12, 2)), ("total_price", _number(12, 2)),
+        *_DOCUMENT_FIELDS,
+    ),
+    "DOCAI_INVOICE_TOTALS": _schema(
+        ("invoice_id", pa.string()), ("invoice_date", pa.date32()),
+        ("subtotal", _number(12, 2)), ("tax", _number(12, 2)), ("total", _number(12, 2)),
+        *_DOCUMENT_FIELDS,
+    ),
+    "GOLD_INVOICE_ITEMS": _schema(
+        ("invoice_id", pa.string()), ("product_name", pa.string()),
+        ("quantity", _number(38)), ("unit_price", _number(10, 2)), ("total_price", _number(10, 2)),
+        *_REVIEW_FIELDS,
+    ),
+    "GOLD_INVOICE_TOTALS": _schema(
+        ("invoice_id", pa.string()), ("invoice_date", pa.date32()),
+        ("subtotal", _number(10, 2)), ("tax", _number(10, 2)), ("total", _number(10, 2)),
+        *_REVIEW_FIELDS,
+    ),
+}
+
+
+def table_schema(table_name):
+    """Schema of a (possibly fully qualified) table name."""
+    return TABLE_SCHEMAS[table_name.rsplit(".", 1)[-1].upper()]
+
+
+def _cast(column, kind):
+    if column.type == kind:
+        return column
+    if pa.types.is_timestamp(kind) and kind.tz and (pa.types.is_string(column.type) or pa.types.is_large_string(column.type)):
+        try:
+            # Text without an offset is UTC: parse it naive, then the cast only attaches the zone
+            return pc.cast(pc.cast(column, pa.timestamp(kind.unit)), kind)
+        except pa.ArrowInvalid: # text with offsets
+            return pc.cast(column, kind)
+    # Unsafe so floats and integers round to the column's scale instead of raising
+    return pc.cast(column, kind, safe=not (pa.types.is_decimal(kind) or pa.types.is_integer(kind)))
+
+
+def conform(table, schema):
+    """
+    `table` with the columns of `schema`, in its order and cast to its types. Column names
+    match case-insensitively; columns missing from `table` are null, extra ones are dropped.
+    """
+    table = table if table is not None else pa.table({})
+    columns = {name.upper(): table.column(index) for index, name in enumerate(table.column_names)}
+    arrays = [_cast(columns[field.name], field.type) if field.name in columns else pa.nulls(table.num_rows, field.type)
+              for field in schema]
+    return pa.Table.from_arrays(arrays, schema=schema)
+
+
+def _decimal_to_float(column, scale):
+    # Unscaled integer / 10**scale is one correctly rounded division, so 13.62 stays float("13.62");
+    # a direct decimal -> double cast can be off by an ulp
+    if scale == 0:
+        return pc.cast(column, pa.float64())
+    unscaled = pc.cast(pc.multiply(column, pa.scalar(Decimal(10) ** scale)), pa.int64())
+    return pc.divide(pc.cast(unscaled, pa.float64()), float(10 ** scale))
+
+
+def to_pandas(table, date_as_object=True):
+    """
+    pandas frame of an Arrow table: decimals as float64 (zero-copy from the cast when there
+    are no nulls), dates as python dates unless `date_as_object` is false. Frees `table`'s
+    buffers as columns are converted, so it must not be used afterwards.
+    """
+    for index, field in enumerate(table.schema):
+        if pa.types.is_decimal(field.type):
+            table = table.set_column(index, field.name, _decimal_to_float(table.column(index), field.type.scale))
+    return table.to_pandas(date_as_object=date_as_object, split_blocks=True, self_destruct=True)
+
+
+def fetch_typed(session, query, params, table_name):
+    """Runs QueryTemplate `query` and returns its rows as a pandas frame typed by `table_name`'s schema."""
+    return to_pandas(conform(query.to_arrow(session, params), table_schema(table_name)))
+
+
+def from_rows(rows, table_name):
+    """Arrow table of `table_name` from row dicts (lower- or upper-case keys; Decimal, date and datetime values)."""
+    schema = table_schema(table_name)
+    return pa.Table.from_pylist([{key.upper(): value for key, value in row.items()} for row in rows], schema=schema)
@@ -39,6 +39,7 @@ USE SCHEMA doc_ai_qs_db.doc_ai_schema;
 CREATE OR REPLACE STREAM doc_ai_qs_db.doc_ai_schema.INVOICE_STREAM 
 ON DIRECTORY(@DOC_AI_STAGE);
 
+-- Bronze, gold and reconcile tables are clustered on invoice_id: nearly every access is a point lookup or delete of one invoice
 CREATE OR REPLACE TABLE doc_ai_qs_db.doc_ai_schema.DOCAI_INVOICE_ITEMS (
     invoice_id VARCHAR(255),
     product_name VARCHAR(255),
@@ -49,7 +50,7 @@ CREATE OR REPLACE TABLE doc_ai_qs_db.doc_ai_schema.DOCAI_INVOICE_ITEMS (
     file_size NUMBER(12, 2),
     last_modified TIMESTAMP_TZ,
     snowflake_file_url VARCHAR(255)
-);
+) CLUSTER BY (invoice_id);
 
  CREATE OR REPLACE TABLE doc_ai_qs_db.doc_ai_schema.DOCAI_INVOICE_TOTALS (
     invoice_id VARCHAR(255),
@@ -61,47 +62,114 @@ CREATE OR REPLACE TABLE doc_ai_qs_db.doc_ai_schema.DOCAI_INVOICE_ITEMS (
     file_size NUMBER(12, 2),
     last_modified TIMESTAMP_TZ,
     snowflake_file_url VARCHAR(255)
+) CLUSTER BY (invoice_id);
+
+-- CONTENT HASHES (MD5) OF DOCUMENTS THAT HAVE ALREADY BEEN THROUGH PREDICT
+-- duplicate_count counts re-uploads of identical content, i.e. PREDICT calls avoided
+CREATE OR REPLACE TABLE doc_ai_qs_db.doc_ai_schema.DOCAI_DOCUMENT_HASHES (
+    content_hash VARCHAR(32),
+    file_name VARCHAR(255),
+    file_size NUMBER(12, 2),
+    extracted_timestamp TIMESTAMP_TZ,
+    duplicate_count NUMBER DEFAULT 0
+);
+
+-- ONE ROW PER STAGE OF EACH RUN OF THE DOCAI_EXTRACT -> RECONCILE_* TASK GRAPH (docai_invoice_qs_reconcile.sql)
+-- Timestamps are UTC. The EXTRACT row records the upload times of the documents it extracted;
+-- the PIPELINE row closes the run with its upload-to-queue latency.
+CREATE OR REPLACE TABLE doc_ai_qs_db.doc_ai_schema.PIPELINE_RUN_HISTORY (
+    run_group_id VARCHAR,
+    stage VARCHAR, -- 'EXTRACT', 'CAPTURE', 'ITEMS', 'TOTALS', 'FINALIZE' or 'PIPELINE'
+    started_timestamp TIMESTAMP_NTZ,
+    completed_timestamp TIMESTAMP_NTZ,
+    duration_ms NUMBER,
+    invoice_count NUMBER,
+    first_upload_timestamp TIMESTAMP_NTZ,
+    last_upload_timestamp TIMESTAMP_NTZ,
+    upload_to_queue_ms NUMBER, -- PIPELINE: oldest extracted upload until both reconciliations committed
+    trigger_wait_ms NUMBER, -- PIPELINE: newest extracted upload until extraction started
+    status_message VARCHAR
 );
 
 -- CREATE A TASK TO RUN WHEN THE STREAM DETECTS NEW FILE UPLOADS IN OUR STAGE
+-- Triggered task (no schedule): it starts as soon as the stream has data instead of polling.
+-- It is the root of the task graph; docai_invoice_qs_reconcile.sql adds the reconciliation tasks after it.
 create or replace task doc_ai_qs_db.doc_ai_schema.DOCAI_EXTRACT
 	warehouse=doc_ai_qs_wh
-	schedule='1 MINUTE'
 	when SYSTEM$STREAM_HAS_DATA('INVOICE_STREAM')
-	as BEGIN
-        CREATE OR REPLACE TEMPORARY TABLE doc_ai_qs_db.doc_ai_schema.docai_parsed AS (
+	as DECLARE
+        started_timestamp TIMESTAMP_NTZ DEFAULT SYSDATE();
+        run_group_id VARCHAR DEFAULT SYSTEM$TASK_RUNTIME_INFO('CURRENT_TASK_GRAPH_RUN_GROUP_ID');
+    BEGIN
+        -- Read the stream once; the offset advances when this statement commits
+        CREATE OR REPLACE TEMPORARY TABLE doc_ai_qs_db.doc_ai_schema.invoice_stream_rows AS (
         SELECT
             Relative_path as file_name,
             size as file_size,
             last_modified,
             file_url as snowflake_file_url,
-            PARSE_JSON(DOC_AI_QS_DB.DOC_AI_SCHEMA.DOC_AI_QS_INVOICES!PREDICT(get_presigned_url('@doc_ai_stage', RELATIVE_PATH ), 1)) AS json_data
+            md5 as content_hash
         FROM doc_ai_qs_db.doc_ai_schema.INVOICE_STREAM
         WHERE METADATA$ACTION = 'INSERT' OR METADATA$ACTION = 'UPDATE'
         );
 
+        -- Byte-identical documents were already extracted: count them and skip PREDICT
+        UPDATE doc_ai_qs_db.doc_ai_schema.DOCAI_DOCUMENT_HASHES h
+        SET duplicate_count = h.duplicate_count + d.uploads
+        FROM (
+            SELECT content_hash, COUNT(*) AS uploads
+            FROM doc_ai_qs_db.doc_ai_schema.invoice_stream_rows
+            GROUP BY content_hash
+        ) d
+        WHERE h.content_hash = d.content_hash;
+
+        CREATE OR REPLACE TEMPORARY TABLE doc_ai_qs_db.doc_ai_schema.docai_parsed AS (
+        SELECT
+            file_name,
+            file_size,
+            last_modified,
+            snowflake_file_url,
+            content_hash,
+            PARSE_JSON(DOC_AI_QS_DB.DOC_AI_SCHEMA.DOC_AI_QS_INVOICES!PREDICT(get_presigned_url('@doc_ai_stage', file_name), 1)) AS json_data
+        FROM doc_ai_qs_db.doc_ai_schema.invoice_stream_rows s
+        WHERE content_hash IS NULL
+           OR NOT EXISTS (SELECT 1 FROM doc_ai_qs_db.doc_ai_schema.DOCAI_DOCUMENT_HASHES h WHERE h.content_hash = s.content_hash)
+        -- Identical files in the same batch are extracted once
+        QUALIFY content_hash IS NULL
+             OR ROW_NUMBER() OVER (PARTITION BY content_hash ORDER BY last_modified DESC, file_name) = 1
+        );
+
+        -- Index the newly extracted documents; extra copies in this batch count as duplicates
+        INSERT INTO doc_ai_qs_db.doc_ai_schema.DOCAI_DOCUMENT_HASHES (content_hash, file_name, file_size, extracted_timestamp, duplicate_count)
+        SELECT p.content_hash, p.file_name, p.file_size, CURRENT_TIMESTAMP(),
+            (SELECT COUNT(*) - 1 FROM doc_ai_qs_db.doc_ai_schema.invoice_stream_rows s WHERE s.content_hash = p.content_hash)
+        FROM doc_ai_qs_db.doc_ai_schema.docai_parsed p
+        WHERE p.content_hash IS NOT NULL;
+
+        -- Walk the order_info arrays once, aligned by position. The index range covers the
+        -- longest array so a missing cell becomes NULL instead of dropping the whole line.
+        -- A line without a product name is labelled by its position, so its mismatches still show in the details.
+        -- (Reference implementation: docai_invoice_qs_extract.py)
         CREATE OR REPLACE TEMPORARY TABLE extracted_item_data AS (
         SELECT
             -- Remove '$' and ',' characters, then attempt to cast to NUMBER for appropriate values
             REPLACE(p.json_data:"total_info|Invoice ID"[0].value::STRING, '#', '') AS invoice_id,
-            ni.value:"value"::STRING AS product_name,
-            TRY_CAST(qi.value:"value"::STRING AS NUMBER(12, 2)) AS quantity,
-            TRY_CAST(REPLACE(REPLACE(pri.value:"value"::STRING, '$', ''), ',', '') AS NUMBER(12, 2)) AS unit_price,
-            TRY_CAST(REPLACE(REPLACE(ti.value:"value"::STRING, '$', ''), ',', '') AS NUMBER(12, 2)) AS total_price,
+            COALESCE(GET(p.json_data:"order_info|Item", li.index):"value"::STRING, '(unnamed line ' || (li.index + 1) || ')') AS product_name,
+            TRY_CAST(GET(p.json_data:"order_info|Quantity", li.index):"value"::STRING AS NUMBER(12, 2)) AS quantity,
+            TRY_CAST(REPLACE(REPLACE(GET(p.json_data:"order_info|Price", li.index):"value"::STRING, '$', ''), ',', '') AS NUMBER(12, 2)) AS unit_price,
+            TRY_CAST(REPLACE(REPLACE(GET(p.json_data:"order_info|Total", li.index):"value"::STRING, '$', ''), ',', '') AS NUMBER(12, 2)) AS total_price,
             file_name,
             file_size,
             last_modified,
             snowflake_file_url
         FROM
             doc_ai_qs_db.doc_ai_schema.docai_parsed p,
-            LATERAL FLATTEN(input => p.json_data:"order_info|Item") ni,
-            LATERAL FLATTEN(input => p.json_data:"order_info|Quantity") qi,
-            LATERAL FLATTEN(input => p.json_data:"order_info|Price") pri,
-            LATERAL FLATTEN(input => p.json_data:"order_info|Total") ti
-        WHERE
-            ni.index = pri.index AND
-            ni.index = qi.index AND
-            ni.index = ti.index
+            LATERAL FLATTEN(input => ARRAY_GENERATE_RANGE(0, GREATEST(
+                COALESCE(ARRAY_SIZE(p.json_data:"order_info|Item"), 0),
+                COALESCE(ARRAY_SIZE(p.json_data:"order_info|Quantity"), 0),
+                COALESCE(ARRAY_SIZE(p.json_data:"order_info|Price"), 0),
+                COALESCE(ARRAY_SIZE(p.json_data:"order_info|Total"), 0)
+            ))) li
         );
         
         DELETE FROM doc_ai_qs_db.doc_ai_schema.DOCAI_INVOICE_ITEMS
@@ -152,6 +220,21 @@ create or replace task doc_ai_qs_db.doc_ai_schema.DOCAI_EXTRACT
           last_modified,
           snowflake_file_url
         FROM extracted_total_data;
+
+        INSERT INTO doc_ai_qs_db.doc_ai_schema.PIPELINE_RUN_HISTORY (
+          run_group_id, stage, started_timestamp, completed_timestamp, duration_ms, invoice_count,
+          first_upload_timestamp, last_upload_timestamp, status_message)
+        SELECT
+          :run_group_id,
+          'EXTRACT',
+          :started_timestamp,
+          SYSDATE(),
+          DATEDIFF('millisecond', :started_timestamp, SYSDATE()),
+          COUNT(*),
+          MIN(CONVERT_TIMEZONE('UTC', last_modified)::TIMESTAMP_NTZ),
+          MAX(CONVERT_TIMEZONE('UTC', last_modified)::TIMESTAMP_NTZ),
+          'Extracted ' || COUNT(*) || ' documents.'
+        FROM doc_ai_qs_db.doc_ai_schema.docai_parsed;
     END;
 
 ALTER TASK doc_ai_qs_db.doc_ai_schema.DOCAI_EXTRACT RESUME;
@@ -162,7 +245,7 @@ CREATE OR REPLACE TABLE doc_ai_qs_db.doc_ai_schema.TRANSACT_ITEMS (
     quantity NUMBER(10, 2),
     unit_price NUMBER(10, 2),
     total_price NUMBER(12, 2)
-);
+) CLUSTER BY (invoice_id);
 
 
  CREATE OR REPLACE TABLE doc_ai_qs_db.doc_ai_schema.TRANSACT_TOTALS (
@@ -171,4 +254,4 @@ CREATE OR REPLACE TABLE doc_ai_qs_db.doc_ai_schema.TRANSACT_ITEMS (
     subtotal NUMBER(10, 2),
     tax NUMBER(10, 2),
     total NUMBER(12, 2)
-);
+) CLUSTER BY (invoice_id);
@@ -0,0 +1,146 @@
+"""
+Persistent cache of Cortex mismatch summaries.
+
+Summaries live in MISMATCH_SUMMARIES keyed by a SHA-256 of the invoice id and its item
+and total mismatch details, so changed details never reuse a stale summary.
+SP_GENERATE_MISMATCH_SUMMARIES (docai_invoice_qs_reconcile.sql) fills the table in one
+set-based batch after each reconciliation run; the app only generates on a miss.
+
+Both key the details as fetch_mismatch_details returns them (both sides, whatever their
+review status). Check that the procedure's SQL key and details_hash agree with:
+    python docai_invoice_qs_summaries.py --check-hash
+"""
+import hashlib
+import sys
+import threading
+
+from docai_invoice_qs_queue import fetch_mismatch_details
+from docai_invoice_qs_templates import template
+
+CORTEX_MODEL = "llama3.1-70b"
+
+# Must stay in sync with the prompt built in SP_GENERATE_MISMATCH_SUMMARIES
+PROMPT_TEMPLATE = (
+    "Based on the following item mismatch details for invoice {invoice_id}, please provide a concise summary of the differences.\n"
+    "Focus on the types of mismatches and affected items or amounts, do not use the words expected or actual.\n"
+    "\n"
+    "Mismatch Details:\n"
+    "---\n"
+    "{details}\n"
+    "---"
+)
+
+
+@template("summary_lookup")
+def _summary_lookup_sql(summaries_table):
+    return f"SELECT summary FROM {summaries_table} WHERE details_hash = ?"
+
+
+# Model and prompt are both bound: the prompt embeds extracted document text
+@template("summary_complete")
+def _summary_complete_sql():
+    return "SELECT SNOWFLAKE.CORTEX.COMPLETE(?, ?) AS summary"
+
+
+@template("summary_store")
+def _summary_store_sql(summaries_table):
+    return f"""
+        MERGE INTO {summaries_table} t
+        USING (SELECT ? AS details_hash, ? AS invoice_id, ? AS summary, ? AS model) s
+        ON t.details_hash = s.details_hash
+        WHEN NOT MATCHED THEN INSERT (details_hash, invoice_id, summary, model, created_timestamp)
+        VALUES (s.details_hash, s.invoice_id, s.summary, s.model, CURRENT_TIMESTAMP())
+    """
+
+
+# The invoices SP_GENERATE_MISMATCH_SUMMARIES summarizes and their keys: same expression as its
+# pending_details / uncached CTEs
+@template("summary_keys")
+def _summary_keys_sql(items_table, totals_table):
+    return f"""
+        SELECT COALESCE(i.invoice_id, t.invoice_id) AS invoice_id,
+               SHA2(COALESCE(i.invoice_id, t.invoice_id) || '|' || COALESCE(i.item_mismatch_details, '') || '|'
+                    || COALESCE(t.item_mismatch_details, ''), 256) AS details_hash
+        FROM {items_table} i
+        FULL OUTER JOIN {totals_table} t ON i.invoice_id = t.invoice_id
+        WHERE i.review_status = 'Pending Review' OR t.review_status = 'Pending Review'
+    """
+
+
+def details_hash(invoice_id, item_mismatch_details, total_mismatch_details):
+    """Same value as SHA2(invoice_id || '|' || COALESCE(items, '') || '|' || COALESCE(totals, ''), 256)."""
+    key = f"{invoice_id}|{item_mismatch_details or ''}|{total_mismatch_details or ''}"
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+def build_prompt(invoice_id, item_mismatch_details, total_mismatch_details):
+    return PROMPT_TEMPLATE.format(invoice_id=invoice_id, details=(item_mismatch_details or "") + (total_mismatch_details or ""))
+
+
+class SummaryCacheStats:
+    """Process-wide hit/miss counters for the summary cache."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def record(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+def get_summary(session, summaries_table, invoice_id, item_mismatch_details, total_mismatch_details, stats=None):
+    """Returns the cached summary for these details, generating and storing it on a miss."""
+    digest = details_hash(invoice_id, item_mismatch_details, total_mismatch_details)
+    rows = _summary_lookup_sql(summaries_table).collect(session, [digest])
+    if rows:
+        if stats:
+            stats.record(hit=True)
+        return rows[0]["SUMMARY"]
+
+    if stats:
+        stats.record(hit=False)
+    prompt = build_prompt(invoice_id, item_mismatch_details, total_mismatch_details)
+    rows = _summary_complete_sql().collect(session, [CORTEX_MODEL, prompt])
+    summary = rows[0]["SUMMARY"] if rows else None
+    if summary:
+        _summary_store_sql(summaries_table).collect(session, [digest, invoice_id, summary, CORTEX_MODEL])
+    return summary
+
+
+def check_hash_parity(session, items_table, totals_table):
+    """Pending invoices whose batch key differs from the app's details_hash of the details it reads."""
+    keys = {row["INVOICE_ID"]: row["DETAILS_HASH"] for row in _summary_keys_sql(items_table, totals_table).collect(session)}
+    details = fetch_mismatch_details(session, items_table, totals_table, keys)
+    return [f"{invoice_id}: batch {digest}, app {details_hash(invoice_id, *details.get(invoice_id, ('', '')))}"
+            for invoice_id, digest in sorted(keys.items())
+            if details_hash(invoice_id, *details.get(invoice_id, ("", ""))) != digest]
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["--check-hash"]:
+        print(__doc__.strip(), file=sys.stderr)
+        sys.exit(2)
+    from docai_invoice_qs_local import open_local_session
+
+    local = open_local_session()
+    items_table, totals_table = "doc_ai_qs_db.doc_ai_schema.RECONCILE_RESULTS_ITEMS", "doc_ai_qs_db.doc_ai_schema.RECONCILE_RESULTS_TOTALS"
+    # Seed invoices are pending on one side only; also cover a reviewed side that keeps its details
+    local.sql(f"UPDATE {items_table} SET review_status = 'Reviewed' WHERE item_mismatch_details <> '' "
+              f"AND invoice_id = (SELECT MIN(invoice_id) FROM {items_table} WHERE item_mismatch_details <> '')").collect()
+    local.sql(f"UPDATE {totals_table} SET review_status = 'Pending Review', item_mismatch_details = invoice_id || ': tax_Diff(1.00 vs 2.00);' "
+              f"WHERE invoice_id = (SELECT MIN(invoice_id) FROM {items_table} WHERE review_status = 'Reviewed')").collect()
+    failures = check_hash_parity(local, items_table, totals_table)
+    for failure in failures:
+        print(failure)
+    print("hash parity: " + ("FAILED" if failures else "OK"))
+    sys.exit(1 if failures else 0)
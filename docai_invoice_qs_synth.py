@@ -0,0 +1,268 @@
+"""
+Synthetic invoice data at configurable scale.
+
+Generates TRANSACT_ITEMS / TRANSACT_TOTALS and the matching DOCAI_INVOICE_ITEMS /
+DOCAI_INVOICE_TOTALS rows, with a controlled share of invoices carrying a planted line
+item or totals discrepancy, repeated product lines and invoices present on one side
+only. Optionally writes image-only invoice PDFs of the DocAI side for extraction tests.
+
+Large datasets are generated in chunks of whole invoices, so 10M line items never have
+to be in memory at once.
+
+Usage:
+    python docai_invoice_qs_synth.py --items 100000 --out synthetic/ [--pdfs 20] [--seed 0]
+"""
+import argparse
+import os
+import sys
+from dataclasses import dataclass, field
+
+import numpy as np
+import pandas as pd
+
+PRODUCTS = [
+    "Apples (kg)", "Bananas (kg)", "Bread (loaf)", "Butter (pack)", "Cheese (block)",
+    "Chicken (kg)", "Eggs (dozen)", "Milk (ltr)", "Onions (kg)", "Rice (kg)",
+    "Tomatoes (kg)", "Yogurt (cup)",
+]
+
+ITEM_COLUMNS = ["INVOICE_ID", "PRODUCT_NAME", "QUANTITY", "UNIT_PRICE", "TOTAL_PRICE"]
+TOTAL_COLUMNS = ["INVOICE_ID", "INVOICE_DATE", "SUBTOTAL", "TAX", "TOTAL"]
+DOCAI_FILE_COLUMNS = ["FILE_NAME", "FILE_SIZE", "LAST_MODIFIED"]
+
+DEFAULT_CHUNK_ITEMS = 1_000_000
+FIRST_INVOICE_ID = 100000
+TAX_RATE = 0.1
+# Step through PRODUCTS coprime to its length, so lines of one invoice get distinct products
+_PRODUCT_STEP = 5
+
+
+@dataclass
+class SyntheticDataset:
+    transact_items: pd.DataFrame
+    transact_totals: pd.DataFrame
+    docai_items: pd.DataFrame
+    docai_totals: pd.DataFrame
+    # Planted invoice ids, for checking reconciliation output
+    item_discrepancies: set = field(default_factory=set)
+    total_discrepancies: set = field(default_factory=set)
+    duplicate_lines: set = field(default_factory=set)
+    transact_only: set = field(default_factory=set)
+    docai_only: set = field(default_factory=set)
+
+    @property
+    def expected_item_pending(self):
+        """Invoices SP_RUN_ITEM_RECONCILIATION must leave Pending Review."""
+        return self.item_discrepancies | self.transact_only | self.docai_only
+
+    @property
+    def expected_total_pending(self):
+        """Invoices SP_RUN_TOTALS_RECONCILIATION must leave Pending Review."""
+        return self.total_discrepancies | self.transact_only | self.docai_only
+
+    def summary(self):
+        return {
+            "invoices": int(self.transact_totals["INVOICE_ID"].nunique() + len(self.docai_only)),
+            "transact_items": len(self.transact_items), "docai_items": len(self.docai_items),
+            "item_discrepancies": len(self.item_discrepancies), "total_discrepancies": len(self.total_discrepancies),
+            "duplicate_lines": len(self.duplicate_lines),
+            "transact_only": len(self.transact_only), "docai_only": len(self.docai_only),
+        }
+
+
+def _pick(rng, count, rate):
+    return rng.random(count) < rate
+
+
+def generate_chunk(items, first_invoice_id=FIRST_INVOICE_ID, max_lines=len(PRODUCTS), item_discrepancy_rate=0.05,
+                   total_discrepancy_rate=0.02, duplicate_rate=0.05, missing_rate=0.01, seed=0):
+    """
+    Generates one SyntheticDataset of `items` line items (before one-sided invoices are
+    dropped from the other side).
+
+    Invoices get 1..`max_lines` lines. The rates are per invoice: a planted item discrepancy
+    changes one field of one DocAI line, a totals discrepancy changes the DocAI tax and
+    total, a duplicate repeats the invoice's first product on its last line, and a missing
+    invoice is dropped from one side (DOCAI_* or TRANSACT_*, alternately).
+    """
+    if not 1 <= max_lines <= len(PRODUCTS):
+        raise ValueError(f"max_lines must be between 1 and {len(PRODUCTS)}")
+    rng = np.random.default_rng(seed)
+
+    line_counts = np.empty(0, dtype=np.int64)
+    while line_counts.sum() < items:
+        batch = max(16, int((items - line_counts.sum()) / ((max_lines + 1) / 2) * 1.1))
+        line_counts = np.concatenate((line_counts, rng.integers(1, max_lines + 1, size=batch)))
+    ends = np.cumsum(line_counts)
+    invoice_count = int(np.searchsorted(ends, items)) + 1
+    line_counts = line_counts[:invoice_count]
+    line_counts[-1] -= int(ends[invoice_count - 1] - items)
+    starts = np.concatenate(([0], np.cumsum(line_counts)[:-1]))
+
+    invoice_ids = (np.arange(invoice_count) + first_invoice_id).astype(str).astype(object)
+    invoice_of_line = np.repeat(np.arange(invoice_count), line_counts)
+    position = np.arange(items) - starts[invoice_of_line]
+
+    product_offset = rng.integers(0, len(PRODUCTS), size=invoice_count)
+    product_index = (product_offset[invoice_of_line] + position * _PRODUCT_STEP) % len(PRODUCTS)
+    duplicate = _pick(rng, invoice_count, duplicate_rate) & (line_counts >= 2)
+    last_lines = starts[duplicate] + line_counts[duplicate] - 1
+    product_index[last_lines] = product_index[starts[duplicate]]
+
+    quantity = rng.integers(1, 11, size=items).astype(float)
+    unit_price = np.round(rng.uniform(0.5, 50, size=items), 2)
+    total_price = np.round(quantity * unit_price, 2)
+
+    subtotal = np.round(np.bincount(invoice_of_line, weights=total_price, minlength=invoice_count), 2)
+    tax = np.round(subtotal * TAX_RATE, 2)
+    total = np.round(subtotal + tax, 2)
+    invoice_date = (np.datetime64("2025-01-01") + rng.integers(0, 365, size=invoice_count)).astype("datetime64[D]")
+
+    products = np.array(PRODUCTS, dtype=object)
+    transact_items = pd.DataFrame({
+        "INVOICE_ID": invoice_ids[invoice_of_line], "PRODUCT_NAME": products[product_index],
+        "QUANTITY": quantity, "UNIT_PRICE": unit_price, "TOTAL_PRICE": total_price,
+    })
+    transact_totals = pd.DataFrame({
+        "INVOICE_ID": invoice_ids, "INVOICE_DATE": invoice_date, "SUBTOTAL": subtotal, "TAX": tax, "TOTAL": total,
+    })
+    docai_items = transact_items.copy()
+    docai_totals = transact_totals.copy()
+
+    # One changed field on one line per planted invoice
+    item_discrepancy = _pick(rng, invoice_count, item_discrepancy_rate)
+    changed_lines = starts[item_discrepancy] + (rng.random(int(item_discrepancy.sum())) * line_counts[item_discrepancy]).astype(int)
+    changed_field = rng.integers(0, 3, size=len(changed_lines))
+    delta = np.round(rng.uniform(0.01, 5, size=len(changed_lines)), 2)
+    for field_no, column in enumerate(["QUANTITY", "UNIT_PRICE", "TOTAL_PRICE"]):
+        lines = changed_lines[changed_field == field_no]
+        docai_items.loc[lines, column] += 1 if column == "QUANTITY" else delta[changed_field == field_no]
+        docai_items[column] = docai_items[column].round(2)
+
+    total_discrepancy = _pick(rng, invoice_count, total_discrepancy_rate)
+    tax_delta = np.round(rng.uniform(0.01, 20, size=int(total_discrepancy.sum())), 2)
+    docai_totals.loc[total_discrepancy, "TAX"] = np.round(tax[total_discrepancy] + tax_delta, 2)
+    docai_totals.loc[total_discrepancy, "TOTAL"] = np.round(total[total_discrepancy] + tax_delta, 2)
+
+    missing = np.flatnonzero(_pick(rng, invoice_count, missing_rate))
+    transact_only, docai_only = set(invoice_ids[missing[0::2]]), set(invoice_ids[missing[1::2]])
+    if docai_only:
+        transact_items = transact_items[~transact_items["INVOICE_ID"].isin(docai_only)].reset_index(drop=True)
+        transact_totals = transact_totals[~transact_totals["INVOICE_ID"].isin(docai_only)].reset_index(drop=True)
+    if transact_only:
+        docai_items = docai_items[~docai_items["INVOICE_ID"].isin(transact_only)].reset_index(drop=True)
+        docai_totals = docai_totals[~docai_totals["INVOICE_ID"].isin(transact_only)].reset_index(drop=True)
+
+    docai_file_names = "Invoice_" + docai_totals["INVOICE_ID"] + ".pdf"
+    docai_totals["FILE_NAME"] = docai_file_names
+    docai_totals["FILE_SIZE"] = rng.integers(20_000, 200_000, size=len(docai_totals)).astype(float)
+    docai_totals["LAST_MODIFIED"] = pd.Timestamp("2025-06-01", tz="UTC")
+    docai_items = docai_items.merge(docai_totals[["INVOICE_ID"] + DOCAI_FILE_COLUMNS], on="INVOICE_ID", how="left")
+
+    one_sided = transact_only | docai_only
+    return SyntheticDataset(
+        transact_items, transact_totals, docai_items, docai_totals,
+        item_discrepancies=set(invoice_ids[item_discrepancy]) - one_sided,
+        total_discrepancies=set(invoice_ids[total_discrepancy]) - one_sided,
+        duplicate_lines=set(invoice_ids[duplicate]) - one_sided,
+        transact_only=transact_only,
+        docai_only=docai_only,
+    )
+
+
+def iter_chunks(items, chunk_items=DEFAULT_CHUNK_ITEMS, seed=0, **rates):
+    """Yields SyntheticDatasets of at most `chunk_items` line items, `items` in total, with disjoint invoice ids."""
+    first_invoice_id = FIRST_INVOICE_ID
+    for chunk_no, start in enumerate(range(0, items, chunk_items)):
+        chunk = generate_chunk(min(chunk_items, items - start), first_invoice_id, seed=seed + chunk_no, **rates)
+        first_invoice_id += len(chunk.transact_totals) + len(chunk.docai_only)
+        yield chunk
+
+
+def generate(items, seed=0, **rates):
+    """One in-memory SyntheticDataset of `items` line items."""
+    chunks = list(iter_chunks(items, seed=seed, **rates))
+    if len(chunks) == 1:
+        return chunks[0]
+    merged = SyntheticDataset(*(pd.concat([getattr(c, name) for c in chunks], ignore_index=True)
+                                for name in ["transact_items", "transact_totals", "docai_items", "docai_totals"]))
+    for name in ["item_discrepancies", "total_discrepancies", "duplicate_lines", "transact_only", "docai_only"]:
+        setattr(merged, name, set().union(*(getattr(c, name) for c in chunks)))
+    return merged
+
+
+def write_csv(chunks, directory):
+    """
+    Appends the chunks to TRANSACT_ITEMS.csv, TRANSACT_TOTALS.csv, DOCAI_INVOICE_ITEMS.csv and
+    DOCAI_INVOICE_TOTALS.csv under `directory` (headers included, ready for COPY INTO with
+    SKIP_HEADER = 1). Returns the combined summary.
+    """
+    os.makedirs(directory, exist_ok=True)
+    summary = {}
+    for chunk_no, chunk in enumerate(chunks):
+        for table, df in [("TRANSACT_ITEMS", chunk.transact_items), ("TRANSACT_TOTALS", chunk.transact_totals),
+                          ("DOCAI_INVOICE_ITEMS", chunk.docai_items), ("DOCAI_INVOICE_TOTALS", chunk.docai_totals)]:
+            df.to_csv(os.path.join(directory, f"{table}.csv"), mode="w" if chunk_no == 0 else "a", header=chunk_no == 0, index=False)
+        for key, value in chunk.summary().items():
+            summary[key] = summary.get(key, 0) + value
+    return summary
+
+
+def write_pdfs(dataset, directory, limit=None):
+    """Writes image-only PDFs of the DocAI side (what the document says) for up to `limit` invoices."""
+    from PIL import Image, ImageDraw, ImageFont
+
+    os.makedirs(directory, exist_ok=True)
+    font = ImageFont.load_default(size=26)
+    columns = [100, 560, 760, 980] # x of Item, Quantity, Price, Total
+    items_by_invoice = dict(tuple(dataset.docai_items.groupby("INVOICE_ID", sort=False)))
+    paths = []
+    for totals in dataset.docai_totals.head(limit).itertuples(index=False):
+        image = Image.new("L", (1240, 1754), 255) # A4 at 150 dpi
+        draw = ImageDraw.Draw(image)
+        rows = [[f"Invoice ID: #{totals.INVOICE_ID}"], [f"Date: {pd.Timestamp(totals.INVOICE_DATE):%Y-%m-%d}"], [],
+                ["Item", "Quantity", "Price", "Total"]]
+        for item in items_by_invoice[totals.INVOICE_ID].itertuples(index=False):
+            rows.append([item.PRODUCT_NAME, f"{item.QUANTITY:g}", f"${item.UNIT_PRICE:,.2f}", f"${item.TOTAL_PRICE:,.2f}"])
+        rows += [[], [f"Subtotal: ${totals.SUBTOTAL:,.2f}"], [f"Tax: ${totals.TAX:,.2f}"], [f"Grand Total: ${totals.TOTAL:,.2f}"]]
+        for row_no, cells in enumerate(rows):
+            for x, text in zip(columns, cells):
+                draw.text((x, 100 + row_no * 40), text, fill=0, font=font)
+        path = os.path.join(directory, totals.FILE_NAME)
+        image.save(path, format="PDF", resolution=150)
+        paths.append(path)
+    return paths
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--items", type=int, required=True, help="TRANSACT line items to generate")
+    parser.add_argument("--out", required=True, help="output directory")
+    parser.add_argument("--chunk-items", type=int, default=DEFAULT_CHUNK_ITEMS)
+    parser.add_argument("--item-discrepancy-rate", type=float, default=0.05)
+    parser.add_argument("--total-discrepancy-rate", type=float, default=0.02)
+    parser.add_argument("--duplicate-rate", type=float, default=0.05)
+    parser.add_argument("--missing-rate", type=float, default=0.01)
+    parser.add_argument("--pdfs", type=int, default=0, help="also write PDFs for the first N invoices")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    rates = {"item_discrepancy_rate": args.item_discrepancy_rate, "total_discrepancy_rate": args.total_discrepancy_rate,
+             "duplicate_rate": args.duplicate_rate, "missing_rate": args.missing_rate}
+    first_chunk = []
+
+    def chunks():
+        for chunk in iter_chunks(args.items, args.chunk_items, args.seed, **rates):
+            if not first_chunk:
+                first_chunk.append(chunk)
+            yield chunk
+
+    summary = write_csv(chunks(), args.out)
+    if args.pdfs:
+        write_pdfs(first_chunk[0], os.path.join(args.out, "pdfs"), args.pdfs)
+    print(summary)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,206 @@
+"""
+Bind-parameterized query templates for the app's queries and procedure calls.
+
+A template's SQL text depends only on identifiers (fully qualified table names) and the
+query's shape (which optional filters are present, page size), never on values: invoice
+ids, statuses, reviewer names, notes and prompts are always bound as `?` parameters. Every
+invoice therefore runs the same statement text, so Snowflake can reuse the compiled plan
+and serve repeated reads of unchanged tables from its result cache. Variable-length IN
+lists are padded with NULLs to a power-of-two number of binds (`in_list`), so a page of
+37 ids and a page of 50 compile to the same statement.
+
+Builder functions decorated with `@template(name)` return a QueryTemplate that is compiled
+once per process for each distinct set of arguments. Every execution is counted in
+TEMPLATE_STATS: executions, repeats of an identical (text, binds) pair and their latency,
+and - after `check_result_cache()` looks them up in QUERY_HISTORY_BY_SESSION - how many
+repeats were served from the result cache.
+"""
+import functools
+import threading
+import time
+from collections import OrderedDict, deque
+
+_SEEN_CAPACITY = 4096
+_PENDING_CAPACITY = 1000
+_MIN_IN_LIST = 4
+
+_compiled = {}
+_compiled_lock = threading.Lock()
+
+
+class QueryTemplate:
+    """Compiled statement text with `?` binds; executes through any session of the backend interface."""
+
+    def __init__(self, name, text):
+        self.name = name
+        self.text = text
+
+    def __repr__(self):
+        return f"QueryTemplate({self.name!r})"
+
+    def _execute(self, session, params, method):
+        params = list(params)
+        repeat = TEMPLATE_STATS.is_repeat(self, params)
+        start = time.perf_counter()
+        dataframe = session.sql(self.text, params=params) if params else session.sql(self.text)
+        if not repeat:
+            result = getattr(dataframe, method)()
+            TEMPLATE_STATS.record(self, time.perf_counter() - start, repeat=False)
+            return result
+        # Repeats keep their query ids so check_result_cache() can look them up later
+        with session.query_history() as history:
+            result = getattr(dataframe, method)()
+        TEMPLATE_STATS.record(self, time.perf_counter() - start, repeat=True, query_ids=[q.query_id for q in history.queries])
+        return result
+
+    def collect(self, session, params=()):
+        return self._execute(session, params, "collect")
+
+    def to_pandas(self, session, params=()):
+        return self._execute(session, params, "to_pandas")
+
+    def to_arrow(self, session, params=()):
+        return self._execute(session, params, "to_arrow")
+
+
+def template(name):
+    """Decorator for a function that builds SQL text from identifiers and shape flags only."""
+    def decorator(build):
+        @functools.wraps(build)
+        def compiled(*args):
+            key = (name, args)
+            with _compiled_lock:
+                query = _compiled.get(key)
+            if query is None:
+                query = QueryTemplate(name, " ".join(build(*args).split()))
+                with _compiled_lock:
+                    query = _compiled.setdefault(key, query)
+            return query
+        return compiled
+    return decorator
+
+
+def compiled_count():
+    with _compiled_lock:
+        return len(_compiled)
+
+
+def in_list_size(count):
+    """Number of binds for an IN list of `count` values: the next power of two, at least _MIN_IN_LIST."""
+    size = _MIN_IN_LIST
+    while size < count:
+        size *= 2
+    return size
+
+
+def in_list(values):
+    """(placeholders, binds) for `values`, padded with NULLs (never equal to anything) to in_list_size()."""
+    values = list(values)
+    size = in_list_size(len(values))
+    return ", ".join("?" for _ in range(size)), values + [None] * (size - len(values))
+
+
+class TemplateStats:
+    """Process-wide per-template execution counters, shared by all sessions."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._seen = OrderedDict() # (text, binds) of recent executions, LRU
+        self._pending = deque(maxlen=_PENDING_CAPACITY) # (template name, query id) of repeats not yet checked
+        self._stats = {}
+
+    def is_repeat(self, query, params):
+        key = (query.text, tuple(map(str, params)))
+        with self._lock:
+            if key in self._seen:
+                self._seen.move_to_end(key)
+                return True
+            self._seen[key] = None
+            if len(self._seen) > _SEEN_CAPACITY:
+                self._seen.popitem(last=False)
+            return False
+
+    def _entry(self, name):
+        return self._stats.setdefault(name, {
+            "template": name, "executions": 0, "repeats": 0, "first_seconds": 0.0, "repeat_seconds": 0.0,
+            "repeats_checked": 0, "result_cache_hits": 0,
+        })
+
+    def record(self, query, seconds, repeat, query_ids=()):
+        with self._lock:
+            entry = self._entry(query.name)
+            entry["executions"] += 1
+            if repeat:
+                entry["repeats"] += 1
+                entry["repeat_seconds"] += seconds
+                self._pending.extend((query.name, query_id) for query_id in query_ids)
+            else:
+                entry["first_seconds"] += seconds
+
+    def take_pending(self):
+        with self._lock:
+            pending = list(self._pending)
+            self._pending.clear()
+            return pending
+
+    def record_result_cache(self, name, checked, hits):
+        with self._lock:
+            entry = self._entry(name)
+            entry["repeats_checked"] += checked
+            entry["result_cache_hits"] += hits
+
+    def summary(self):
+        """One row per template: executions, repeats, mean first/repeat latency and result-cache hits, busiest first."""
+        with self._lock:
+            entries = [dict(entry) for entry in self._stats.values()]
+        rows = []
+        for entry in entries:
+            first = entry["executions"] - entry["repeats"]
+            rows.append({
+                "template": entry["template"], "executions": entry["executions"], "repeats": entry["repeats"],
+                "first_ms": round(entry["first_seconds"] / first * 1000, 2) if first else None,
+                "repeat_ms": round(entry["repeat_seconds"] / entry["repeats"] * 1000, 2) if entry["repeats"] else None,
+                "repeats_checked": entry["repeats_checked"], "result_cache_hits": entry["result_cache_hits"],
+            })
+        return sorted(rows, key=lambda row: row["executions"], reverse=True)
+
+    def clear(self):
+        with self._lock:
+            self._seen.clear()
+            self._pending.clear()
+            self._stats.clear()
+
+
+TEMPLATE_STATS = TemplateStats()
+
+
+# A reused result runs no warehouse work: nothing scanned and no execution time
+@template("result_cache_check")
+def _result_cache_check(database, id_count):
+    placeholders = ", ".join("?" for _ in range(id_count))
+    return f"""
+        SELECT query_id, bytes_scanned = 0 AND execution_time = 0 AS result_reused
+        FROM TABLE({database}.INFORMATION_SCHEMA.QUERY_HISTORY_BY_SESSION(RESULT_LIMIT => 10000))
+        WHERE query_id IN ({placeholders})
+    """
+
+
+def check_result_cache(session, database, stats=TEMPLATE_STATS):
+    """
+    Looks up the repeats executed since the last check in QUERY_HISTORY_BY_SESSION and adds
+    how many were served from the result cache to `stats`. Returns (checked, hits).
+    """
+    pending = stats.take_pending()
+    if not pending:
+        return 0, 0
+    _, params = in_list([query_id for _, query_id in pending])
+    rows = session.sql(_result_cache_check(database, len(params)).text, params=params).collect()
+    reused = {row["QUERY_ID"]: bool(row["RESULT_REUSED"]) for row in rows}
+    totals = {}
+    for name, query_id in pending:
+        if query_id in reused:
+            checked, hits = totals.get(name, (0, 0))
+            totals[name] = (checked + 1, hits + reused[query_id])
+    for name, (checked, hits) in totals.items():
+        stats.record_result_cache(name, checked, hits)
+    return sum(c for c, _ in totals.values()), sum(h for _, h in totals.values())
@@ -0,0 +1,32 @@
+"""
+Per-rerun timing of the app's UI sections.
+
+Each section records its wall time and the number of warehouse queries issued on the
+session while it ran (Snowpark query history), so a rerun can be checked for work it
+should not do, e.g. a PDF page flip must issue zero queries. Queries started by
+background prefetch threads during a section are counted against that section.
+"""
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+
+
+@dataclass
+class SectionTiming:
+    section: str
+    seconds: float
+    queries: int
+
+    def caption(self):
+        return f"⏱️ {self.section}: {self.seconds * 1000:.0f} ms, {self.queries} quer{'y' if self.queries == 1 else 'ies'}"
+
+
+@contextmanager
+def timed_section(session, section, timings):
+    """Records a SectionTiming for the enclosed block into `timings[section]`."""
+    start = time.perf_counter()
+    with session.query_history() as history:
+        try:
+            yield
+        finally:
+            timings[section] = SectionTiming(section, time.perf_counter() - start, len(history.queries))
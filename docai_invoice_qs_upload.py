@@ -0,0 +1,167 @@
+"""
+Batched, concurrent upload of documents to the DocAI stage.
+
+Files are PUT through a bounded thread pool with per-file retry/backoff and the
+stage directory is refreshed once per batch instead of once per file. Files whose
+content hash is already in DOCAI_DOCUMENT_HASHES are skipped entirely.
+"""
+import hashlib
+import io
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+
+from docai_invoice_qs_templates import in_list, in_list_size, template
+
+DEFAULT_MAX_WORKERS = 8
+DEFAULT_MAX_ATTEMPTS = 3
+DEFAULT_BACKOFF_SECONDS = 0.5
+
+
+@dataclass
+class UploadResult:
+    file_name: str
+    size_bytes: int
+    ok: bool
+    attempts: int
+    seconds: float
+    error: str = ""
+
+
+@dataclass
+class BatchSummary:
+    results: list
+    seconds: float
+    refreshed: bool
+
+    @property
+    def uploaded(self):
+        return [r for r in self.results if r.ok]
+
+    @property
+    def failed(self):
+        return [r for r in self.results if not r.ok]
+
+    @property
+    def bytes_uploaded(self):
+        return sum(r.size_bytes for r in self.uploaded)
+
+    @property
+    def files_per_second(self):
+        return len(self.uploaded) / self.seconds if self.seconds else 0.0
+
+    @property
+    def mb_per_second(self):
+        return self.bytes_uploaded / 1e6 / self.seconds if self.seconds else 0.0
+
+
+@template("known_hashes")
+def _known_hashes_sql(hash_table, hash_count):
+    placeholders = ", ".join("?" for _ in range(hash_count))
+    return f"SELECT content_hash FROM {hash_table} WHERE content_hash IN ({placeholders})"
+
+
+@template("record_duplicates")
+def _record_duplicates_sql(hash_table, row_count):
+    values = ", ".join("(?, ?)" for _ in range(row_count))
+    return f"""
+        UPDATE {hash_table} h
+        SET duplicate_count = h.duplicate_count + d.uploads
+        FROM (SELECT column1 AS content_hash, column2 AS uploads FROM VALUES {values}) d
+        WHERE h.content_hash = d.content_hash
+    """
+
+
+@template("stage_refresh")
+def _stage_refresh_sql(stage_name):
+    return f"ALTER STAGE {stage_name} REFRESH"
+
+
+def content_hash(file_bytes):
+    """MD5 hex digest, matching the MD5 column of the stage directory / INVOICE_STREAM."""
+    return hashlib.md5(file_bytes).hexdigest()
+
+
+def split_extracted_documents(session, hash_table, files):
+    """
+    Splits `files` (an iterable of (file_name, file_bytes)) into (new_files, duplicates).
+
+    A duplicate is a file whose bytes were already extracted by DOCAI_EXTRACT, or an
+    identical copy of an earlier file in the same batch. Duplicates are returned as
+    (file_name, content_hash) pairs. One query checks the whole batch.
+    """
+    hashed = [(name, data, content_hash(data)) for name, data in files]
+    if not hashed:
+        return [], []
+    _, params = in_list(sorted({h for _, _, h in hashed}))
+    rows = _known_hashes_sql(hash_table, len(params)).collect(session, params)
+    seen = {row["CONTENT_HASH"] for row in rows}
+
+    new_files, duplicates = [], []
+    for name, data, digest in hashed:
+        if digest in seen:
+            duplicates.append((name, digest))
+        else:
+            seen.add(digest)
+            new_files.append((name, data))
+    return new_files, duplicates
+
+
+def record_duplicates(session, hash_table, duplicates):
+    """Adds skipped uploads to DOCAI_DOCUMENT_HASHES.duplicate_count (PREDICT calls avoided)."""
+    counts = {}
+    for _, digest in duplicates:
+        counts[digest] = counts.get(digest, 0) + 1
+    if not counts:
+        return
+    # Padding rows (NULL, 0) match no hash
+    row_count = in_list_size(len(counts))
+    params = [value for digest, count in counts.items() for value in (digest, count)] + [None, 0] * (row_count - len(counts))
+    _record_duplicates_sql(hash_table, row_count).collect(session, params)
+
+
+def put_with_retry(session, stage_location, file_name, file_bytes,
+                   max_attempts=DEFAULT_MAX_ATTEMPTS, backoff_seconds=DEFAULT_BACKOFF_SECONDS):
+    """PUTs one file, retrying failures with exponential backoff and jitter."""
+    start = time.perf_counter()
+    error = ""
+    for attempt in range(1, max_attempts + 1):
+        try:
+            session.file.put_stream(io.BytesIO(file_bytes), f"{stage_location}/{file_name}", overwrite=True, auto_compress=False)
+            return UploadResult(file_name, len(file_bytes), True, attempt, time.perf_counter() - start)
+        except Exception as e:
+            error = str(e)
+            if attempt < max_attempts:
+                time.sleep(backoff_seconds * (2 ** (attempt - 1)) * (1 + random.random()))
+    return UploadResult(file_name, len(file_bytes), False, max_attempts, time.perf_counter() - start, error)
+
+
+def upload_batch(session, stage_name, files, max_workers=DEFAULT_MAX_WORKERS,
+                 max_attempts=DEFAULT_MAX_ATTEMPTS, backoff_seconds=DEFAULT_BACKOFF_SECONDS, on_progress=None):
+    """
+    Uploads `files` (an iterable of (file_name, file_bytes)) to `@stage_name` concurrently.
+
+    `on_progress(done, total, result)` is called from the calling thread as each file
+    finishes. The stage directory is refreshed once, after all PUTs, if any succeeded.
+    """
+    files = list(files)
+    stage_location = f"@{stage_name}"
+    results = []
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(files) or 1))) as pool:
+        futures = [
+            pool.submit(put_with_retry, session, stage_location, name, data, max_attempts, backoff_seconds)
+            for name, data in files
+        ]
+        for future in as_completed(futures):
+            result = future.result()
+            results.append(result)
+            if on_progress:
+                on_progress(len(results), len(files), result)
+
+    refreshed = False
+    if any(r.ok for r in results):
+        _stage_refresh_sql(stage_name).collect(session)
+        refreshed = True
+    return BatchSummary(results, time.perf_counter() - start, refreshed)
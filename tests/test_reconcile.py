@@ -0,0 +1,145 @@
+"""Parity tests of docai_invoice_qs_reconcile against the seed data and small crafted frames."""
+import pandas as pd
+import pytest
+
+import docai_invoice_qs_reconcile as reconcile
+
+RUN = "2025-05-01 00:00:00"
+EARLIER = "2025-04-01 00:00:00"
+
+
+def items(*rows):
+    return pd.DataFrame(rows, columns=reconcile.ITEM_COLUMNS)
+
+
+def results(*rows):
+    return pd.DataFrame(rows, columns=reconcile.RESULT_COLUMNS)
+
+
+def source(*rows):
+    return pd.DataFrame(rows, columns=["invoice_id", "item_mismatch_details", "review_status"])
+
+
+@pytest.fixture(scope="module")
+def seed():
+    return reconcile.seed_frames()
+
+
+# --- Seed data ---
+
+def test_seed_parity():
+    assert reconcile.check_seed_parity() == []
+
+
+def test_seed_statuses(seed):
+    transact_items, docai_items, transact_totals, docai_totals = seed
+    item_source = reconcile.reconcile_items(transact_items, docai_items).set_index("invoice_id")
+    total_source = reconcile.reconcile_totals(transact_totals, docai_totals).set_index("invoice_id")
+    assert set(item_source.index[item_source["review_status"] == reconcile.PENDING_REVIEW]) == set(reconcile.EXPECTED_SEED_ITEM_DETAILS)
+    assert set(total_source.index[total_source["review_status"] == reconcile.PENDING_REVIEW]) == set(reconcile.EXPECTED_SEED_TOTAL_DETAILS)
+    assert (item_source.loc[item_source["item_mismatch_details"] == "", "review_status"] == reconcile.AUTO_RECONCILED).all()
+
+
+def test_seed_gold_eligibility(seed):
+    transact_items, docai_items, _, _ = seed
+    merged = reconcile.merge_results(None, reconcile.reconcile_items(transact_items, docai_items), RUN)
+    promoted = set(reconcile.ready_for_gold(merged, RUN))
+    assert promoted == set(transact_items["invoice_id"]) - set(reconcile.EXPECTED_SEED_ITEM_DETAILS)
+    # Gold already holding the bronze rows is not rewritten; a changed line is
+    gold = transact_items[transact_items["invoice_id"].isin(promoted)].copy()
+    assert reconcile.gold_up_to_date(transact_items, gold, reconcile.ITEM_COLUMNS, promoted) == promoted
+    gold.loc[gold["invoice_id"] == "2001", "quantity"] += 1
+    assert "2001" not in reconcile.gold_up_to_date(transact_items, gold, reconcile.ITEM_COLUMNS, promoted)
+
+
+def test_seed_partitioned_matches_in_memory(seed):
+    transact_items, docai_items, _, _ = seed
+    expected = reconcile.reconcile_items(transact_items, docai_items)
+    chunks = lambda df: [df.iloc[start:start + 7] for start in range(0, len(df), 7)]
+    parts = list(reconcile.reconcile_partitioned(reconcile.reconcile_items, chunks(transact_items), chunks(docai_items),
+                                                 reconcile.ITEM_COLUMNS, num_partitions=4))
+    assert len(parts) > 1
+    got = pd.concat(parts, ignore_index=True).sort_values("invoice_id", kind="mergesort").reset_index(drop=True)
+    pd.testing.assert_frame_equal(got, expected, check_dtype=False)
+
+
+# --- Status transitions of the results MERGE ---
+
+def test_merge_inserts_new_invoices():
+    merged = reconcile.merge_results(None, source(("1", "", reconcile.AUTO_RECONCILED), ("2", "x: Qty_Diff(1.00 vs 2.00);", reconcile.PENDING_REVIEW)), RUN)
+    assert merged.set_index("invoice_id")["review_status"].to_dict() == {"1": reconcile.AUTO_RECONCILED, "2": reconcile.PENDING_REVIEW}
+    assert (merged["last_reconciled_timestamp"] == RUN).all()
+
+
+def test_merge_keeps_reviewed_while_still_differing():
+    target = results(("1", "old", reconcile.REVIEWED, EARLIER, "bob", EARLIER, "checked"))
+    merged = reconcile.merge_results(target, source(("1", "new", reconcile.PENDING_REVIEW)), RUN).iloc[0]
+    assert (merged["review_status"], merged["reviewed_by"], merged["notes"]) == (reconcile.REVIEWED, "bob", "checked")
+    assert (merged["item_mismatch_details"], merged["last_reconciled_timestamp"]) == ("new", RUN)
+
+
+def test_merge_pending_becomes_auto_reconciled():
+    target = results(("1", "x: Qty_Diff(1.00 vs 2.00);", reconcile.PENDING_REVIEW, EARLIER, None, None, None))
+    merged = reconcile.merge_results(target, source(("1", "", reconcile.AUTO_RECONCILED)), RUN)
+    assert merged.iloc[0]["review_status"] == reconcile.AUTO_RECONCILED
+    assert reconcile.ready_for_gold(merged, RUN) == ["1"]
+
+
+def test_merge_reviewed_becomes_auto_reconciled_keeping_review_fields():
+    target = results(("1", "old", reconcile.REVIEWED, EARLIER, "bob", EARLIER, "checked"))
+    merged = reconcile.merge_results(target, source(("1", "", reconcile.AUTO_RECONCILED)), RUN).iloc[0]
+    assert (merged["review_status"], merged["reviewed_by"]) == (reconcile.AUTO_RECONCILED, "bob")
+
+
+def test_merge_clears_review_fields_of_new_discrepancy():
+    target = results(("1", "", reconcile.AUTO_RECONCILED, EARLIER, "x", EARLIER, "n"))
+    merged = reconcile.merge_results(target, source(("1", "d", reconcile.PENDING_REVIEW)), RUN).iloc[0]
+    assert merged["review_status"] == reconcile.PENDING_REVIEW
+    assert merged[["reviewed_by", "reviewed_timestamp", "notes"]].isna().all()
+
+
+def test_merge_leaves_out_of_scope_rows_untouched():
+    target = results(("1", "", reconcile.AUTO_RECONCILED, EARLIER, None, None, None),
+                     ("2", "d", reconcile.PENDING_REVIEW, EARLIER, None, None, None))
+    merged = reconcile.merge_results(target, source(("2", "", reconcile.AUTO_RECONCILED)), RUN).set_index("invoice_id")
+    assert merged.loc["1", "last_reconciled_timestamp"] == EARLIER
+    assert reconcile.ready_for_gold(merged.reset_index(), RUN) == ["2"]
+
+
+# --- Line matching ---
+
+def test_duplicate_lines_match_by_occurrence():
+    a = items(("1", "Milk", 2, 1.00, 2.00), ("1", "Milk", 1, 1.00, 1.00))
+    b = items(("1", "Milk", 1, 1.00, 1.00), ("1", "Milk", 3, 1.00, 3.00))
+    out = reconcile.reconcile_items(a, b).iloc[0]
+    assert out["item_mismatch_details"] == "Milk: Qty_Diff(2.00 vs 3.00); Total_Price_Diff(2.00 vs 3.00);"
+    assert out["review_status"] == reconcile.PENDING_REVIEW
+
+
+def test_extra_duplicate_line_is_one_sided():
+    a = items(("1", "Milk", 1, 1.00, 1.00))
+    b = items(("1", "Milk", 1, 1.00, 1.00), ("1", "Milk", 1, 1.00, 1.00))
+    assert reconcile.reconcile_items(a, b).iloc[0]["item_mismatch_details"] == "Milk: In Table B Only"
+
+
+def test_null_value_is_not_a_difference():
+    a = items(("1", "Milk", 1, 1.00, 1.00))
+    b = items(("1", "Milk", None, 1.00, 1.00))
+    out = reconcile.reconcile_items(a, b).iloc[0]
+    assert (out["item_mismatch_details"], out["review_status"]) == ("", reconcile.AUTO_RECONCILED)
+
+
+def test_null_product_name_never_matches_and_stays_visible():
+    a = items(("1", "Milk", 1, 1.00, 1.00))
+    b = items(("1", None, 1, 1.00, 1.00))
+    out = reconcile.reconcile_items(a, b).iloc[0]
+    assert out["item_mismatch_details"] == "(unnamed line 1): In Table B Only; Milk: In Table A Only"
+    assert out["review_status"] == reconcile.PENDING_REVIEW
+    assert reconcile.ready_for_gold(reconcile.merge_results(None, reconcile.reconcile_items(a, b), RUN), RUN) == []
+
+
+def test_missing_totals_invoice_is_pending():
+    a = pd.DataFrame([("1", "2025-04-01", 10.0, 1.0, 11.0)], columns=reconcile.TOTAL_COLUMNS)
+    b = a.iloc[0:0]
+    out = reconcile.reconcile_totals(a, b).iloc[0]
+    assert (out["item_mismatch_details"], out["review_status"]) == ("1: In Table A Only", reconcile.PENDING_REVIEW)